@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
+# coroutine views, see AsyncAPIView
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
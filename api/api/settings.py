@@ -51,6 +51,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'appapi.throttling.ThrottleMiddleware',
+    'appapi.routers.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'api.urls'
@@ -73,17 +75,95 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'api.wsgi.application'
 
+# ASGI deployment: serve api.asgi:application with an ASGI server instead,
+# e.g. `uvicorn api.asgi:application --workers 4` or gunicorn with
+# `-k uvicorn.workers.UvicornWorker`. api/asgi.py sets ASYNC_VIEWS=1, which
+# turns the read handlers of AsyncAPIView views (appapi/views.py) into
+# coroutines: they wait on the database and disk without holding a
+# thread, and video streams are read block by block from an async
+# iterator, so slow clients cost a coroutine rather than a worker.
+# Synchronous code (DRF's checks, the ORM underneath, write endpoints)
+# still runs on threads; ASGI_THREADS bounds the shared pool. Under WSGI
+# the views stay synchronous and videos keep sendfile.
+ASGI_APPLICATION = 'api.asgi.application'
+
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql selects PostgreSQL (DB_NAME, DB_USER, DB_PASSWORD,
+# DB_HOST, DB_PORT); otherwise SQLite at DB_NAME, by default db.sqlite3.
+# Connections are kept for DB_CONN_MAX_AGE seconds and checked before
+# reuse; DB_POOL_SIZE > 0 uses a psycopg pool per process instead.
+# Setting DB_REPLICA_NAME (and DB_REPLICA_HOST) adds a read replica that
+# GET requests read from, see appapi/routers.py.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+# SQLITE_TUNING=0 keeps SQLite's defaults. Tuned, readers no longer block
+# the writer (WAL), commits skip the fsync per transaction (synchronous=
+# NORMAL is still crash-safe in WAL mode), a locked database is retried for
+# busy_timeout ms, and write transactions take the lock at BEGIN, so two
+# read-then-write transactions wait for each other instead of one failing
+# with "database is locked".
+SQLITE_TUNED_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA busy_timeout=5000;'
+        'PRAGMA mmap_size=268435456;'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+}
+
+
+def database(name, host=None):
+    config = {
+        'NAME': name,
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
+    if DB_ENGINE == 'postgresql':
+        config.update({
+            'ENGINE': 'django.db.backends.postgresql',
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': host or '',
+            'PORT': os.environ.get('DB_PORT', ''),
+        })
+        pool_size = int(os.environ.get('DB_POOL_SIZE', 0))
+        if pool_size:
+            # pooled connections are returned to the pool, not kept per thread
+            config['CONN_MAX_AGE'] = 0
+            config['OPTIONS'] = {'pool': {'min_size': 1, 'max_size': pool_size}}
+    else:
+        config['ENGINE'] = 'django.db.backends.sqlite3'
+        if os.environ.get('SQLITE_TUNING', '1') != '0':
+            config['OPTIONS'] = dict(SQLITE_TUNED_OPTIONS)
+    return config
+
+
+DATABASES = {
+    'default': database(os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'), os.environ.get('DB_HOST')),
 }
 
+# Read replica alias, or None to read from the primary
+DATABASE_REPLICA = None
+if os.environ.get('DB_REPLICA_NAME'):
+    DATABASE_REPLICA = 'replica'
+    DATABASES[DATABASE_REPLICA] = dict(
+        database(os.environ['DB_REPLICA_NAME'], os.environ.get('DB_REPLICA_HOST')),
+        TEST={'MIRROR': 'default'},
+    )
+
+DATABASE_ROUTERS = ['appapi.routers.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after a write of theirs; an
+# upper bound on replication lag
+DATABASE_REPLICA_PIN = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -130,6 +210,141 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
 
+# Response cache for read endpoints (see appapi/cache.py). Set
+# API_CACHE_BACKEND=file to share cached responses between processes
+# through the LRU file-based stand-in instead of per-process memory.
+# Cache versions and replica pins always live in a store every process
+# shares, the files under API_VERSIONS_DIR by default; point 'api_versions'
+# at memcached or Redis when workers run on more than one host.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'api_versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('API_VERSIONS_DIR', '/var/tmp/videosharing-api-versions'),
+        'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_FREQUENCY': 10},
+    },
+}
+if os.environ.get('API_CACHE_BACKEND') == 'file':
+    CACHES['api'] = {
+        'BACKEND': 'appapi.cache.LRUFileBasedCache',
+        'LOCATION': os.environ.get('API_CACHE_DIR', '/var/tmp/videosharing-api-cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000, 'CULL_FREQUENCY': 4},
+    }
+
+API_CACHE = {
+    'ALIAS': 'api',
+    'VERSIONS': 'api_versions',
+    # seconds; version bumps make invalidation immediate, TTLs bound memory
+    'TIMEOUTS': {
+        'detail': 300,
+        'list': 60,
+    },
+}
+
+# How /api/videos/<pk>/stream/ sends file bytes: None streams from Django,
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) hand the
+# transfer to the front proxy. For nginx, map the prefix to MEDIA_ROOT in
+# an `internal` location.
+VIDEO_STREAM_OFFLOAD = None
+VIDEO_STREAM_ACCEL_PREFIX = '/protected-media/'
+
+# Resumable uploads (see appapi/uploads.py): the largest total_size a
+# session may declare, in bytes, and how long a session may sit idle, in
+# seconds, before `manage.py expire_uploads` deletes it and its partial file.
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 5 * 1024 ** 3))
+UPLOAD_SESSION_TTL = 24 * 3600
+
+# Creators with more subscribers than this are not copied into each
+# subscriber's timeline on upload; their videos are merged in at read time.
+FEED_FANOUT_LIMIT = 5000
+# How many of a creator's recent videos a new subscriber's timeline receives.
+FEED_BACKFILL = 20
+
+# How deep comment replies may nest; each level takes 11 characters of
+# Comment.path (max_length 255).
+COMMENT_MAX_DEPTH = 8
+
+# Batch write endpoints (/api/comments/bulk/, /api/subscriptions/bulk/):
+# the most items one request may carry, and how long an Idempotency-Key
+# and its stored response are kept, in seconds.
+BULK_WRITE_MAX_ITEMS = 10000
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+
+# HLS packaging (see appapi/hls.py): segment length in seconds and the
+# (name, height, bits/s) renditions ffmpeg produces, highest first. Rungs
+# taller than the source are skipped.
+HLS = {
+    'SEGMENT_DURATION': 6,
+    'LADDER': [
+        ('1080p', 1080, 5000000),
+        ('720p', 720, 2800000),
+        ('480p', 480, 1400000),
+        ('360p', 360, 800000),
+    ],
+}
+
+# Post image derivatives (see appapi/images.py): named widths in pixels,
+# encoder quality per format, and the disk budget for generated files.
+IMAGE_DERIVATIVES = {
+    'SIZES': {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280},
+    'QUALITY': {'webp': 80, 'jpeg': 82},
+    'MAX_BYTES': 256 * 1024 * 1024,
+}
+
+# View beacons (see appapi/analytics.py): where they are logged until
+# `manage.py flush_views` adds them to the hourly rollups, how many one
+# request may carry, the longest watch time one beacon may report, the
+# default window of /api/videos/trending/ in hours and how many views of
+# one video a viewer (user, or address when anonymous) counts per hour.
+VIEW_EVENTS = {
+    'LOG_DIR': os.environ.get('VIEW_EVENTS_DIR', '/var/tmp/videosharing-views'),
+    'MAX_BATCH': 1000,
+    'MAX_SECONDS': 24 * 3600,
+    'TRENDING_HOURS': 24,
+    'MAX_VIEWS_PER_HOUR': 10,
+}
+
+# Trending scores and recommendations (see appapi/ranking.py), recomputed
+# every INTERVAL seconds by the rank_videos job. Engagement halves in
+# weight every HALF_LIFE_HOURS; views count from the last
+# VIEW_WINDOW_HOURS of rollups. MAX_RANKED videos are kept in the trending
+# ranking. Similarity is computed over the MAX_CREATORS most followed
+# creators, sampling at most MAX_SUBSCRIPTIONS_PER_USER per user; each
+# user gets RECOMMENDATIONS videos, the best VIDEOS_PER_CREATOR of each of
+# their CANDIDATE_CREATORS most similar creators.
+RANKING = {
+    'INTERVAL': 900,
+    'HALF_LIFE_HOURS': 24,
+    'VIEW_WINDOW_HOURS': 7 * 24,
+    'WEIGHTS': {'views': 1.0, 'comments': 5.0, 'subscriptions': 2.0},
+    'MAX_RANKED': 10000,
+    'MAX_CREATORS': 2000,
+    'MAX_SUBSCRIPTIONS_PER_USER': 200,
+    'CANDIDATE_CREATORS': 20,
+    'VIDEOS_PER_CREATOR': 5,
+    'RECOMMENDATIONS': 50,
+}
+
+# Background job queue (see appapi/jobs.py). LEASE is how long a running
+# job's lease lasts; its worker renews it every LEASE / 3 seconds, so only
+# a job whose worker died is taken over by another once it runs out;
+# retries wait BACKOFF * 2**(attempt - 1) seconds, up to MAX_BACKOFF.
+JOBS = {
+    'WORKERS': 2,
+    'POLL_INTERVAL': 1.0,
+    'LEASE': 600,
+    'BACKOFF': 10,
+    'MAX_BACKOFF': 3600,
+    'MAX_ATTEMPTS': 5,
+}
+
 
 
 
@@ -137,17 +352,64 @@ REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
         
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'appapi.authentication.ClaimsJWTAuthentication',
         
-    )
+    ),
+
+    'DEFAULT_THROTTLE_CLASSES': (
+        'appapi.throttling.TokenBucketThrottle',
+        'appapi.throttling.ConcurrencyThrottle',
+    ),
+
+    # orjson-backed when installed, see appapi/fastjson.py
+    'DEFAULT_RENDERER_CLASSES': (
+        'appapi.fastjson.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+
+    'DEFAULT_PARSER_CLASSES': (
+        'appapi.fastjson.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 
 }
 
+# Request admission control (see appapi/throttling.py). Each scope is a
+# token bucket of N requests refilled at N per period, per user (per
+# address when anonymous); views pick scopes per method with
+# `throttle_scopes`. CONCURRENCY caps a user's in-flight requests in a
+# scope. Set THROTTLE_STORE=sqlite to share buckets between processes
+# through the SQLite file at PATH instead of per-process memory.
+# Anonymous clients are keyed on REMOTE_ADDR; behind reverse proxies set
+# THROTTLE_NUM_PROXIES to how many of them append to X-Forwarded-For, or
+# any client can pick its own address by sending the header.
+THROTTLE = {
+    'STORE': os.environ.get('THROTTLE_STORE', 'local'),
+    'PATH': os.environ.get('THROTTLE_PATH', '/var/tmp/videosharing-throttle.sqlite3'),
+    'RATES': {
+        'read': '1200/min',
+        'write': '300/min',
+        'comment': '60/min',
+        'upload': '30/hour',
+        'chunk': '600/min',
+        'auth': '20/min',
+        'beacon': '30/min',
+    },
+    'CONCURRENCY': {
+        'upload': 2,
+        'chunk': 4,
+    },
+    # seconds before a slot held by a crashed process frees itself
+    'LEASE': 600,
+    'NUM_PROXIES': int(os.environ.get('THROTTLE_NUM_PROXIES', 0)),
+}
 
 
-from datetime import timedelta
 
+from datetime import timedelta
 
+SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
     "ROTATE_REFRESH_TOKENS": False,
@@ -171,7 +433,7 @@ from datetime import timedelta
 
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
-    "TOKEN_USER_CLASS": "rest_framework_simplejwt.models.TokenUser",
+    "TOKEN_USER_CLASS": "appapi.authentication.ClaimsUser",
 
     "JTI_CLAIM": "jti",
 
@@ -179,10 +441,14 @@ from datetime import timedelta
     "SLIDING_TOKEN_LIFETIME": timedelta(days=1),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
-    "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_OBTAIN_SERIALIZER": "appapi.serializers.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "appapi.serializers.ClaimsTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",
-}
\ No newline at end of file
+}
+
+# How long a user's active flag and token revocation cutoff are cached;
+# a deactivation or POST /api/token/revoke/ reaches other processes within it
+TOKEN_REVOCATION_CACHE_TTL = 30
@@ -8,3 +8,6 @@ admin.site.register(Video)
 admin.site.register(Post)
 admin.site.register(Comment)
 admin.site.register(Subscription)
+admin.site.register(Profile)
+admin.site.register(Rendition)
+admin.site.register(Job)
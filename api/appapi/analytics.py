@@ -0,0 +1,210 @@
+"""
+View and watch-time analytics.
+
+Players POST view beacons in batches to /api/views/. A request never
+touches the database: its beacons are summed per (video, hour) and
+appended as one write to a log file shared by every process on the node.
+`manage.py flush_views`, run every minute or so, rotates the log, sums it
+and adds the totals to ViewRollup rows (one per video per hour) and to
+Video.view_count with batched upserts, so the database sees a handful of
+statements per flush however many views arrived.
+
+Beacons are open to anonymous players, so each viewer (user, or client
+address) is counted at most VIEW_EVENTS['MAX_VIEWS_PER_HOUR'] times per
+video per rolling hour, through a token bucket in the throttle store;
+beacons over the cap are dropped like invalid ones.
+
+Writers hold a shared flock while appending and re-check that the path
+still names the file they opened; the flusher renames the log away and
+takes an exclusive lock before reading it, so no append lands in a file
+that has already been read. Delivery into the rollups is at least once:
+a flush that dies between committing and deleting its file is counted
+again by the next one.
+"""
+
+import datetime
+import fcntl
+import os
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from . import cache, counters, throttling
+from .models import Video, ViewRollup
+
+LOG_NAME = 'views.log'
+VIDEO_BATCH_SIZE = 500
+
+
+def option(name):
+    defaults = {
+        'LOG_DIR': '/var/tmp/videosharing-views',
+        'MAX_BATCH': 1000,
+        'MAX_SECONDS': 24 * 3600,
+        'TRENDING_HOURS': 24,
+        'MAX_VIEWS_PER_HOUR': 10,
+    }
+    return getattr(settings, 'VIEW_EVENTS', {}).get(name, defaults[name])
+
+
+def log_path():
+    return os.path.join(option('LOG_DIR'), LOG_NAME)
+
+
+def parse(beacons, viewer=None):
+    """
+    Sum valid beacons, {"video": id, "seconds": watched}, per (video, hour).
+    Returns (totals, rejected) where totals maps (video_id, hour) to
+    [views, seconds]. The hour is the server's, not the client's. With
+    `viewer`, beacons over that viewer's per-video cap are rejected too.
+    """
+    now = time.time()
+    hour = int(now) // 3600 * 3600
+    max_seconds = option('MAX_SECONDS')
+    cap = option('MAX_VIEWS_PER_HOUR') if viewer else None
+    store = throttling.get_store()
+    totals, rejected, capped = {}, 0, set()
+    for beacon in beacons:
+        try:
+            video_id, seconds = beacon['video'], beacon.get('seconds', 0)
+            valid = (
+                type(video_id) is int and video_id > 0
+                and type(seconds) in (int, float) and 0 <= seconds <= max_seconds
+            )
+        except (TypeError, KeyError, AttributeError):
+            valid = False
+        if valid and cap is not None:
+            if video_id not in capped and not store.take(f'views:{viewer}:{video_id}', cap, cap / 3600, now)[0]:
+                capped.add(video_id)
+            valid = video_id not in capped
+        if not valid:
+            rejected += 1
+            continue
+        total = totals.get((video_id, hour))
+        if total is None:
+            totals[(video_id, hour)] = [1, seconds]
+        else:
+            total[0] += 1
+            total[1] += seconds
+    return totals, rejected
+
+
+def record(totals):
+    """Append `totals` from parse() to the log in one write."""
+    if not totals:
+        return
+    data = ''.join(f'{video_id} {hour} {views} {seconds:.3f}\n' for (video_id, hour), (views, seconds) in totals.items())
+    _append(data.encode())
+
+
+def _append(data):
+    path = log_path()
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(fd).st_ino:
+                # flushed while we waited for the lock; write to the new log
+                continue
+            os.write(fd, data)
+            return
+        finally:
+            os.close(fd)
+
+
+def _rotate():
+    """Move the live log aside and return the paths of every log awaiting a flush."""
+    directory = option('LOG_DIR')
+    if os.path.exists(log_path()):
+        os.rename(log_path(), os.path.join(directory, f'{LOG_NAME}.{time.time_ns()}'))
+    if not os.path.isdir(directory):
+        return []
+    # including files left behind by a flush that did not finish
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(f'{LOG_NAME}.')
+    )
+
+
+def _read(path):
+    totals = {}
+    with open(path, 'rb') as log:
+        # wait for writers that opened the file before it was renamed
+        fcntl.flock(log.fileno(), fcntl.LOCK_EX)
+        for line in log:
+            try:
+                video_id, hour, views, seconds = line.split()
+                key = (int(video_id), int(hour))
+                views, seconds = int(views), float(seconds)
+            except ValueError:
+                continue  # a torn line from a crashed writer
+            total = totals.setdefault(key, [0, 0.0])
+            total[0] += views
+            total[1] += seconds
+    return totals
+
+
+def flush():
+    """Add every logged view to the rollups and view counts. Returns (views, rollup rows)."""
+    paths = _rotate()
+    totals = {}
+    for path in paths:
+        for key, (views, seconds) in _read(path).items():
+            total = totals.setdefault(key, [0, 0.0])
+            total[0] += views
+            total[1] += seconds
+
+    # beacons are not checked against the database when they arrive
+    video_ids = list({video_id for video_id, _ in totals})
+    existing = set()
+    for start in range(0, len(video_ids), VIDEO_BATCH_SIZE):
+        existing.update(Video.objects.filter(pk__in=video_ids[start:start + VIDEO_BATCH_SIZE]).values_list('pk', flat=True))
+    rows = [
+        (video_id, datetime.datetime.fromtimestamp(hour, datetime.timezone.utc), views, seconds)
+        for (video_id, hour), (views, seconds) in totals.items() if video_id in existing
+    ]
+
+    deltas = {}
+    for video_id, _, views, _ in rows:
+        deltas[video_id] = deltas.get(video_id, 0) + views
+    with transaction.atomic():
+        _upsert(rows)
+        counters.adjust_view_counts(deltas)
+    for path in paths:
+        os.remove(path)
+    if rows:
+        cache.bump('views', 'videos', *(f'video:{video_id}' for video_id in deltas))
+    return sum(deltas.values()), len(rows)
+
+
+def _upsert(rows):
+    table = connection.ops.quote_name(ViewRollup._meta.db_table)
+    sql = (
+        f'INSERT INTO {table} (video_id, hour, views, watch_seconds) VALUES (%s, %s, %s, %s) '
+        f'ON CONFLICT (video_id, hour) DO UPDATE SET views = {table}.views + excluded.views, '
+        f'watch_seconds = {table}.watch_seconds + excluded.watch_seconds'
+    )
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(video_id, adapt(hour), views, seconds) for video_id, hour, views, seconds in rows])
+
+
+def trending(hours=None, limit=20):
+    """[(video_id, views, watch_seconds)] for the most viewed videos of the last `hours` hours."""
+    hours = hours or option('TRENDING_HOURS')
+    now = datetime.datetime.now(datetime.timezone.utc)
+    since = now.replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=hours - 1)
+    return list(
+        ViewRollup.objects.filter(hour__gte=since).values('video')
+        .annotate(total=Sum('views'), watched=Sum('watch_seconds')).order_by('-total', '-video')
+        .values_list('video', 'total', 'watched')[:limit]
+    )
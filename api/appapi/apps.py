@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AppapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'appapi'
+
+    def ready(self):
+        from . import ranking, signals  # noqa: F401
@@ -0,0 +1,100 @@
+"""
+Stateless JWT authentication.
+
+Tokens carry the user's id, username and is_staff, embedded when they are
+issued (see ClaimsTokenObtainPairSerializer), so ClaimsJWTAuthentication
+builds request.user from the token instead of loading the User row.
+request.user is then a ClaimsUser, not a model instance: code compares
+ids (`obj.creator_id == request.user.id`) and saves foreign keys as
+`creator_id=request.user.id`.
+
+Without the row, a token would outlive its user being deactivated or
+deleted, a change to their is_staff or is_superuser flag (signals.py
+revokes their tokens then), or a "sign out everywhere" (POST
+/api/token/revoke/, which records a TokenRevocation). Refresh tokens are
+held to the same cutoff when they mint access tokens, and the claims of
+those are read afresh from the User row (ClaimsTokenRefreshSerializer).
+Each user's standing (active, and the cutoff
+before which their tokens are revoked) is looked up once and cached in
+the API cache for TOKEN_REVOCATION_CACHE_TTL seconds, so an authenticated
+request costs no query while that entry is warm. Saving or deleting the
+user and revoking drop or replace the entry, which other processes see at
+once when the cache is shared and within the TTL otherwise.
+"""
+
+import math
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from . import cache
+from .models import TokenRevocation
+
+
+def ttl():
+    return getattr(settings, 'TOKEN_REVOCATION_CACHE_TTL', 30)
+
+
+def _cutoff_key(user_id):
+    return f'auth:cutoff:{user_id}'
+
+
+class ClaimsUser(TokenUser):
+    """TokenUser whose id is the integer primary key, comparable with foreign key ids."""
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+
+def cutoff(user_id):
+    """
+    Whole epoch seconds before which the user's tokens are refused: 0 when
+    none are, infinity when the user is inactive or gone.
+    """
+    store = cache.get_cache()
+    value = store.get(_cutoff_key(user_id))
+    if value is None:
+        row = User.objects.filter(pk=user_id).values_list('is_active', 'token_revocation__revoked_at').first()
+        if row is None or not row[0]:
+            value = math.inf
+        else:
+            value = math.floor(row[1].timestamp()) if row[1] else 0
+        store.set(_cutoff_key(user_id), value, ttl())
+    return value
+
+
+def revoke(user_id):
+    """Refuse every token issued to the user before the current second."""
+    # to the whole second, like iat
+    now = timezone.now().replace(microsecond=0)
+    TokenRevocation.objects.update_or_create(user_id=user_id, defaults={'revoked_at': now})
+    cache.get_cache().set(_cutoff_key(user_id), int(now.timestamp()), ttl())
+
+
+def forget(user_id):
+    """Drop the cached cutoff after the user row changed (see signals.py)."""
+    cache.get_cache().delete(_cutoff_key(user_id))
+
+
+def check_revoked(token, user_id):
+    """Raise AuthenticationFailed if `token`, access or refresh, was issued before the user's cutoff."""
+    revoked_before = cutoff(user_id)
+    # iat has whole seconds, so tokens issued in the second of a revocation
+    # are kept: otherwise signing in again right after it would be refused
+    if revoked_before and token.get('iat', 0) < revoked_before:
+        raise AuthenticationFailed('Token has been revoked.', code='token_revoked')
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        check_revoked(validated_token, user.id)
+        return user
@@ -0,0 +1,177 @@
+"""
+Response cache for read endpoints.
+
+Serialized response data is cached under keys that embed a version number
+per scope: one per object (e.g. "video:12") and one per collection (e.g.
+"videos"). Model signals bump the versions a write affects (see
+signals.py), so stale entries are never read again and simply age out
+through the backend's TTL and eviction.
+
+The backend is whichever Django cache API_CACHE['ALIAS'] names: LocMemCache
+(in-process, LRU) or LRUFileBasedCache below, a shared on-disk stand-in for
+multi-process deployments.
+
+Versions are kept apart, in the cache API_CACHE['VERSIONS'] names, which
+must be one every process shares (files on local disk by default). A bump
+made by one worker then reaches all of them, even while each keeps its
+cached responses in its own memory.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from rest_framework.response import Response
+
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """
+    FileBasedCache that evicts least recently used entries instead of a
+    random sample. Reads refresh the file's mtime, which eviction sorts on.
+    """
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, default, version)
+        if value is not default:
+            try:
+                os.utime(self._key_to_file(key, version))
+            except FileNotFoundError:
+                pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+
+        def mtime(fname):
+            try:
+                return os.stat(fname).st_mtime_ns
+            except FileNotFoundError:
+                return 0
+
+        for fname in sorted(filelist, key=mtime)[:num_entries // self._cull_frequency]:
+            self._delete(fname)
+
+
+def get_cache():
+    return caches[settings.API_CACHE['ALIAS']]
+
+
+def get_version_store():
+    return caches[settings.API_CACHE.get('VERSIONS', settings.API_CACHE['ALIAS'])]
+
+
+def _version_key(scope):
+    return f'api:version:{scope}'
+
+
+def version(scope):
+    # Versions start from the clock rather than 1, so a version key that was
+    # evicted can never come back as a number an old entry was stored under.
+    return get_version_store().get_or_set(_version_key(scope), time.time_ns, timeout=None)
+
+
+def versions(scopes):
+    """version() of each scope, read in one call to the store."""
+    found = get_version_store().get_many([_version_key(scope) for scope in scopes])
+    return [found.get(_version_key(scope)) or version(scope) for scope in scopes]
+
+
+def bump(*scopes):
+    get_version_store().set_many({_version_key(scope): time.time_ns() for scope in scopes}, timeout=None)
+
+
+def record(kind, hit):
+    with _stats_lock:
+        stats[f'{kind}_{"hits" if hit else "misses"}'] += 1
+
+
+def _plain(data):
+    """
+    Strip serializer output down to builtins before pickling. DRF's
+    Hyperlink is a str that pickles its model instance along with it.
+    """
+    if isinstance(data, dict):
+        return {key: _plain(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_plain(value) for value in data]
+    if isinstance(data, str):
+        return str(data)
+    return data
+
+
+def cached_data(request, kind, scopes, build):
+    """
+    Return (data, hit) for this request, calling `build()` on a miss.
+    `kind` selects the TTL from API_CACHE['TIMEOUTS'].
+    """
+    cache = get_cache()
+    key = _data_key(request, kind, versions(scopes), scopes)
+
+    data = cache.get(key)
+    hit = data is not None
+    if not hit:
+        data = _plain(build())
+        cache.set(key, data, settings.API_CACHE['TIMEOUTS'][kind])
+    record(kind, hit)
+    return data, hit
+
+
+async def acached_data(request, kind, scopes, build):
+    """
+    cached_data() for async views; `build` is a coroutine function. The
+    cache is read synchronously: the backends here answer from memory or
+    local disk faster than a hop to a worker thread would take.
+    """
+    cache = get_cache()
+    key = _data_key(request, kind, versions(scopes), scopes)
+
+    data = cache.get(key)
+    hit = data is not None
+    if not hit:
+        data = _plain(await build())
+        cache.set(key, data, settings.API_CACHE['TIMEOUTS'][kind])
+    record(kind, hit)
+    return data, hit
+
+
+def _data_key(request, kind, versions, scopes):
+    parts = [f'{scope}@{version}' for scope, version in zip(scopes, versions)]
+    # hyperlinked fields are absolute, so the host is part of the key
+    parts.append(request.build_absolute_uri())
+    return f'api:{kind}:' + hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def cached_response(request, kind, scopes, build):
+    """
+    Response for `build()`'s data, served from the cache when `scopes` is
+    given. The X-Cache header reports HIT or MISS.
+    """
+    if scopes is None:
+        return Response(build())
+    return _response(*cached_data(request, kind, scopes, build))
+
+
+async def acached_response(request, kind, scopes, build):
+    """cached_response() for async views; `build` is a coroutine function."""
+    if scopes is None:
+        return Response(await build())
+    return _response(*await acached_data(request, kind, scopes, build))
+
+
+def _response(data, hit):
+    response = Response(data)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
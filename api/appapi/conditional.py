@@ -0,0 +1,98 @@
+"""
+Conditional GET (ETag / Last-Modified) for API views.
+
+Checking a validator never costs more than the lookup the view already
+does, and when the client's copy is current the view answers 304 before
+any serializer runs.
+
+- single objects: the row's pk and `updated_at`
+- collections: the response cache's scope versions (see cache.py), which
+  signals bump on every write and delete, so no aggregate or scan is needed;
+  they are read from the version store all workers share, so every worker
+  derives the same ETag and none answers 304 to a stale copy
+- anything else (e.g. the feed): the (pk, updated_at) pairs of the page
+
+The request's query string is folded into every ETag because it selects
+the page and, with ?fields=, the representation.
+"""
+
+import datetime
+import hashlib
+
+from django.http import HttpResponseNotModified
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import cache
+
+
+def _etag(*parts):
+    return quote_etag(hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:32])
+
+
+def _timestamp(value):
+    return int(value.timestamp()) if value is not None else None
+
+
+def object_validators(request, obj):
+    etag = _etag(obj._meta.label, obj.pk, obj.updated_at.isoformat(), request.GET.urlencode())
+    return etag, obj.updated_at
+
+
+def collection_validators(request, *scopes):
+    versions = cache.versions(scopes)
+    etag = _etag(*[f'{scope}@{version}' for scope, version in zip(scopes, versions)], request.GET.urlencode())
+    # versions are time_ns() of the last bump
+    last = datetime.datetime.fromtimestamp(max(versions) / 1e9, tz=datetime.timezone.utc)
+    return etag, last
+
+
+def rows_validators(request, rows):
+    last = max((row.updated_at for row in rows), default=None)
+    etag = _etag(*[f'{row.pk}@{row.updated_at.isoformat()}' for row in rows], request.GET.urlencode())
+    return etag, last
+
+
+def respond(request, etag, last_modified, build_response, check_modified_since=True):
+    """
+    Return 304 if the request's validators match, otherwise `build_response()`
+    with ETag and Last-Modified set.
+
+    Collections pass check_modified_since=False: they can change several
+    times within Last-Modified's one-second resolution, so only the ETag
+    is trusted.
+    """
+    timestamp = _timestamp(last_modified)
+    response = _preconditions(request, etag, timestamp, check_modified_since)
+    if response is None:
+        response = build_response()
+    elif not isinstance(response, HttpResponseNotModified):
+        # 412 Precondition Failed
+        return response
+    return _stamp(response, etag, timestamp)
+
+
+async def arespond(request, etag, last_modified, build_response, check_modified_since=True):
+    """respond() for async views; `build_response` is a coroutine function."""
+    timestamp = _timestamp(last_modified)
+    response = _preconditions(request, etag, timestamp, check_modified_since)
+    if response is None:
+        response = await build_response()
+    elif not isinstance(response, HttpResponseNotModified):
+        return response
+    return _stamp(response, etag, timestamp)
+
+
+def _preconditions(request, etag, timestamp, check_modified_since):
+    return get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=timestamp if check_modified_since else None,
+    )
+
+
+def _stamp(response, etag, timestamp):
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    return response
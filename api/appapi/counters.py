@@ -0,0 +1,104 @@
+"""
+Denormalized counters.
+
+Views adjust counters with single UPDATE ... SET n = n + delta statements
+inside the same transaction as the write they describe. Anything that
+bypasses the views (admin, cascades, shell) can leave them drifting;
+`manage.py reconcile_counters` recomputes them in bulk.
+"""
+
+from django.contrib.auth.models import User
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Comment, Profile, Subscription, Video
+
+IN_BATCH_SIZE = 500
+
+
+# updated_at is set explicitly because QuerySet.update() skips auto_now;
+# it feeds the ETag of the row being counted (see conditional.py).
+
+def adjust_comment_count(video_id, delta):
+    Video.objects.filter(pk=video_id).update(comment_count=F('comment_count') + delta, updated_at=timezone.now())
+
+
+def adjust_reply_count(comment_id, delta):
+    Comment.objects.filter(pk=comment_id).update(reply_count=F('reply_count') + delta, updated_at=timezone.now())
+
+
+def adjust_subscriber_count(user_id, delta):
+    Profile.objects.filter(user_id=user_id).update(subscriber_count=F('subscriber_count') + delta, updated_at=timezone.now())
+
+
+def adjust_video_count(user_id, delta):
+    Profile.objects.filter(user_id=user_id).update(video_count=F('video_count') + delta, updated_at=timezone.now())
+
+
+def adjust_comment_counts(deltas):
+    """adjust_comment_count() for a batch: `deltas` maps video ids to deltas."""
+    _adjust_many(Video.objects, 'pk', 'comment_count', deltas)
+
+
+def adjust_reply_counts(deltas):
+    """adjust_reply_count() for a batch: `deltas` maps comment ids to deltas."""
+    _adjust_many(Comment.objects, 'pk', 'reply_count', deltas)
+
+
+def adjust_subscriber_counts(deltas):
+    """adjust_subscriber_count() for a batch: `deltas` maps user ids to deltas."""
+    _adjust_many(Profile.objects, 'user_id', 'subscriber_count', deltas)
+
+
+def adjust_view_counts(deltas):
+    """Add views to Video.view_count: `deltas` maps video ids to new views."""
+    _adjust_many(Video.objects, 'pk', 'view_count', deltas)
+
+
+def _adjust_many(queryset, key, field, deltas):
+    # one UPDATE per distinct delta (and IN_BATCH_SIZE rows) instead of one per row
+    by_delta = {}
+    for pk, delta in deltas.items():
+        by_delta.setdefault(delta, []).append(pk)
+    now = timezone.now()
+    for delta, pks in by_delta.items():
+        for start in range(0, len(pks), IN_BATCH_SIZE):
+            queryset.filter(**{f'{key}__in': pks[start:start + IN_BATCH_SIZE]}).update(
+                **{field: F(field) + delta}, updated_at=now,
+            )
+
+
+def _count(queryset, field, outer='pk'):
+    """Correlated COUNT of `queryset` rows whose `field` points at the outer row's `outer`."""
+    counts = queryset.filter(**{field: OuterRef(outer)}).order_by().values(field).annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def reconcile():
+    """
+    Recompute every counter, touching only rows that drifted.
+    Returns the number of rows fixed per counter.
+    """
+    Profile.objects.bulk_create(
+        [Profile(user_id=pk) for pk in User.objects.filter(profile__isnull=True).values_list('pk', flat=True)],
+        ignore_conflicts=True,
+    )
+    fixed = {}
+
+    actual = _count(Comment.objects, 'the_video')
+    videos = Video.objects.annotate(actual=actual).exclude(comment_count=F('actual'))
+    fixed['comment_count'] = Video.objects.filter(pk__in=videos.values('pk')).update(comment_count=actual, updated_at=timezone.now())
+
+    actual = _count(Comment.objects, 'parent')
+    comments = Comment.objects.annotate(actual=actual).exclude(reply_count=F('actual'))
+    fixed['reply_count'] = Comment.objects.filter(pk__in=comments.values('pk')).update(reply_count=actual, updated_at=timezone.now())
+
+    for field, queryset, column in (
+        ('subscriber_count', Subscription.objects, 'subscribed_to'),
+        ('video_count', Video.objects, 'creator'),
+    ):
+        actual = _count(queryset, column, outer='user_id')
+        drifted = Profile.objects.annotate(actual=actual).exclude(**{field: F('actual')})
+        fixed[field] = Profile.objects.filter(pk__in=drifted.values('pk')).update(**{field: actual}, updated_at=timezone.now())
+    return fixed
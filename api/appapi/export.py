@@ -0,0 +1,101 @@
+"""
+Streaming exports of whole tables as NDJSON or CSV, for admins and
+analytics jobs.
+
+Rows are read in primary key order with .iterator(chunk_size=...) and
+encoded a chunk at a time, so memory stays flat however large the table.
+Every NDJSON object and CSV row starts with its id; an interrupted
+consumer resumes with `since_id` set to the last id it received.
+
+Served by the admin-only /api/export/<name>.<ndjson|csv> endpoint and by
+`manage.py export`, which also keeps a checkpoint file.
+"""
+
+import csv
+import io
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from .fastjson import dumps
+from .models import Comment, Subscription, Video
+
+EXPORTS = {
+    'videos': (Video, ('id', 'creator_id', 'title', 'desc', 'video', 'status', 'duration', 'width', 'height',
+                       'comment_count', 'view_count', 'created_at', 'updated_at')),
+    'comments': (Comment, ('id', 'the_video_id', 'creator_id', 'parent_id', 'depth', 'reply_count', 'comment',
+                           'updated_at')),
+    'subscriptions': (Subscription, ('id', 'subscriber_id', 'subscribed_to_id', 'updated_at')),
+}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+# rows per database fetch, and per chunk of output
+CHUNK_SIZE = 2000
+
+
+def queryset(name, since_id=0):
+    model, columns = EXPORTS[name]
+    rows = model.objects.filter(pk__gt=since_id).order_by('pk').values_list(*columns)
+    # route now: a streamed response is read after the view has returned,
+    # outside ReplicaMiddleware's scope
+    return rows.using(rows.db)
+
+
+def encoder(name, fmt):
+    """(header, encode): the bytes to start with, and a function encoding a chunk of rows."""
+    columns = EXPORTS[name][1]
+    if fmt == 'ndjson':
+        def encode(rows):
+            return b''.join([dumps(dict(zip(columns, row))) + b'\n' for row in rows])
+        return b'', encode
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        return buffer.getvalue().encode()
+    return encode([columns]), encode
+
+
+def chunks(name, since_id=0, chunk_size=CHUNK_SIZE):
+    rows = queryset(name, since_id).iterator(chunk_size=chunk_size)
+    try:
+        while chunk := list(islice(rows, chunk_size)):
+            yield chunk
+    finally:
+        # closes the cursor when a client goes away mid-export
+        rows.close()
+
+
+async def achunks(name, since_id=0, chunk_size=CHUNK_SIZE):
+    # QuerySet.aiterator() runs a values_list() query on the event loop;
+    # read each chunk on the thread that owns the connection instead
+    rows = chunks(name, since_id, chunk_size)
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(rows, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(rows.close)()
+
+
+def stream(name, fmt, since_id=0, chunk_size=CHUNK_SIZE):
+    header, encode = encoder(name, fmt)
+    if header:
+        yield header
+    for chunk in chunks(name, since_id, chunk_size):
+        yield encode(chunk)
+
+
+async def astream(name, fmt, since_id=0, chunk_size=CHUNK_SIZE):
+    """stream() for ASGI, which would read a synchronous iterator whole before sending it."""
+    header, encode = encoder(name, fmt)
+    if header:
+        yield header
+    async for chunk in achunks(name, since_id, chunk_size):
+        yield encode(chunk)
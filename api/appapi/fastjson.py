@@ -0,0 +1,60 @@
+"""
+JSON rendering and parsing through orjson, when it is installed.
+
+FastJSONRenderer and FastJSONParser are drop-in replacements for DRF's
+JSONRenderer and JSONParser and produce the same bytes: compact, UTF-8,
+U+2028/U+2029 escaped (DRF's defaults for UNICODE_JSON and COMPACT_JSON,
+which they follow), and types orjson does not handle itself (dates
+and times, Decimal, lazy strings, ...) encoded by DRF's encoder. Without
+orjson, or for what orjson refuses (integers over 64 bits, indented
+output for the browsable API, other charsets), they defer to DRF's
+stdlib-based classes.
+"""
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+OPTIONS = 0
+if orjson is not None:
+    # dict keys as str() like json.dumps; datetimes formatted by DRF's encoder
+    OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # valid JSON, but not valid JavaScript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        if orjson is None or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+def dumps(data):
+    """Compact UTF-8 JSON bytes, as FastJSONRenderer renders them."""
+    return FastJSONRenderer().render(data)
@@ -0,0 +1,85 @@
+"""
+Subscription feeds.
+
+Publishing a video copies it into each subscriber's TimelineEntry rows
+(fan-out on write), so reading a feed is an index range scan on the
+reader's own timeline. Creators with more than FEED_FANOUT_LIMIT
+subscribers are not fanned out; their videos are flagged fanout_on_read
+and merged into followers' feeds at query time instead (see
+pagination.FeedPagination).
+"""
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Subscription, TimelineEntry, Video
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def fanout_limit():
+    return getattr(settings, 'FEED_FANOUT_LIMIT', 5000)
+
+
+def fan_out(video):
+    """Materialize a newly published video into its creator's subscribers' timelines."""
+    limit = fanout_limit()
+    subscribers = list(
+        Subscription.objects.filter(subscribed_to_id=video.creator_id)
+        .values_list('subscriber_id', flat=True)[:limit + 1]
+    )
+    if len(subscribers) > limit:
+        Video.objects.filter(pk=video.pk).update(fanout_on_read=True)
+        video.fanout_on_read = True
+        return 0
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(owner_id=owner_id, video_id=video.pk, created_at=video.created_at) for owner_id in subscribers),
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    return len(subscribers)
+
+
+def backfill(subscription):
+    """Copy a creator's recent fanned-out videos into a new subscriber's timeline."""
+    recent = (
+        Video.objects.filter(creator_id=subscription.subscribed_to_id, fanout_on_read=False)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'created_at')[:getattr(settings, 'FEED_BACKFILL', 20)]
+    )
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(owner_id=subscription.subscriber_id, video_id=video_id, created_at=created_at)
+         for video_id, created_at in recent),
+        ignore_conflicts=True,
+    )
+
+
+def backfill_many(subscriptions):
+    """backfill() for a batch of new subscriptions, reading each creator's recent videos once."""
+    creators = list({subscription.subscribed_to_id for subscription in subscriptions})
+    recent = {}
+    for start in range(0, len(creators), FANOUT_BATCH_SIZE):
+        rank = Window(RowNumber(), partition_by=F('creator_id'), order_by=[F('created_at').desc(), F('id').desc()])
+        rows = (
+            Video.objects.filter(creator_id__in=creators[start:start + FANOUT_BATCH_SIZE], fanout_on_read=False)
+            .annotate(rank=rank).filter(rank__lte=getattr(settings, 'FEED_BACKFILL', 20))
+            .values_list('creator_id', 'id', 'created_at')
+        )
+        for creator_id, video_id, created_at in rows:
+            recent.setdefault(creator_id, []).append((video_id, created_at))
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(owner_id=subscription.subscriber_id, video_id=video_id, created_at=created_at)
+         for subscription in subscriptions
+         for video_id, created_at in recent.get(subscription.subscribed_to_id, ())),
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def prune(subscription):
+    """Remove an unsubscribed creator's videos from the subscriber's timeline."""
+    TimelineEntry.objects.filter(
+        owner_id=subscription.subscriber_id,
+        video__creator_id=subscription.subscribed_to_id,
+    ).delete()
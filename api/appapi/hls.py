@@ -0,0 +1,201 @@
+"""
+HLS packaging.
+
+`package(video)` writes MEDIA_ROOT/uploads/hls/<pk>/: a master playlist,
+and per rendition a VOD playlist with its fixed-duration segments. Players
+fetch the master, pick a rendition for their bandwidth and start after the
+first segment instead of the whole file.
+
+With ffmpeg installed every rung of HLS['LADDER'] at or below the source
+height is transcoded to H.264/AAC MPEG-TS. Without it a single "source"
+rendition is cut from the original bytes at the segment duration's share
+of the file; that keeps the layout, URLs and caching behaviour the same
+in development, but only the ffmpeg output is decodable segment by
+segment.
+
+The <pk> path is a symlink to the tree of the latest build
+(uploads/hls/<pk>.<stamp>/). A rebuild writes a new tree beside it and
+repoints the link with one atomic rename, so players switch from a
+complete old tree to a complete new one and never get a 404 in between.
+"""
+
+import math
+import os
+import shutil
+import subprocess
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Rendition
+
+SUBPROCESS_TIMEOUT = 60 * 60
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def option(name):
+    defaults = {
+        'SEGMENT_DURATION': 6,
+        'LADDER': [('1080p', 1080, 5000000), ('720p', 720, 2800000), ('480p', 480, 1400000), ('360p', 360, 800000)],
+    }
+    return getattr(settings, 'HLS', {}).get(name, defaults[name])
+
+
+def relative_dir(video_id):
+    return f'uploads/hls/{video_id}'
+
+
+def output_dir(video_id):
+    return os.path.join(settings.MEDIA_ROOT, relative_dir(video_id))
+
+
+def remove(video_id):
+    path = output_dir(video_id)
+    if os.path.islink(path):
+        target = os.path.realpath(path)
+        os.remove(path)
+        shutil.rmtree(target, ignore_errors=True)
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _switch(link, tree):
+    """Point `link` at the directory `tree` with one atomic rename, then delete the tree it replaced."""
+    pending = f'{link}.link-{os.getpid()}'
+    if os.path.lexists(pending):
+        os.remove(pending)
+    # relative, so MEDIA_ROOT can move
+    os.symlink(os.path.basename(tree), pending)
+    if os.path.islink(link):
+        old = os.path.realpath(link)
+    elif os.path.isdir(link):
+        # packaged before trees were linked: a rename cannot replace a
+        # directory, so move it aside first
+        old = f'{link}.old-{os.getpid()}'
+        os.rename(link, old)
+    else:
+        old = None
+    os.replace(pending, link)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def package(video):
+    """(Re)build the video's renditions and point video.hls_manifest at the master playlist."""
+    final = output_dir(video.pk)
+    building = f'{final}.{time.time_ns()}'
+    os.makedirs(building)
+    try:
+        if shutil.which('ffmpeg'):
+            variants = _transcode(video, building)
+        else:
+            variants = [_split(video, building)]
+        _write_master(building, variants)
+        # switch to the finished tree so players never see half a rendition
+        _switch(final, building)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+
+    base = relative_dir(video.pk)
+    with transaction.atomic():
+        video.renditions.all().delete()
+        Rendition.objects.bulk_create([
+            Rendition(video=video, playlist=f'{base}/{variant["name"]}/index.m3u8', **variant)
+            for variant in variants
+        ])
+        video.hls_manifest.name = f'{base}/master.m3u8'
+        video.save(update_fields=['hls_manifest', 'updated_at'])
+    return variants
+
+
+def _transcode(video, directory):
+    segment = option('SEGMENT_DURATION')
+    ladder = [rung for rung in option('LADDER') if not video.height or rung[1] <= video.height]
+    if not ladder:
+        # smaller than the lowest rung: keep the source size
+        ladder = [(f'{video.height}p', video.height, option('LADDER')[-1][2])]
+    variants = []
+    for name, height, bandwidth in ladder:
+        os.makedirs(os.path.join(directory, name))
+        subprocess.run(
+            ['ffmpeg', '-v', 'error', '-i', video.video.path,
+             '-vf', f'scale=-2:{height}', '-c:v', 'libx264', '-b:v', str(bandwidth),
+             '-maxrate', str(bandwidth), '-bufsize', str(2 * bandwidth),
+             # a keyframe at every segment boundary
+             '-force_key_frames', f'expr:gte(t,n_forced*{segment})',
+             '-c:a', 'aac', '-b:a', '128k',
+             '-f', 'hls', '-hls_time', str(segment), '-hls_playlist_type', 'vod',
+             '-hls_segment_filename', os.path.join(directory, name, 'seg_%05d.ts'),
+             os.path.join(directory, name, 'index.m3u8')],
+            check=True, timeout=SUBPROCESS_TIMEOUT,
+        )
+        width = round(video.width * height / video.height / 2) * 2 if video.width and video.height else None
+        count = sum(1 for entry in os.listdir(os.path.join(directory, name)) if entry.endswith('.ts'))
+        variants.append({
+            'name': name, 'width': width, 'height': height, 'bandwidth': bandwidth,
+            'segment_duration': segment, 'segment_count': count,
+        })
+    return variants
+
+
+def _split(video, directory):
+    segment = option('SEGMENT_DURATION')
+    size = video.video.size
+    duration = video.duration or segment
+    segment_bytes = max(1, math.ceil(size * segment / duration))
+    os.makedirs(os.path.join(directory, 'source'))
+
+    durations = []
+    with video.video.open('rb') as source:
+        while True:
+            remaining = segment_bytes
+            path = os.path.join(directory, 'source', f'seg_{len(durations):05d}.ts')
+            with open(path, 'wb') as out:
+                while remaining:
+                    chunk = source.read(min(COPY_BUFFER_SIZE, remaining))
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    remaining -= len(chunk)
+            written = segment_bytes - remaining
+            if not written:
+                os.remove(path)
+                break
+            durations.append(duration * written / size)
+            if remaining:
+                break
+
+    _write_playlist(os.path.join(directory, 'source', 'index.m3u8'), durations)
+    return {
+        'name': 'source', 'width': video.width, 'height': video.height,
+        'bandwidth': math.ceil(size * 8 / duration),
+        'segment_duration': segment, 'segment_count': len(durations),
+    }
+
+
+def _write_playlist(path, durations):
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f'#EXT-X-TARGETDURATION:{math.ceil(max(durations, default=0))}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    for index, duration in enumerate(durations):
+        lines += [f'#EXTINF:{duration:.3f},', f'seg_{index:05d}.ts']
+    lines.append('#EXT-X-ENDLIST')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _write_master(directory, variants):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for variant in sorted(variants, key=lambda v: v['bandwidth']):
+        attributes = f'BANDWIDTH={variant["bandwidth"]}'
+        if variant['width'] and variant['height']:
+            attributes += f',RESOLUTION={variant["width"]}x{variant["height"]}'
+        lines += [f'#EXT-X-STREAM-INF:{attributes}', f'{variant["name"]}/index.m3u8']
+    with open(os.path.join(directory, 'master.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
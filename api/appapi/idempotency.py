@@ -0,0 +1,96 @@
+"""
+Idempotency keys for write endpoints.
+
+A client that sends an `Idempotency-Key` header can retry a write without
+repeating it. The first response is stored under the key in the same
+transaction as the rows it reports, so either both commit or neither
+does, and later requests with that key get the stored response back with
+`Idempotent-Replayed: true`. Keys belong to one user and one endpoint,
+must be sent with the same body each time (422 otherwise) and expire
+after IDEMPOTENCY_KEY_TTL seconds.
+"""
+
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600)
+
+
+def fingerprint(data):
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _stored(user, scope, key):
+    cutoff = timezone.now() - datetime.timedelta(seconds=ttl())
+    return IdempotencyKey.objects.filter(user_id=user.id, scope=scope, key=key, created_at__gte=cutoff).first()
+
+
+def _replay(stored, digest):
+    if stored.fingerprint != digest:
+        return Response(
+            {"detail": f"This {HEADER} was already used with a different request body."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(stored.response, status=stored.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def _storable(response):
+    # conflicts and server errors are worth retrying, so they are not kept
+    return response.status_code < 500 and response.status_code != status.HTTP_409_CONFLICT
+
+
+def respond(request, scope, run):
+    """
+    Return the Response of `run()`, called inside a transaction, or the
+    stored response if `request.user` already sent this request's key to
+    `scope`.
+    """
+    key = request.headers.get(HEADER)
+    if not key:
+        with transaction.atomic():
+            return run()
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {"detail": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    digest = fingerprint(request.data)
+    stored = _stored(request.user, scope, key)
+    if stored is not None:
+        return _replay(stored, digest)
+    try:
+        with transaction.atomic():
+            response = run()
+            if _storable(response):
+                cutoff = timezone.now() - datetime.timedelta(seconds=ttl())
+                # an expired row would still hold the unique constraint
+                IdempotencyKey.objects.filter(user_id=request.user.id, created_at__lt=cutoff).delete()
+                IdempotencyKey.objects.create(
+                    user_id=request.user.id, scope=scope, key=key, fingerprint=digest,
+                    status_code=response.status_code, response=response.data,
+                )
+    except IntegrityError:
+        # a concurrent request with the same key committed first and our
+        # writes were rolled back; answer with its response
+        stored = _stored(request.user, scope, key)
+        if stored is None:
+            raise
+        return _replay(stored, digest)
+    return response
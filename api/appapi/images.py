@@ -0,0 +1,150 @@
+"""
+Resized, re-encoded derivatives of post images.
+
+A derivative is a named width from IMAGE_DERIVATIVES['SIZES'] in WebP or
+JPEG. It is generated on its first request and kept on disk under
+MEDIA_ROOT/derivatives/<version>/, where <version> is derived from the
+source file's name; with content-addressed storage that name changes
+whenever the image does, so derivatives never need invalidating and their
+URLs can be cached for good.
+
+Reads refresh a file's mtime. When the directory grows past MAX_BYTES the
+least recently used derivatives are deleted down to 90% of it.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from PIL import Image, ImageOps, UnidentifiedImageError  # noqa: F401
+
+from .storage import media_storage
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+_usage = None
+_usage_lock = threading.Lock()
+
+
+def option(name):
+    defaults = {
+        'SIZES': {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280},
+        'QUALITY': {'webp': 80, 'jpeg': 82},
+        'MAX_BYTES': 256 * 1024 * 1024,
+    }
+    return getattr(settings, 'IMAGE_DERIVATIVES', {}).get(name, defaults[name])
+
+
+@receiver(setting_changed)
+def reset_usage(setting, **kwargs):
+    global _usage
+    if setting in ('MEDIA_ROOT', 'IMAGE_DERIVATIVES'):
+        _usage = None
+
+
+def cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'derivatives')
+
+
+def version(name):
+    return hashlib.sha1(name.encode()).hexdigest()[:16]
+
+
+def derivative(name, size, fmt):
+    """Return the path of the `size`/`fmt` derivative of media file `name`, creating it if needed."""
+    path = os.path.join(cache_dir(), version(name), f'{size}.{fmt}')
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    width = option('SIZES')[size]
+    with media_storage.open(name) as source:
+        image = Image.open(source)
+        # let the JPEG decoder scale down by up to 8x while decoding
+        image.draft('RGB', (width, width))
+        image = ImageOps.exif_transpose(image)
+        # never upscale; height follows the aspect ratio
+        image.thumbnail((width, image.height), Image.LANCZOS)
+
+    pil_format = FORMATS[fmt][0]
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.mode in ('LA', 'P', 'PA') else 'RGB')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            image.save(out, pil_format, quality=option('QUALITY')[fmt], optimize=pil_format == 'JPEG')
+        # concurrent requests may render the same derivative; the last rename wins
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _account(os.path.getsize(path))
+    return path
+
+
+def _account(size):
+    global _usage
+    with _usage_lock:
+        if _usage is None:
+            _usage = _scan_usage()
+        else:
+            _usage += size
+        over = _usage > option('MAX_BYTES')
+    if over:
+        evict()
+
+
+def _scan():
+    entries = []
+    for root, dirs, files in os.walk(cache_dir()):
+        for name in files:
+            if name.endswith('.part'):
+                # still being written by another request
+                continue
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, os.path.join(root, name)))
+    return entries
+
+
+def _scan_usage():
+    return sum(size for _, size, _ in _scan())
+
+
+def evict():
+    """Delete least recently used derivatives until they fit in 90% of MAX_BYTES."""
+    global _usage
+    entries = sorted(_scan())
+    total = sum(size for _, size, _ in entries)
+    target = option('MAX_BYTES') * 0.9
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    with _usage_lock:
+        _usage = total
+    return total
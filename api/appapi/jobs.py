@@ -0,0 +1,201 @@
+"""
+Database-backed job queue.
+
+Request handlers enqueue Job rows and return; `manage.py run_workers`
+starts worker processes that claim due jobs and run the handler registered
+for each job's kind. A failed job is retried with exponential backoff until
+it runs out of attempts. Claiming is a compare-and-set UPDATE on the row's
+status, so any number of workers can share the table without locks, and a
+job whose worker died is reclaimed once its lease expires. While a handler
+runs, a heartbeat thread renews the lease every LEASE / 3 seconds, so a
+job that legitimately runs longer than LEASE (an HLS transcode) is not
+taken over and run twice.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import F, Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+handlers = {}
+
+# sent after a job finishes for good, whether it succeeded or failed
+job_finished = Signal()
+
+CLAIM_BATCH = 10
+
+
+class PermanentError(Exception):
+    """Raised by a handler when retrying cannot help; the job fails at once."""
+
+
+def option(name):
+    defaults = {'WORKERS': 2, 'POLL_INTERVAL': 1.0, 'LEASE': 600, 'BACKOFF': 10, 'MAX_BACKOFF': 3600, 'MAX_ATTEMPTS': 5}
+    return getattr(settings, 'JOBS', {}).get(name, defaults[name])
+
+
+def register(kind):
+    """Decorator registering `func(**payload)` as the handler for `kind`."""
+    def decorator(func):
+        handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, key='', delay=0, max_attempts=None, **payload):
+    return Job.objects.create(
+        kind=kind,
+        key=key,
+        payload=payload,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or option('MAX_ATTEMPTS'),
+    )
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number `attempts`, with 10% jitter."""
+    delay = min(option('BACKOFF') * 2 ** (attempts - 1), option('MAX_BACKOFF'))
+    return delay + random.uniform(0, delay / 10)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker):
+    """Take one due job for `worker`, or return None if there is none."""
+    now = timezone.now()
+    due = Q(status=Job.QUEUED, run_at__lte=now)
+    abandoned = Q(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=option('LEASE')))
+    candidates = Job.objects.filter(due | abandoned).order_by('run_at', 'id').values_list('pk', 'status', 'locked_at')[:CLAIM_BATCH]
+    for pk, status, locked_at in candidates:
+        # only one worker's UPDATE can still see the row as it was read
+        claimed = Job.objects.filter(pk=pk, status=status, locked_at=locked_at).update(
+            status=Job.RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def renew(job):
+    """Push a running job's lease forward; False once another worker has reclaimed it."""
+    now = timezone.now()
+    renewed = Job.objects.filter(
+        pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by, locked_at=job.locked_at,
+    ).update(locked_at=now)
+    if renewed:
+        job.locked_at = now
+    return bool(renewed)
+
+
+class Heartbeat(threading.Thread):
+    """Renews a job's lease every LEASE / 3 seconds until stopped."""
+
+    def __init__(self, job):
+        super().__init__(name=f'job-{job.pk}-heartbeat', daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(option('LEASE') / 3):
+                try:
+                    if not renew(self.job):
+                        logger.warning('job %s (%s) lost its lease', self.job.pk, self.job.kind)
+                        return
+                except DatabaseError as exc:
+                    # e.g. SQLite busy with the handler's own writes; the next beat retries
+                    logger.warning('job %s (%s) lease not renewed: %s', self.job.pk, self.job.kind, exc)
+        finally:
+            # this thread's own connection
+            connection.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.join()
+
+
+def run(job):
+    """
+    Run a claimed job and record the outcome, unless the job was reclaimed
+    meanwhile; the returned job then shows the row as the new owner left it.
+    """
+    try:
+        handler = handlers.get(job.kind)
+        if handler is None:
+            raise PermanentError(f'no handler registered for {job.kind!r}')
+        with Heartbeat(job):
+            handler(**job.payload)
+    except Exception as exc:
+        job.last_error = traceback.format_exc()
+        if isinstance(exc, PermanentError) or job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            logger.error('job %s (%s) failed: %s', job.pk, job.kind, exc)
+        else:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+            logger.warning('job %s (%s) failed, retry %s at %s', job.pk, job.kind, job.attempts, job.run_at)
+    else:
+        job.status = Job.DONE
+        job.last_error = ''
+    # compare-and-set on the lease: a worker that reclaimed the job owns it now
+    recorded = Job.objects.filter(pk=job.pk, locked_by=job.locked_by, locked_at=job.locked_at).update(
+        status=job.status,
+        run_at=job.run_at,
+        last_error=job.last_error,
+        locked_by='',
+        locked_at=None,
+        updated_at=timezone.now(),
+    )
+    if not recorded:
+        logger.warning('job %s (%s) was reclaimed by another worker, outcome dropped', job.pk, job.kind)
+        job.refresh_from_db()
+        return job
+    job.locked_by = ''
+    job.locked_at = None
+    if job.status != Job.QUEUED:
+        job_finished.send(sender=Job, job=job)
+    return job
+
+
+def work(worker=None, once=False, should_stop=lambda: False):
+    """
+    Claim and run jobs until `should_stop()` is true. With `once`, return as
+    soon as no job is due. Returns the number of jobs run.
+    """
+    worker = worker or worker_name()
+    count = 0
+    while not should_stop():
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if once:
+                break
+            time.sleep(option('POLL_INTERVAL'))
+            continue
+        run(job)
+        count += 1
+    return count
@@ -0,0 +1,121 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from appapi import cache
+from appapi.models import Blob, Post, Video
+from appapi.storage import is_blob, media_storage
+
+MEDIA_FIELDS = [(Video, 'video'), (Post, 'post_image')]
+# response cache scope of one row, see signals.py
+SCOPES = {Video: 'video', Post: 'post'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Move media files saved before content-addressed storage into the blob store, "
+        "point their rows at the shared copy and recount blob references."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without changing it.")
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help="Also delete files in the upload directories that no row refers to.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        # a name can be shared by several rows, and in principle by both models
+        legacy = {}
+        for model, field in MEDIA_FIELDS:
+            names = (
+                model.objects.exclude(**{f'{field}__startswith': 'blobs/'}).exclude(**{field: ''})
+                .exclude(**{f'{field}__isnull': True}).values_list(field, flat=True).distinct()
+            )
+            for name in names:
+                legacy.setdefault(name, []).append((model, field))
+
+        before = sum(Blob.objects.values_list('size', flat=True))
+        moved = 0
+        for name, uses in legacy.items():
+            if not media_storage.exists(name):
+                self.stderr.write(f"missing: {name}")
+                continue
+            before += media_storage.size(name)
+            if dry_run:
+                moved += 1
+                continue
+            blob = media_storage.store_path(media_storage.path(name), name)
+            scopes = []
+            with transaction.atomic():
+                for model, field in uses:
+                    rows = model.objects.filter(**{field: name})
+                    scopes += [f'{SCOPES[model]}:{pk}' for pk in rows.values_list('pk', flat=True)]
+                    # updated_at moves so conditional GETs see the new URL
+                    rows.update(**{field: blob, 'updated_at': timezone.now()})
+            # update() sends no signals
+            cache.bump(*scopes)
+            moved += 1
+
+        orphans = self.orphans()
+        orphan_bytes = sum(os.path.getsize(path) for path in orphans)
+        if dry_run or not options['delete_orphans']:
+            self.stdout.write(f"{len(orphans)} unreferenced file(s), {orphan_bytes} byte(s), in the upload directories")
+        else:
+            for path in orphans:
+                os.remove(path)
+            before += orphan_bytes
+            self.stdout.write(f"{len(orphans)} unreferenced file(s) deleted")
+
+        if dry_run:
+            self.stdout.write(f"{moved} file(s) would move to the blob store")
+            return
+
+        self.recount()
+        cache.bump('videos', 'posts')
+        after = sum(Blob.objects.values_list('size', flat=True))
+        self.stdout.write(
+            f"{moved} file(s) moved to the blob store; {Blob.objects.count()} blob(s) hold {after} byte(s), "
+            f"{before - after} byte(s) freed"
+        )
+
+    def orphans(self):
+        """Files directly in each field's upload_to directory that no row names."""
+        referenced = set()
+        directories = set()
+        for model, field in MEDIA_FIELDS:
+            referenced.update(model.objects.values_list(field, flat=True).distinct())
+            directories.add(model._meta.get_field(field).upload_to)
+        found = []
+        for directory in directories:
+            # subdirectories hold partial uploads and HLS output, not row files
+            if media_storage.exists(directory):
+                found += [
+                    media_storage.path(directory + name) for name in media_storage.listdir(directory)[1]
+                    if directory + name not in referenced
+                ]
+        return found
+
+    def recount(self):
+        """Set every blob's refcount from the rows that use it and delete unused blobs."""
+        counts = {}
+        for model, field in MEDIA_FIELDS:
+            rows = model.objects.filter(**{f'{field}__startswith': 'blobs/'}).values(field).annotate(n=Count('pk'))
+            for row in rows:
+                counts[row[field]] = counts.get(row[field], 0) + row['n']
+
+        with transaction.atomic():
+            for blob in Blob.objects.all():
+                refcount = counts.pop(blob.name, 0)
+                if refcount == 0:
+                    blob.delete()
+                    media_storage.delete(blob.name)
+                elif blob.refcount != refcount:
+                    Blob.objects.filter(pk=blob.pk).update(refcount=refcount)
+            Blob.objects.bulk_create([
+                Blob(name=name, refcount=refcount, size=media_storage.size(name))
+                for name, refcount in counts.items() if is_blob(name) and media_storage.exists(name)
+            ])
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from appapi import uploads
+
+
+class Command(BaseCommand):
+    help = "Delete upload sessions idle for longer than UPLOAD_SESSION_TTL, with their partial files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=None, metavar='SECONDS',
+                            help="Keep expiring at this interval instead of expiring once.")
+
+    def handle(self, *args, **options):
+        while True:
+            self.stdout.write(f"{uploads.expire_sessions()} upload session(s) expired")
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
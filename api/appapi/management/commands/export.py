@@ -0,0 +1,59 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from appapi import export
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a table as NDJSON or CSV in id order. With --checkpoint, the last id written is saved after "
+        "every chunk and a rerun resumes after it, appending to --output."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(export.EXPORTS))
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='ndjson')
+        parser.add_argument('--output', help="File to write to; standard output by default.")
+        parser.add_argument('--since-id', type=int, help="Export rows with a greater id only.")
+        parser.add_argument('--checkpoint', help="File holding the last id written, read to resume.")
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE, help="Rows per database fetch.")
+
+    def handle(self, *args, **options):
+        since_id = options['since_id']
+        checkpoint = options['checkpoint']
+        # resuming appends to what the last run wrote, header included
+        resuming = since_id is None and checkpoint is not None and os.path.exists(checkpoint)
+        if resuming:
+            with open(checkpoint) as f:
+                try:
+                    since_id = int(f.read())
+                except ValueError:
+                    raise CommandError(f"{checkpoint} does not hold an id")
+
+        header, encode = export.encoder(options['name'], options['format'])
+        if options['output']:
+            out = open(options['output'], 'ab' if resuming else 'wb')
+        else:
+            out = sys.stdout.buffer
+        written = 0
+        try:
+            if not resuming:
+                out.write(header)
+            for chunk in export.chunks(options['name'], since_id or 0, options['chunk_size']):
+                out.write(encode(chunk))
+                out.flush()
+                written += len(chunk)
+                if checkpoint:
+                    self.save_checkpoint(checkpoint, chunk[-1][0])
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        self.stderr.write(f"{written} row(s) exported")
+
+    def save_checkpoint(self, path, last_id):
+        # replaced whole, so an interrupted write never leaves a torn id
+        with open(path + '.tmp', 'w') as f:
+            f.write(str(last_id))
+        os.replace(path + '.tmp', path)
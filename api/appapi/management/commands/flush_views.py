@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from appapi import analytics
+
+
+class Command(BaseCommand):
+    help = "Add logged view beacons to the hourly view rollups and video view counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=None, metavar='SECONDS',
+                            help="Keep flushing at this interval instead of flushing once.")
+
+    def handle(self, *args, **options):
+        while True:
+            views, rows = analytics.flush()
+            self.stdout.write(f"{views} view(s) added to {rows} rollup row(s)")
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
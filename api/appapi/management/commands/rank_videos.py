@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from appapi import ranking
+
+
+class Command(BaseCommand):
+    help = "Recompute trending scores and per-user recommendations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schedule', action='store_true',
+                            help="Queue the recurring rank_videos job for the workers instead of ranking now.")
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            ranking.schedule()
+            self.stdout.write("rank_videos job queued")
+            return
+        start = time.monotonic()
+        ranked, users = ranking.rank()
+        self.stdout.write(f"{ranked} video(s) ranked, {users} user(s) recommended to in {time.monotonic() - start:.1f}s")
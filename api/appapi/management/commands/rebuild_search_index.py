@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from appapi import search
+
+
+class Command(BaseCommand):
+    help = "Reindex every video and post in the full-text search table."
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError("No full-text search table on this database; search uses icontains instead.")
+        with transaction.atomic():
+            count = search.rebuild()
+        self.stdout.write(f"{count} document(s) indexed")
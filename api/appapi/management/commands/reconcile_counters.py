@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from appapi.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recompute comment, reply, subscriber and video counters that have drifted from the real row counts."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = reconcile()
+        for field, rows in fixed.items():
+            self.stdout.write(f"{field}: {rows} row(s) corrected")
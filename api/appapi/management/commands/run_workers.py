@@ -0,0 +1,53 @@
+import multiprocessing
+import signal
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from appapi import jobs
+
+
+def worker_main(stop, once):
+    # the parent handles Ctrl-C and tells workers to stop between jobs
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    django.setup()
+    jobs.work(once=once, should_stop=stop.is_set)
+
+
+class Command(BaseCommand):
+    help = "Run background job workers until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Number of worker processes (default: JOBS['WORKERS']).")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no job is due instead of polling for more.")
+
+    def handle(self, *args, **options):
+        processes = options['processes'] or jobs.option('WORKERS')
+        once = options['once']
+
+        if processes == 1:
+            count = jobs.work(once=once)
+            self.stdout.write(f"{count} job(s) run")
+            return
+
+        stop = multiprocessing.Event()
+
+        def shutdown(signum, frame):
+            self.stdout.write("Stopping workers after their current job...")
+            stop.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        # children must open their own connections, not share the parent's
+        connections.close_all()
+        workers = [multiprocessing.Process(target=worker_main, args=(stop, once), daemon=True) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {processes} worker(s)")
+        for worker in workers:
+            worker.join()
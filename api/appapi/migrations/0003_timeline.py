@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def serve_existing_videos_on_read(apps, schema_editor):
+    # videos published before timelines existed were never fanned out
+    Video = apps.get_model('appapi', 'Video')
+    Video.objects.update(fanout_on_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appapi', '0002_uploadsession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='fanout_on_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(serve_existing_videos_on_read, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(null=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='appapi.video')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'created_at'], name='timeline_owner_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'video'), name='unique_timeline_entry')],
+            },
+        ),
+    ]
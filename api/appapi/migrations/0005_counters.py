@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Video = apps.get_model('appapi', 'Video')
+    Comment = apps.get_model('appapi', 'Comment')
+    Subscription = apps.get_model('appapi', 'Subscription')
+    Profile = apps.get_model('appapi', 'Profile')
+
+    def count(queryset, field, outer):
+        counts = queryset.filter(**{field: models.OuterRef(outer)}).order_by().values(field).annotate(n=models.Count('pk')).values('n')
+        return Coalesce(models.Subquery(counts), models.Value(0))
+
+    Video.objects.update(comment_count=count(Comment.objects, 'the_video', 'pk'))
+    Profile.objects.bulk_create(Profile(user_id=pk) for pk in User.objects.values_list('pk', flat=True))
+    Profile.objects.update(
+        subscriber_count=count(Subscription.objects, 'subscribed_to', 'user_id'),
+        video_count=count(Video.objects, 'creator', 'user_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appapi', '0004_hot_lookup_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscriber_count', models.PositiveIntegerField(default=0)),
+                ('video_count', models.PositiveIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:59
+
+from django.db import migrations, models
+from django.utils import timezone
+
+VIDEO_JOBS = ('extract_metadata', 'poster', 'content_hash')
+
+
+def queue_existing_videos(apps, schema_editor):
+    # videos uploaded before the pipeline existed go through it once
+    Video = apps.get_model('appapi', 'Video')
+    Job = apps.get_model('appapi', 'Job')
+    now = timezone.now()
+    Job.objects.bulk_create(
+        (Job(kind=kind, key=f'video:{pk}', payload={'video_id': pk}, run_at=now)
+         for pk in Video.objects.values_list('pk', flat=True).iterator()
+         for kind in VIDEO_JOBS),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appapi', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='codec',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='poster',
+            field=models.ImageField(blank=True, null=True, upload_to='posters/'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50)),
+                ('key', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('run_at', models.DateTimeField()),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx')],
+            },
+        ),
+        migrations.RunPython(queue_existing_videos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appapi', '0007_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='hls_manifest',
+            field=models.FileField(blank=True, max_length=255, upload_to=''),
+        ),
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20)),
+                ('width', models.PositiveIntegerField(blank=True, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, null=True)),
+                ('bandwidth', models.PositiveIntegerField()),
+                ('playlist', models.FileField(max_length=255, upload_to='')),
+                ('segment_duration', models.FloatField()),
+                ('segment_count', models.PositiveIntegerField()),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='appapi.video')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('video', 'name'), name='unique_rendition')],
+            },
+        ),
+    ]
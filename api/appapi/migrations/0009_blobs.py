@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:07
+
+import appapi.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appapi', '0008_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='post_image',
+            field=models.ImageField(blank=True, null=True, storage=appapi.storage.ContentAddressedStorage(), upload_to='post_images/'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='video',
+            field=models.FileField(storage=appapi.storage.ContentAddressedStorage(), upload_to='uploads/'),
+        ),
+    ]
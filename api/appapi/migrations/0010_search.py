@@ -0,0 +1,37 @@
+from django.db import migrations
+
+TABLE = 'appapi_search'
+
+
+def create_index(apps, schema_editor):
+    # FTS5 is SQLite-only; other databases use the icontains fallback in search.py.
+    # The last word of a query is matched as a prefix, and short prefixes
+    # expand to many terms unless they have indexes of their own.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+        "title, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    Video = apps.get_model('appapi', 'Video')
+    Post = apps.get_model('appapi', 'Post')
+    rows = [(pk * 2, title, desc) for pk, title, desc in Video.objects.values_list('pk', 'title', 'desc')]
+    rows += [(pk * 2 + 1, '', text) for pk, text in Post.objects.values_list('pk', 'post')]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {TABLE} (rowid, title, body) VALUES (%s, %s, %s)', rows)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appapi', '0009_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+
+def set_root_paths(apps, schema_editor):
+    # every existing comment starts a thread of its own (see threads.py)
+    Comment = apps.get_model('appapi', 'Comment')
+    Comment.objects.update(path=Concat(LPad(Cast('id', CharField()), 10, Value('0')), Value('/')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appapi', '0011_idempotency_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='appapi.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['path'], name='comment_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['the_video', 'depth', 'id'], name='comment_video_depth_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['the_video', 'depth', 'reply_count', 'id'], name='comment_video_top_idx'),
+        ),
+        migrations.RunPython(set_root_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appapi', '0012_comment_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='view_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ViewRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.PositiveBigIntegerField(default=0)),
+                ('watch_seconds', models.FloatField(default=0)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_rollups', to='appapi.video')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour', 'video', 'views'], name='viewrollup_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('video', 'hour'), name='unique_view_rollup')],
+            },
+        ),
+    ]
@@ -1,14 +1,44 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 
+from .storage import media_storage
+
 
 # Create your models here.
 class Video(models.Model):
-    video = models.FileField(upload_to='uploads/')
+    video = models.FileField(upload_to='uploads/', storage=media_storage)
     title = models.CharField(max_length=40)
     desc = models.CharField(max_length=100)
     creator = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(null=True)
+    # set when the creator had too many subscribers to fan out to timelines
+    fanout_on_read = models.BooleanField(default=False)
+    comment_count = models.PositiveIntegerField(default=0)
+    # all-time views, added to by analytics.flush()
+    view_count = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # filled in by the background jobs in processing.py
+    PENDING, PROCESSING, READY, FAILED = 'pending', 'processing', 'ready', 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (PROCESSING, 'Processing'), (READY, 'Ready'), (FAILED, 'Failed')]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    duration = models.FloatField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    codec = models.CharField(max_length=16, blank=True)
+    poster = models.ImageField(upload_to='posters/', null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # HLS master playlist written by hls.package()
+    hls_manifest = models.FileField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='video_created_idx'),
+            models.Index(fields=['creator', 'created_at'], name='video_creator_created_idx'),
+            models.Index(fields=['fanout_on_read', 'created_at'], name='video_fanout_created_idx'),
+        ]
 
     def __str__(self):
         return f"title: {self.title}, created at: {self.created_at}"
@@ -17,7 +47,8 @@ class Video(models.Model):
 class Post(models.Model):
     post = models.CharField(max_length=200)
     creator = models.ForeignKey(User, on_delete=models.CASCADE)
-    post_image = models.ImageField(upload_to='post_images/', blank=True, null=True)
+    post_image = models.ImageField(upload_to='post_images/', storage=media_storage, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.post
@@ -27,6 +58,21 @@ class Comment(models.Model):
     comment = models.CharField(max_length=100)
     creator = models.ForeignKey(User, on_delete=models.CASCADE)
     the_video = models.ForeignKey(Video, related_name='comments',on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+    # replies: see threads.py for how path and depth are kept
+    parent = models.ForeignKey('self', related_name='replies', null=True, blank=True, on_delete=models.CASCADE)
+    path = models.CharField(max_length=255, blank=True)
+    depth = models.PositiveSmallIntegerField(default=0)
+    # direct replies only
+    reply_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['the_video', 'id'], name='comment_video_id_idx'),
+            models.Index(fields=['path'], name='comment_path_idx'),
+            models.Index(fields=['the_video', 'depth', 'id'], name='comment_video_depth_id_idx'),
+            models.Index(fields=['the_video', 'depth', 'reply_count', 'id'], name='comment_video_top_idx'),
+        ]
 
     def __str__(self):
         return self.comment
@@ -35,11 +81,205 @@ class Comment(models.Model):
 class Subscription(models.Model):
     subscriber = models.ForeignKey(User, related_name='subscriber',on_delete=models.CASCADE)
     subscribed_to = models.ForeignKey(User, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subscriber', 'subscribed_to'], name='unique_subscription'),
+        ]
 
     def __str__(self):
         return f"subscriber: {self.subscriber} - subscribed_to: {self.subscribed_to} "
     
-    
 
-    
+class Profile(models.Model):
+    """
+    Per-user counters kept in step with Subscription and Video writes, so
+    they can be shown without COUNT(*) queries.
+    """
+    user = models.OneToOneField(User, related_name='profile', on_delete=models.CASCADE)
+    subscriber_count = models.PositiveIntegerField(default=0)
+    video_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"profile: {self.user}"
+
+
+class TimelineEntry(models.Model):
+    """
+    A video materialized into a subscriber's feed when it was published.
+    created_at is copied from the video so a timeline pages on its own index.
+    """
+    owner = models.ForeignKey(User, related_name='timeline', on_delete=models.CASCADE)
+    video = models.ForeignKey(Video, related_name='timeline_entries', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'video'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'created_at', 'video'], name='timeline_owner_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.owner}: {self.video_id}"
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    creator = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    title = models.CharField(max_length=40)
+    desc = models.CharField(max_length=100)
+    total_size = models.PositiveBigIntegerField()
+    # merged [start, end) byte ranges already on disk
+    received = models.JSONField(default=list)
+    video = models.OneToOneField(Video, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"upload: {self.filename} ({self.total_size} bytes)"
+
+
+class Rendition(models.Model):
+    """One HLS variant of a video: a playlist and its segments under uploads/hls/<video>/."""
+    video = models.ForeignKey(Video, related_name='renditions', on_delete=models.CASCADE)
+    name = models.CharField(max_length=20)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    bandwidth = models.PositiveIntegerField()
+    playlist = models.FileField(max_length=255)
+    segment_duration = models.FloatField()
+    segment_count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['video', 'name'], name='unique_rendition'),
+        ]
+
+    def __str__(self):
+        return f"{self.video_id}: {self.name}"
+
+
+class Blob(models.Model):
+    """A file in the content-addressed store and how many fields point at it."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by `manage.py run_workers` (see jobs.py).
+    `key` groups jobs that belong to one object, e.g. "video:12".
+    """
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=50)
+    key = models.CharField(max_length=100, blank=True, db_index=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.key} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The stored response to a write sent with an Idempotency-Key header,
+    replayed when the same user sends the key to the same endpoint again
+    (see idempotency.py).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    # sha256 of the request body the key was first used with
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.scope} {self.key}"
+
+
+class ViewRollup(models.Model):
+    """Views and seconds watched of one video in one clock hour, written by analytics.flush()."""
+    video = models.ForeignKey(Video, related_name='view_rollups', on_delete=models.CASCADE)
+    hour = models.DateTimeField()
+    views = models.PositiveBigIntegerField(default=0)
+    watch_seconds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['video', 'hour'], name='unique_view_rollup'),
+        ]
+        indexes = [
+            # trending reads a range of hours and sums views per video
+            models.Index(fields=['hour', 'video', 'views'], name='viewrollup_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.video_id} @ {self.hour}: {self.views} views"
+
+
+class VideoScore(models.Model):
+    """A video's place in the trending ranking, rewritten by ranking.rank()."""
+    video = models.OneToOneField(Video, related_name='score', on_delete=models.CASCADE)
+    score = models.FloatField()
+    rank = models.PositiveIntegerField(unique=True)
+
+    def __str__(self):
+        return f"#{self.rank}: {self.video_id} ({self.score:.3f})"
+
+
+class Recommendation(models.Model):
+    """A video recommended to a user, best first by rank, rewritten by ranking.rank()."""
+    # unique_recommendation_rank already indexes user first
+    user = models.ForeignKey(User, related_name='recommendations', on_delete=models.CASCADE, db_index=False)
+    video = models.ForeignKey(Video, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+    rank = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} #{self.rank}: {self.video_id}"
+
+
+class TokenRevocation(models.Model):
+    """Tokens issued to the user before revoked_at are refused (see authentication.py)."""
+    user = models.OneToOneField(User, related_name='token_revocation', on_delete=models.CASCADE)
+    revoked_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user_id} revoked at {self.revoked_at}"
@@ -0,0 +1,316 @@
+import datetime
+import json
+from base64 import b64decode, b64encode
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .models import Subscription, TimelineEntry
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder truncates to milliseconds, which would skip rows on seek
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on an ordered tuple of columns instead of
+    using OFFSET, so page 10,000 costs the same as page 1.
+
+    `ordering` works like `order_by()` and must end with a unique column
+    (usually `id`). Nullable columns sort last in both directions of travel.
+    """
+
+    ordering = ('-id',)
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor, ordering = self._start(queryset, request)
+        results = self.fetch(queryset, ordering, cursor['p'] if cursor else None, self.page_size + 1)
+        return self._finish(results, cursor)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() for async views."""
+        cursor, ordering = self._start(queryset, request)
+        results = await self.afetch(queryset, ordering, cursor['p'] if cursor else None, self.page_size + 1)
+        return self._finish(results, cursor)
+
+    def _start(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+
+        cursor = self.decode_cursor(request)
+        self.reverse = cursor is not None and cursor['r']
+        ordering = self.ordering if not self.reverse else [self._flip(field) for field in self.ordering]
+        return cursor, ordering
+
+    def _finish(self, results, cursor):
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        return self.page
+
+    def fetch(self, queryset, ordering, position, limit):
+        """Return up to `limit` rows strictly after `position` in `ordering`."""
+        order_by = [self._order_expression(field) for field in ordering]
+        results = []
+        for segment in self._segments(queryset.model, ordering, position):
+            results += queryset.filter(segment).order_by(*order_by)[:limit - len(results)]
+            if len(results) >= limit:
+                break
+        return results
+
+    async def afetch(self, queryset, ordering, position, limit):
+        """fetch() through the async ORM."""
+        if type(self).fetch is not KeysetPagination.fetch:
+            # subclasses that merge sources override the synchronous fetch()
+            return await sync_to_async(self.fetch)(queryset, ordering, position, limit)
+        order_by = [self._order_expression(field) for field in ordering]
+        results = []
+        for segment in self._segments(queryset.model, ordering, position):
+            results += [row async for row in queryset.filter(segment).order_by(*order_by)[:limit - len(results)]]
+            if len(results) >= limit:
+                break
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size,
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse):
+        position = [self._value(instance, field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps({'p': position, 'r': reverse}, cls=CursorEncoder, separators=(',', ':'))
+        encoded = b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(b64decode(encoded.encode('ascii')).decode('ascii'))
+            position = payload['p']
+            if len(position) != len(self.ordering):
+                raise ValueError
+            payload['p'] = [
+                None if value is None else self._field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+            payload['r'] = bool(payload.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        return payload
+
+    def _segments(self, model, ordering, position):
+        """
+        Split "rows after `position`" into filters that are each a single
+        index range, to be read in order. A nullable leading column is split
+        into its non-NULL and NULL runs; an OR across them would make the
+        planner sort every matching row instead of walking the index.
+        """
+        lead, rest = ordering[0], ordering[1:]
+        name = lead.lstrip('-')
+        descending = lead.startswith('-')
+        nullable = model._meta.get_field(name).null
+        non_null, nulls = Q(**{f'{name}__isnull': False}), Q(**{f'{name}__isnull': True})
+
+        if position is None:
+            # ORDER BY alone already walks the index in the right order
+            return [Q()]
+
+        value, tail = position[0], self._after(rest, position[1:])
+        if value is None:
+            # NULLs sort last when descending and first when ascending
+            return [nulls & tail] if descending else [nulls & tail, non_null]
+
+        bound, strict = ('lte', 'lt') if descending else ('gte', 'gt')
+        # the redundant bound on the leading column gives the planner a range
+        segment = Q(**{f'{name}__{bound}': value}) & (Q(**{f'{name}__{strict}': value}) | (Q(**{name: value}) & tail))
+        return [segment, nulls] if nullable and descending else [segment]
+
+    def _after(self, ordering, position):
+        """(a > x) OR (a = x AND b > y) OR ... over non-null columns."""
+        if not ordering:
+            return Q(pk__in=[])
+        name = ordering[0].lstrip('-')
+        strict = 'lt' if ordering[0].startswith('-') else 'gt'
+        condition = Q(**{f'{name}__{strict}': position[0]})
+        if len(ordering) > 1:
+            condition |= Q(**{name: position[0]}) & self._after(ordering[1:], position[1:])
+        return condition
+
+    def _order_expression(self, field):
+        name = field.lstrip('-')
+        if field.startswith('-'):
+            return F(name).desc(nulls_last=True)
+        return F(name).asc(nulls_first=True)
+
+    def _field(self, name):
+        return self.model._meta.get_field(name)
+
+    def _value(self, instance, name):
+        if isinstance(instance, dict):
+            return instance[name]
+        return getattr(instance, self._field(name).attname)
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+
+class VideoPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+
+
+class PostPagination(KeysetPagination):
+    ordering = ('-id',)
+
+
+class CommentPagination(KeysetPagination):
+    ordering = ('-id',)
+
+
+class TopCommentPagination(KeysetPagination):
+    # reply counts move while a client pages, so a page can repeat or skip
+    # a comment that gained replies; acceptable for a "top" listing
+    ordering = ('-reply_count', '-id')
+
+
+class ThreadPagination(KeysetPagination):
+    # paths are unique and sort a thread in reading order (see threads.py)
+    ordering = ('path',)
+    max_page_size = 500
+
+
+class RankPagination(KeysetPagination):
+    # ranks are rewritten wholesale by ranking.rank(), so a cursor held
+    # across a re-rank continues from the same position in the new ranking
+    ordering = ('rank',)
+
+
+class FeedPagination(VideoPagination):
+    """
+    Pages a subscription feed by merging two index-ordered sources: the
+    reader's materialized timeline and videos from followed creators that
+    were too large to fan out. Each source is read with the same keyset
+    and LIMIT, so a page costs O(page size) whatever the feed length.
+    """
+
+    def fetch(self, queryset, ordering, position, limit):
+        user = self.request.user
+        entry_ordering = [field.replace('id', 'video_id') for field in ordering]
+        entries = TimelineEntry.objects.filter(owner_id=user.id).values_list('video_id', flat=True)
+        video_ids = super().fetch(entries, entry_ordering, position, limit)
+
+        materialized = list(queryset.filter(pk__in=video_ids)) if video_ids else []
+        followed = Subscription.objects.filter(subscriber_id=user.id).values('subscribed_to_id')
+        on_read = super().fetch(queryset.filter(fanout_on_read=True, creator_id__in=followed), ordering, position, limit)
+
+        rows = {video.pk: video for video in materialized + on_read}.values()
+        descending = ordering[0].startswith('-')
+        # sort like the database: NULL created_at last when descending, first when ascending
+        merged = sorted(
+            rows,
+            key=lambda video: (video.created_at is not None, video.created_at or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc), video.pk),
+            reverse=descending,
+        )
+        return merged[:limit]
+
+
+class SearchPagination(BasePagination):
+    """
+    Page numbers for ranked search results. Relevance is computed per
+    query, so there is no indexed key to seek on; FTS5 scores every match
+    anyway, which keeps OFFSET cheap by comparison.
+    """
+
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    page_query_param = 'page'
+
+    def paginate(self, request, fetch):
+        """Call `fetch(limit, offset)` for the requested page and return its rows."""
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        try:
+            self.page_number = _positive_int(request.query_params.get(self.page_query_param, 1), strict=True)
+        except ValueError:
+            raise NotFound('Invalid page')
+        rows = fetch(self.page_size + 1, (self.page_number - 1) * self.page_size)
+        self.has_next = len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number == 1:
+            return None
+        if self.page_number == 2:
+            return remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(self.base_url, self.page_query_param, self.page_number - 1)
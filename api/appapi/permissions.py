@@ -10,5 +10,5 @@ class IsOwnerOrAdmin(BasePermission):
     """
 
     def has_object_permission(self, request, view, obj):
-        # Allow if the user is the creator or an admin
-        return obj.creator == request.user or request.user.is_staff
+        # Allow if the user is the creator or an admin; ids, so the creator row is never loaded
+        return obj.creator_id == request.user.id or request.user.is_staff
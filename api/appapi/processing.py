@@ -0,0 +1,240 @@
+"""
+Background processing for uploaded videos.
+
+Saving a new Video queues the jobs in UPLOAD_JOBS (see signals.py), and
+extracting metadata queues HLS packaging, which needs the video's
+dimensions. Each job fills in part of the row, and once none of
+VIDEO_JOBS is outstanding the video's status becomes READY, or FAILED if
+any of them gave up.
+
+Metadata comes from ffprobe when it is installed and otherwise from the
+MP4/QuickTime headers, read directly; posters need ffmpeg and are skipped
+without it.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+
+from django.core.files import File
+from django.dispatch import receiver
+
+from . import hls, jobs
+from .models import Job, Video
+from .storage import is_blob
+
+UPLOAD_JOBS = ('extract_metadata', 'poster', 'content_hash')
+VIDEO_JOBS = UPLOAD_JOBS + ('package_hls',)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# a moov box this large is not a real video's index
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+SUBPROCESS_TIMEOUT = 120
+
+
+class ProbeError(ValueError):
+    pass
+
+
+def queue(video):
+    for kind in UPLOAD_JOBS:
+        jobs.enqueue(kind, key=f'video:{video.pk}', video_id=video.pk)
+
+
+def _video(video_id):
+    try:
+        video = Video.objects.get(pk=video_id)
+    except Video.DoesNotExist:
+        raise jobs.PermanentError(f'video {video_id} no longer exists')
+    if video.status == Video.PENDING:
+        video.status = Video.PROCESSING
+        video.save(update_fields=['status', 'updated_at'])
+    return video
+
+
+@jobs.register('extract_metadata')
+def extract_metadata(video_id):
+    video = _video(video_id)
+    try:
+        info = probe(video.video.path)
+    except (ProbeError, FileNotFoundError) as exc:
+        raise jobs.PermanentError(str(exc))
+    for field, value in info.items():
+        setattr(video, field, value)
+    video.save(update_fields=[*info, 'updated_at'])
+    jobs.enqueue('package_hls', key=f'video:{video.pk}', video_id=video.pk)
+
+
+@jobs.register('poster')
+def poster(video_id):
+    video = _video(video_id)
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return
+    offset = min(1.0, (video.duration or 0) / 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'poster.jpg')
+        subprocess.run(
+            [ffmpeg, '-v', 'error', '-ss', str(offset), '-i', video.video.path,
+             '-frames:v', '1', '-vf', 'scale=640:-2', '-y', out],
+            check=True, timeout=SUBPROCESS_TIMEOUT,
+        )
+        with open(out, 'rb') as f:
+            video.poster.save(f'{video.pk}.jpg', File(f), save=False)
+    video.save(update_fields=['poster', 'updated_at'])
+
+
+@jobs.register('content_hash')
+def content_hash(video_id):
+    video = _video(video_id)
+    if is_blob(video.video.name):
+        # content-addressed storage already named the file by its SHA-256
+        video.content_hash = os.path.splitext(os.path.basename(video.video.name))[0]
+        video.save(update_fields=['content_hash', 'updated_at'])
+        return
+    digest = hashlib.sha256()
+    try:
+        f = video.video.open('rb')
+    except FileNotFoundError as exc:
+        raise jobs.PermanentError(str(exc))
+    with f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    video.content_hash = digest.hexdigest()
+    video.save(update_fields=['content_hash', 'updated_at'])
+
+
+@jobs.register('package_hls')
+def package_hls(video_id):
+    hls.package(_video(video_id))
+
+
+@receiver(jobs.job_finished)
+def update_video_status(sender, job, **kwargs):
+    if job.kind not in VIDEO_JOBS or 'video_id' not in job.payload:
+        return
+    # every job records its own outcome before this runs, so whichever
+    # finishes last sees no sibling outstanding
+    siblings = Job.objects.filter(key=job.key, kind__in=VIDEO_JOBS)
+    if siblings.filter(status__in=[Job.QUEUED, Job.RUNNING]).exists():
+        return
+    status = Video.FAILED if siblings.filter(status=Job.FAILED).exists() else Video.READY
+    video = Video.objects.filter(pk=job.payload['video_id']).first()
+    if video is not None and video.status != status:
+        video.status = status
+        video.save(update_fields=['status', 'updated_at'])
+
+
+def probe(path):
+    """Return duration, width, height and codec of the video at `path`."""
+    if shutil.which('ffprobe'):
+        return _ffprobe(path)
+    try:
+        return _mp4_probe(path)
+    except struct.error:
+        raise ProbeError('truncated MP4 header')
+
+
+def _ffprobe(path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+        capture_output=True, timeout=SUBPROCESS_TIMEOUT,
+    )
+    if result.returncode != 0:
+        raise ProbeError(result.stderr.decode(errors='replace').strip() or 'ffprobe failed')
+    data = json.loads(result.stdout)
+    stream = next((s for s in data.get('streams', []) if s.get('codec_type') == 'video'), None)
+    if stream is None:
+        raise ProbeError('no video stream')
+    duration = data.get('format', {}).get('duration') or stream.get('duration')
+    return {
+        'duration': float(duration) if duration else None,
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'codec': stream.get('codec_name', '')[:16],
+    }
+
+
+def _boxes(data, start=0, end=None):
+    """Yield (type, payload start, box end) for the ISO-BMFF boxes in data[start:end]."""
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, start)
+        header = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', data, start + 8)
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            raise ProbeError('truncated box')
+        yield kind, start + header, start + size
+        start += size
+
+
+def _child(data, start, end, kind):
+    return next(((s, e) for k, s, e in _boxes(data, start, end) if k == kind), None)
+
+
+def _read_moov(path):
+    # walk the top-level boxes by seeking, since mdat can be gigabytes
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= size:
+            f.seek(offset)
+            box_size, kind = struct.unpack('>I4s', f.read(8))
+            header = 8
+            if box_size == 1:
+                box_size, = struct.unpack('>Q', f.read(8))
+                header = 16
+            elif box_size == 0:
+                box_size = size - offset
+            if box_size < header:
+                break
+            if kind == b'moov':
+                if box_size > MAX_MOOV_SIZE:
+                    raise ProbeError('moov box too large')
+                return f.read(box_size - header)
+            offset += box_size
+    raise ProbeError('not an MP4/QuickTime file')
+
+
+def _mp4_probe(path):
+    moov = _read_moov(path)
+    info = {'duration': None, 'width': None, 'height': None, 'codec': ''}
+
+    mvhd = _child(moov, 0, len(moov), b'mvhd')
+    if mvhd:
+        start = mvhd[0]
+        if moov[start] == 1:
+            timescale, duration = struct.unpack_from('>IQ', moov, start + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', moov, start + 12)
+        if timescale:
+            info['duration'] = duration / timescale
+
+    for kind, start, end in _boxes(moov):
+        if kind != b'trak':
+            continue
+        mdia = _child(moov, start, end, b'mdia')
+        hdlr = mdia and _child(moov, *mdia, b'hdlr')
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+            continue
+        tkhd = _child(moov, start, end, b'tkhd')
+        if tkhd:
+            offset = tkhd[0] + (88 if moov[tkhd[0]] == 1 else 76)
+            width, height = struct.unpack_from('>II', moov, offset)
+            # 16.16 fixed point
+            info['width'], info['height'] = width >> 16, height >> 16
+        minf = _child(moov, *mdia, b'minf')
+        stbl = minf and _child(moov, *minf, b'stbl')
+        stsd = stbl and _child(moov, *stbl, b'stsd')
+        if stsd:
+            info['codec'] = moov[stsd[0] + 12:stsd[0] + 16].decode('latin-1').strip()
+        return info
+    raise ProbeError('no video track')
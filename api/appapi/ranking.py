@@ -0,0 +1,299 @@
+"""
+Trending scores and recommendations, precomputed with NumPy.
+
+`rank()` loads the engagement signals as arrays, scores every video at
+once and rewrites two ranked tables that the API pages through by rank:
+
+- VideoScore: the RANKING['MAX_RANKED'] best videos by time-decayed
+  engagement. Recent views (hourly rollups, each hour decayed by its
+  age), comments and the creator's recent new subscribers (both decayed
+  by the video's age) are weighted by RANKING['WEIGHTS'].
+- Recommendation: per user, the best videos of the creators most
+  co-subscribed with the ones they follow. Creator similarity is the
+  cosine of their subscriber sets over the MAX_CREATORS most followed
+  creators; a user's affinity for a creator sums its similarity to
+  everyone they follow, and each candidate video scores
+  affinity * (1 + its normalized trending score).
+
+The `rank_videos` job runs rank() and schedules its next run
+RANKING['INTERVAL'] seconds later; `manage.py rank_videos --schedule`
+starts the cycle.
+"""
+
+import datetime
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import CharField, F
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from . import cache, jobs
+from .models import Job, Recommendation, Subscription, Video, VideoScore, ViewRollup
+
+# co-subscription pairs counted per NumPy batch, bounding memory
+PAIR_BATCH = 4_000_000
+# users scored, and their recommendations replaced, at a time
+USER_BATCH = 512
+# users per DELETE of stale recommendations
+DELETE_BATCH = 500
+
+
+def option(name):
+    defaults = {
+        'INTERVAL': 900,
+        'HALF_LIFE_HOURS': 24,
+        'VIEW_WINDOW_HOURS': 7 * 24,
+        'WEIGHTS': {'views': 1.0, 'comments': 5.0, 'subscriptions': 2.0},
+        'MAX_RANKED': 10000,
+        'MAX_CREATORS': 2000,
+        'MAX_SUBSCRIPTIONS_PER_USER': 200,
+        'CANDIDATE_CREATORS': 20,
+        'VIDEOS_PER_CREATOR': 5,
+        'RECOMMENDATIONS': 50,
+    }
+    return getattr(settings, 'RANKING', {}).get(name, defaults[name])
+
+
+def _decay(age_seconds):
+    return np.exp2(-np.maximum(age_seconds, 0) / (option('HALF_LIFE_HOURS') * 3600.0))
+
+
+def _columns(queryset, *fields):
+    """
+    `fields` of every row as one tuple per field. Read with a plain cursor:
+    the ORM's per-value conversion costs more than the scoring itself.
+    """
+    sql, params = queryset.values_list(*fields).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return tuple(zip(*rows)) if rows else tuple(() for _ in fields)
+
+
+def _stored(name):
+    # SQLite's adapter parses every datetime it returns one by one; take
+    # the stored UTC text instead and let _epoch() parse it in bulk
+    return Cast(name, CharField()) if connection.vendor == 'sqlite' else F(name)
+
+
+def _epoch(values):
+    """Seconds since the epoch, NaN for NULL, of datetimes as _stored() returned them."""
+    if isinstance(next((value for value in values if value is not None), None), datetime.datetime):
+        return np.array([value.timestamp() if value else np.nan for value in values], dtype=np.float64)
+    stamps = np.array(values, dtype='datetime64[us]')
+    return np.where(np.isnat(stamps), np.nan, stamps.astype(np.int64) / 1e6)
+
+
+def _lookup(keys, values):
+    """(index into sorted `keys` of each of `values`, whether it was found)."""
+    index = np.searchsorted(keys, values)
+    if not len(keys):
+        return index, np.zeros(len(values), dtype=bool)
+    return index, (index < len(keys)) & (keys[np.minimum(index, len(keys) - 1)] == values)
+
+
+def score_videos(now=None):
+    """(video ids, creator ids, scores) for every video that has not failed processing."""
+    now = now or timezone.now()
+    since = now - datetime.timedelta(hours=option('VIEW_WINDOW_HOURS'))
+    now = now.timestamp()
+    weights = option('WEIGHTS')
+    ids, creators, comment_counts, created = _columns(
+        Video.objects.exclude(status=Video.FAILED).order_by('pk'), 'pk', 'creator_id', 'comment_count', _stored('created_at'),
+    )
+    ids = np.array(ids, dtype=np.int64)
+    creators = np.array(creators, dtype=np.int64)
+    created = _epoch(created)
+    # videos without created_at count as brand new
+    age_decay = _decay(np.where(np.isnan(created), 0, now - created))
+
+    video_ids, hours, counts = _columns(ViewRollup.objects.filter(hour__gte=since), 'video_id', _stored('hour'), 'views')
+    index, found = _lookup(ids, np.array(video_ids, dtype=np.int64))
+    decayed = np.array(counts, dtype=np.float64) * _decay(now - _epoch(hours))
+    views = np.bincount(index[found], weights=decayed[found], minlength=len(ids))
+
+    # new subscribers per creator, decayed by when they subscribed
+    followed, when = _columns(Subscription.objects.all(), 'subscribed_to_id', _stored('updated_at'))
+    creator_keys, creator_index = np.unique(creators, return_inverse=True)
+    index, found = _lookup(creator_keys, np.array(followed, dtype=np.int64))
+    per_creator = np.bincount(index[found], weights=_decay(now - _epoch(when))[found], minlength=len(creator_keys))
+    momentum = per_creator[creator_index]
+
+    scores = (
+        weights['views'] * views
+        + (weights['comments'] * np.array(comment_counts, dtype=np.float64) + weights['subscriptions'] * momentum) * age_decay
+    )
+    return ids, creators, scores
+
+
+def _co_subscriptions(users, creators, k):
+    """k x k matrix counting the users who follow both creators; `users` must be sorted."""
+    counts = np.zeros(k * k, dtype=np.int64)
+    if not len(users):
+        return counts.reshape(k, k)
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    sizes = np.diff(np.r_[starts, len(users)])
+    # split the users so each batch generates about PAIR_BATCH pairs
+    cumulative = np.cumsum(sizes.astype(np.int64) ** 2)
+    bounds = np.unique(np.r_[0, np.searchsorted(cumulative, np.arange(PAIR_BATCH, cumulative[-1], PAIR_BATCH)), len(sizes)])
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        group_sizes = sizes[first:last]
+        members = np.arange(starts[first], starts[first] + group_sizes.sum())
+        repeats = np.repeat(group_sizes, group_sizes)
+        # every member paired with every member of its group, itself excluded
+        left = np.repeat(members, repeats)
+        group_start = np.repeat(np.repeat(starts[first:last], group_sizes), repeats)
+        offset = np.arange(len(left)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        right = group_start + offset
+        keep = left != right
+        counts += np.bincount(creators[left[keep]] * k + creators[right[keep]], minlength=k * k)
+    return counts.reshape(k, k)
+
+
+def creator_similarity(subscriber_ids, creator_ids):
+    """
+    (creator ids, k x k cosine similarity) over the MAX_CREATORS most
+    followed creators, from parallel arrays of subscriptions.
+    """
+    if not len(creator_ids):
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+    keys, index, followers = np.unique(creator_ids, return_inverse=True, return_counts=True)
+    top = np.sort(np.argsort(-followers, kind='stable')[:option('MAX_CREATORS')])
+    dense = np.full(len(keys), -1)
+    dense[top] = np.arange(len(top))
+    mapped = dense[index]
+    keep = mapped >= 0
+    users, creators = subscriber_ids[keep], mapped[keep]
+
+    # sample at most MAX_SUBSCRIPTIONS_PER_USER per user so heavy followers stay affordable
+    order = np.lexsort((creators, users))
+    users, creators = users[order], creators[order]
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]]) if len(users) else np.zeros(0, dtype=np.int64)
+    position = np.arange(len(users)) - np.repeat(starts, np.diff(np.r_[starts, len(users)]))
+    keep = position < option('MAX_SUBSCRIPTIONS_PER_USER')
+    users, creators = users[keep], creators[keep]
+
+    k = len(top)
+    counts = _co_subscriptions(users, creators, k).astype(np.float32)
+    degree = np.bincount(creators, minlength=k).astype(np.float32)
+    norm = np.sqrt(np.outer(degree, degree))
+    similarity = np.divide(counts, norm, out=np.zeros_like(counts), where=norm > 0)
+    np.fill_diagonal(similarity, 0)
+    return keys[top], similarity
+
+
+def _top_videos(video_ids, video_creators, scores, creator_keys):
+    """k x VIDEOS_PER_CREATOR arrays of each ranked creator's best video ids (-1 padded) and scores."""
+    per_creator = option('VIDEOS_PER_CREATOR')
+    k = len(creator_keys)
+    top_ids = np.full((k, per_creator), -1, dtype=np.int64)
+    top_scores = np.zeros((k, per_creator))
+    if not k or not len(video_ids):
+        return top_ids, top_scores
+    position, found = _lookup(creator_keys, video_creators)
+    creator, ids, video_scores = position[found], video_ids[found], scores[found]
+    order = np.lexsort((-ids, -video_scores, creator))
+    creator, ids, video_scores = creator[order], ids[order], video_scores[order]
+    starts = np.flatnonzero(np.r_[True, creator[1:] != creator[:-1]]) if len(creator) else np.zeros(0, dtype=np.int64)
+    slot = np.arange(len(creator)) - np.repeat(starts, np.diff(np.r_[starts, len(creator)]))
+    keep = slot < per_creator
+    top_ids[creator[keep], slot[keep]] = ids[keep]
+    top_scores[creator[keep], slot[keep]] = video_scores[keep]
+    return top_ids, top_scores
+
+
+def recommend(subscriber_ids, creator_ids, video_ids, video_creators, scores):
+    """
+    Yield (user ids, rows) per batch of users who follow a ranked creator,
+    rows being (user id, video id, score, rank) with rank 1 the best.
+    """
+    creator_keys, similarity = creator_similarity(subscriber_ids, creator_ids)
+    k = len(creator_keys)
+    if not k:
+        return
+    top_ids, top_scores = _top_videos(video_ids, video_creators, scores, creator_keys)
+    top_scores = 1 + top_scores / (scores.max() if len(scores) and scores.max() > 0 else 1)
+    candidates = min(option('CANDIDATE_CREATORS'), k)
+    limit = option('RECOMMENDATIONS')
+
+    position, ranked = _lookup(creator_keys, creator_ids)
+    users, user_index = np.unique(subscriber_ids[ranked], return_inverse=True)
+    order = np.argsort(user_index, kind='stable')
+    user_index, followed = user_index[order], position[ranked][order]
+    for start in range(0, len(users), USER_BATCH):
+        batch = users[start:start + USER_BATCH]
+        first, last = np.searchsorted(user_index, [start, start + USER_BATCH])
+        rows, columns = user_index[first:last] - start, followed[first:last]
+        # a user's affinity is the sum of the similarity rows of the creators
+        # they follow; every user here follows at least one
+        affinity = np.add.reduceat(similarity[columns], np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]), axis=0)
+        # nothing from creators already followed, or from the user themself
+        affinity[rows, columns] = 0
+        own, is_creator = _lookup(creator_keys, batch)
+        affinity[np.flatnonzero(is_creator), own[is_creator]] = 0
+
+        best = np.argpartition(-affinity, candidates - 1, axis=1)[:, :candidates]
+        weight = np.take_along_axis(affinity, best, axis=1)
+        ids = top_ids[best].reshape(len(batch), -1)
+        combined = (weight[:, :, None] * top_scores[best]).reshape(len(batch), -1)
+        combined[(ids < 0) | (combined <= 0)] = -np.inf
+        order = np.argsort(-combined, axis=1, kind='stable')[:, :limit]
+        ids, combined = np.take_along_axis(ids, order, axis=1), np.take_along_axis(combined, order, axis=1)
+        # the -inf fillers sort last, so a user's picks are the first columns
+        user, slot = np.nonzero(np.isfinite(combined))
+        yield batch, zip(batch[user].tolist(), ids[user, slot].tolist(), combined[user, slot].tolist(), (slot + 1).tolist())
+
+
+def rank(now=None):
+    """Recompute both ranked tables. Returns (videos ranked, users with recommendations)."""
+    video_ids, video_creators, scores = score_videos(now)
+    order = np.lexsort((-video_ids, -scores))[:option('MAX_RANKED')]
+    with transaction.atomic():
+        VideoScore.objects.all().delete()
+        _insert(VideoScore, ('video_id', 'score', 'rank'),
+                zip(video_ids[order].tolist(), scores[order].tolist(), range(1, len(order) + 1)))
+    cache.bump('ranking')
+
+    subscribers, followed = (
+        np.array(column, dtype=np.int64) for column in _columns(Subscription.objects.all(), 'subscriber_id', 'subscribed_to_id')
+    )
+    recommended, seen = set(), set()
+    for users, rows in recommend(subscribers, followed, video_ids, video_creators, scores):
+        rows = list(rows)
+        # one transaction per batch of users: each user sees the old list or the new one
+        with transaction.atomic():
+            Recommendation.objects.filter(user_id__in=users.tolist()).delete()
+            _insert(Recommendation, ('user_id', 'video_id', 'score', 'rank'), rows)
+        seen.update(users.tolist())
+        recommended.update(user for user, _, _, _ in rows)
+    # users who no longer follow any ranked creator fall back to trending
+    stale = list(set(Recommendation.objects.values_list('user_id', flat=True).distinct()) - seen)
+    for start in range(0, len(stale), DELETE_BATCH):
+        Recommendation.objects.filter(user_id__in=stale[start:start + DELETE_BATCH]).delete()
+    return len(order), len(recommended)
+
+
+def _insert(model, columns, rows):
+    # hundreds of thousands of rows per run: skip building model instances
+    table = connection.ops.quote_name(model._meta.db_table)
+    sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["%s"] * len(columns))})'
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def schedule(delay=0):
+    """Queue the next rank_videos job unless one is already waiting."""
+    if not Job.objects.filter(kind='rank_videos', status=Job.QUEUED).exists():
+        jobs.enqueue('rank_videos', key='ranking', delay=delay)
+
+
+@jobs.register('rank_videos')
+def run_ranking_job():
+    # queued first, so a failed run does not stop the cycle
+    schedule(option('INTERVAL'))
+    start = time.monotonic()
+    ranked, users = rank()
+    jobs.logger.info('ranked %s videos and recommended to %s users in %.1fs', ranked, users, time.monotonic() - start)
@@ -0,0 +1,127 @@
+"""
+Primary/replica database routing.
+
+With settings.DATABASE_REPLICA set, ReplicaRouter sends the reads of
+GET/HEAD/OPTIONS requests to that alias and everything else (writes,
+reads in write requests, background jobs and commands) to the primary.
+
+Replicas lag behind, so a user who just wrote would not see their own
+comment on the next GET. After a successful write request,
+ReplicaMiddleware pins the user to the primary for DATABASE_REPLICA_PIN
+seconds. The pin is kept next to the cache versions, in the store every
+process shares (API_CACHE['VERSIONS'], see cache.py), so whichever worker
+serves the next read honours it. It is checked once request.user is
+known, i.e. after DRF authentication; queries before that (e.g. the token
+revocation lookup) still read from the replica.
+"""
+
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from . import cache
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_route = contextvars.ContextVar('db_route', default=None)
+
+
+def _pin_key(user_id):
+    return f'db:pinned:{user_id}'
+
+
+def pin(user_id):
+    cache.get_version_store().set(_pin_key(user_id), True, getattr(settings, 'DATABASE_REPLICA_PIN', 10))
+
+
+def _known_user(request):
+    # Django's AuthenticationMiddleware leaves a lazy session lookup here
+    # until DRF replaces it with the authenticated user
+    user = request.__dict__.get('user')
+    if user is None or isinstance(user, SimpleLazyObject):
+        return None
+    return user
+
+
+class _Route:
+    def __init__(self, request):
+        self.request = request
+        self.replica = request.method in SAFE_METHODS
+        self.checked = False
+
+    def use_replica(self):
+        if self.replica and not self.checked:
+            user = _known_user(self.request)
+            if user is not None:
+                self.checked = True
+                if user.is_authenticated and cache.get_version_store().get(_pin_key(user.id)):
+                    self.replica = False
+        return self.replica
+
+
+def use_replica():
+    """Whether reads in the current context may go to the replica."""
+    route = _route.get()
+    return route is not None and route.use_replica()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = getattr(settings, 'DATABASE_REPLICA', None)
+        if replica and use_replica():
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary
+        return db != getattr(settings, 'DATABASE_REPLICA', None)
+
+
+class ReplicaMiddleware:
+    """Scopes routing to the request and pins users to the primary after their writes."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _route.set(_Route(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _route.reset(token)
+        self.pin_writer(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = _route.set(_Route(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _route.reset(token)
+        if request.method not in SAFE_METHODS:
+            # request.user may still be a lazy session lookup
+            await sync_to_async(self.pin_writer)(request, response)
+        return response
+
+    def pin_writer(self, request, response):
+        replica = getattr(settings, 'DATABASE_REPLICA', None)
+        if replica and request.method not in SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin(user.id)
@@ -0,0 +1,198 @@
+"""
+Full-text search over video titles and descriptions and post text.
+
+On SQLite the documents live in the FTS5 table `appapi_search` (created by
+migration 0010), ranked with bm25 and kept in step with Video and Post by
+the signals in signals.py. A document's rowid encodes what it indexes,
+pk * 2 for a video and pk * 2 + 1 for a post, so updates and deletes are
+rowid lookups. On other databases, or if the table is missing, `search()`
+falls back to icontains filters.
+"""
+
+import html
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Post, Video
+
+TABLE = 'appapi_search'
+KINDS = {'video': 0, 'post': 1}
+# bm25 column weights: a match in a title counts ten times one in the body
+WEIGHTS = (10.0, 1.0)
+# control characters, stripped from indexed text, mark matches safely
+# until the text has been HTML-escaped
+MARK_START, MARK_END = '\x02', '\x03'
+SNIPPET_TOKENS = 16
+# bm25 scores every match, so a very common word would score most of the
+# table; only the newest RANK_WINDOW matches are ranked
+RANK_WINDOW = 10000
+INDEX_BATCH_SIZE = 2000
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+_table_exists = {}
+
+
+def available():
+    if connection.vendor != 'sqlite':
+        return False
+    database = connection.settings_dict['NAME']
+    if database not in _table_exists:
+        _table_exists[database] = TABLE in connection.introspection.table_names()
+    return _table_exists[database]
+
+
+def _rowid(kind, pk):
+    return pk * 2 + KINDS[kind]
+
+
+def _clean(text):
+    return (text or '').replace(MARK_START, '').replace(MARK_END, '')
+
+
+def document(instance):
+    """(rowid, title, body) for a Video or Post."""
+    if isinstance(instance, Video):
+        return _rowid('video', instance.pk), _clean(instance.title), _clean(instance.desc)
+    return _rowid('post', instance.pk), '', _clean(instance.post)
+
+
+def index(*instances):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {TABLE} (rowid, title, body) VALUES (%s, %s, %s)',
+            [document(instance) for instance in instances],
+        )
+
+
+def remove(kind, pk):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [_rowid(kind, pk)])
+
+
+def rebuild():
+    """Reindex every video and post; returns the number of documents."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        count = 0
+        for queryset, kind in ((Video.objects.values_list('pk', 'title', 'desc'), 'video'),
+                               (Post.objects.values_list('pk', 'post'), 'post')):
+            batch = []
+            for row in queryset.iterator(chunk_size=INDEX_BATCH_SIZE):
+                if kind == 'video':
+                    batch.append((_rowid(kind, row[0]), _clean(row[1]), _clean(row[2])))
+                else:
+                    batch.append((_rowid(kind, row[0]), '', _clean(row[1])))
+                if len(batch) == INDEX_BATCH_SIZE:
+                    cursor.executemany(f'INSERT INTO {TABLE} (rowid, title, body) VALUES (%s, %s, %s)', batch)
+                    count += len(batch)
+                    batch = []
+            cursor.executemany(f'INSERT INTO {TABLE} (rowid, title, body) VALUES (%s, %s, %s)', batch)
+            count += len(batch)
+        # merge the index b-trees written by the inserts above
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return count
+
+
+def tokens(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+def match_expression(query):
+    """
+    FTS5 MATCH expression for free text: every word must appear, the last
+    one as a prefix so results keep up with typing. Words are quoted, so
+    FTS5 operators in user input are searched for rather than obeyed.
+    """
+    words = tokens(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _marked(text):
+    return html.escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def search(query, kind=None, limit=20, offset=0):
+    """
+    Return up to `limit` hits, best first, as dicts with `kind`, `id`,
+    `score` (higher is better) and HTML-escaped `title`/`snippet` with
+    matches wrapped in <mark>. Past RANK_WINDOW matches, older documents
+    are left out of the ranking.
+    """
+    if not tokens(query):
+        return []
+    if not available():
+        return _fallback(query, kind, limit, offset)
+
+    where = f'{TABLE} MATCH %s'
+    params = [match_expression(query)]
+    if kind is not None:
+        where += ' AND rowid %% 2 = %s'
+        params.append(KINDS[kind])
+    with connection.cursor() as cursor:
+        # walking matches in rowid order is cheap, scoring them is not
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE} WHERE {where} ORDER BY rowid DESC LIMIT 1 OFFSET %s',
+            [*params, RANK_WINDOW],
+        )
+        floor = cursor.fetchone()
+    if floor is not None:
+        where += ' AND rowid > %s'
+        params.append(floor[0])
+    sql = (
+        f"SELECT rowid, bm25({TABLE}, %s, %s), "
+        f"highlight({TABLE}, 0, %s, %s), "
+        f"snippet({TABLE}, 1, %s, %s, '…', {SNIPPET_TOKENS}) "
+        f"FROM {TABLE} WHERE {where} ORDER BY 2 LIMIT %s OFFSET %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*WEIGHTS, MARK_START, MARK_END, MARK_START, MARK_END, *params, limit, offset])
+        rows = cursor.fetchall()
+    return [
+        {
+            'kind': 'post' if rowid % 2 else 'video',
+            'id': rowid // 2,
+            # bm25() is lower-is-better and negative for matches
+            'score': -rank,
+            'title': _marked(title),
+            'snippet': _marked(body),
+        }
+        for rowid, rank, title, body in rows
+    ]
+
+
+def _highlight(text, words):
+    pattern = re.compile(r'\b(' + '|'.join(re.escape(word) for word in words) + r')', re.IGNORECASE)
+    return _marked(pattern.sub(lambda m: MARK_START + m.group(0) + MARK_END, text))
+
+
+def _fallback(query, kind, limit, offset):
+    """Unranked icontains search, newest first, for databases without FTS5."""
+    words = tokens(query)
+    hits = []
+    if kind in (None, 'video'):
+        videos = Video.objects.all()
+        for word in words:
+            videos = videos.filter(Q(title__icontains=word) | Q(desc__icontains=word))
+        hits += [('video', pk, title, desc) for pk, title, desc in
+                 videos.order_by('-id').values_list('pk', 'title', 'desc')[:offset + limit]]
+    if kind in (None, 'post'):
+        posts = Post.objects.all()
+        for word in words:
+            posts = posts.filter(post__icontains=word)
+        hits += [('post', pk, '', text) for pk, text in posts.order_by('-id').values_list('pk', 'post')[:offset + limit]]
+    return [
+        {'kind': hit_kind, 'id': pk, 'score': None, 'title': _highlight(title, words), 'snippet': _highlight(body, words)}
+        for hit_kind, pk, title, body in hits[offset:offset + limit]
+    ]
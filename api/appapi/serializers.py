@@ -1,9 +1,187 @@
+import abc
 from rest_framework import serializers
-from .models import Video, Post, Comment, Subscription 
+from .models import Video, Post, Comment, Subscription, UploadSession, Profile
 from django.utils import timezone
 from django.contrib.auth.models import User
 
 from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.urls import reverse
+from operator import itemgetter
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import filepath_to_uri
+from . import authentication, images, threads
+from .uploads import max_size, missing_ranges
+
+
+class BatchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that BulkListSerializer points at objects loaded
+    for the whole batch, so validating N items does not cost N lookups.
+    """
+    batch = None
+
+    def load(self, values):
+        pk_field = self.get_queryset().model._meta.pk
+        pks = set()
+        for value in values:
+            try:
+                pks.add(pk_field.to_python(value))
+            except (DjangoValidationError, TypeError):
+                pass  # reported per item by to_internal_value()
+        self.batch = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value(self, data):
+        if self.batch is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except (DjangoValidationError, TypeError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self.batch[pk]
+        except (KeyError, TypeError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    many=True serializer for batch writes. An invalid item does not fail
+    the batch: `validated_data` holds the valid items, `valid_indexes`
+    their positions in the input and `item_errors` maps the position of
+    every other item to its errors. The child may define
+    prepare_batch(items) to load what its validate() needs in one go.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            message = self.error_messages['not_a_list'].format(input_type=type(data).__name__)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='not_a_list')
+        if not data:
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [self.error_messages['empty']]}, code='empty')
+        if self.max_length is not None and len(data) > self.max_length:
+            message = self.error_messages['max_length'].format(max_length=self.max_length)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='max_length')
+
+        items = [item for item in data if isinstance(item, dict)]
+        for name, field in self.child.fields.items():
+            if isinstance(field, BatchedPrimaryKeyRelatedField) and not field.read_only:
+                field.load(item[name] for item in items if name in item)
+        if hasattr(self.child, 'prepare_batch'):
+            self.child.prepare_batch(items)
+
+        validated, self.valid_indexes, self.item_errors = [], [], {}
+        for index, item in enumerate(data):
+            try:
+                validated.append(self.run_child_validation(item))
+            except serializers.ValidationError as exc:
+                self.item_errors[index] = exc.detail
+            else:
+                self.valid_indexes.append(index)
+        return validated
+
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets: on GET requests, `?fields=id,title` limits the
+    output to the named fields. The others are dropped before
+    serialization, so their values (hyperlinks, method fields, related
+    objects) are never computed. Unknown names are a 400.
+    """
+    fields_param = 'fields'
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return fields
+        param = getattr(request, 'query_params', request.GET).get(self.fields_param)
+        if not param:
+            return fields
+        requested = {name.strip() for name in param.split(',') if name.strip()}
+        unknown = requested - fields.keys()
+        if unknown:
+            raise serializers.ValidationError(
+                {self.fields_param: [f'Unknown field(s): {", ".join(sorted(unknown))}. '
+                                     f'Available: {", ".join(fields)}.']})
+        return {name: field for name, field in fields.items() if name in requested}
+
+
+class FlatSerializer(abc.ABC):
+    """
+    Read-only many=True serializer over `.values()` rows, for list pages
+    that would otherwise build a model instance (and its related ones)
+    per row only to read a few columns. Subclasses select `columns` and
+    map each output field to a function of the row in getters().
+    """
+    columns = ()
+
+    def __init__(self, rows, many=True, context=None):
+        assert many, 'FlatSerializer only serializes lists'
+        self.rows = rows
+        self.context = context or {}
+
+    @classmethod
+    def project(cls, queryset):
+        return queryset.values(*cls.columns)
+
+    @abc.abstractmethod
+    def getters(self):
+        """{output field: function of a row}, in output order."""
+
+    def get_fields(self):
+        return self.getters()
+
+    @property
+    def data(self):
+        fields = list(self.get_fields().items())
+        return [{name: get(row) for name, get in fields} for row in self.rows]
+
+
+def _storage_url(storage):
+    """storage.url, without urljoin() per name where FileSystemStorage's would be a concatenation."""
+    base_url = getattr(storage, 'base_url', None)
+    # default_storage is a lazy proxy, set up by reading base_url
+    backend = getattr(storage, '_wrapped', storage)
+    if type(backend).url is not FileSystemStorage.url or not base_url or not base_url.endswith('/'):
+        return storage.url
+
+    def url(name):
+        path = filepath_to_uri(name).lstrip('/')
+        segments = path.split('/')
+        # urljoin() would drop empty segments and resolve dot ones
+        if '' in segments[:-1] or '.' in segments or '..' in segments:
+            return storage.url(name)
+        return base_url + path
+    return url
+
+
+def _file_url(model, column, request):
+    # FileField.to_representation() for a stored name
+    url = _storage_url(model._meta.get_field(column).storage)
+
+    def get(row):
+        name = row[column]
+        if not name:
+            return None
+        if request is None:
+            return url(name)
+        return request.build_absolute_uri(url(name))
+    return get
+
+
+def _nullable(convert, column):
+    def get(row):
+        value = row[column]
+        return None if value is None else convert(value)
+    return get
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -24,15 +202,48 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 
-class VideoSerilaizer(serializers.ModelSerializer):
+def add_claims(token, user):
+    token['username'] = user.username
+    token['is_staff'] = user.is_staff
+    return token
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Embeds what request.user needs in the token, so requests authenticate without loading the User."""
+
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refuses refresh tokens issued before the user's revocation cutoff, and
+    takes the new access token's claims from the User row rather than from
+    the refresh token, which may predate a change to is_staff.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(pk=refresh.payload.get(jwt_settings.USER_ID_CLAIM)).first()
+        if user is None or not jwt_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        authentication.check_revoked(refresh, user.pk)
+        # ROTATE_REFRESH_TOKENS is off, so only an access token is issued
+        return {'access': str(add_claims(refresh.access_token, user))}
+
+
+class VideoSerilaizer(SparseFieldsMixin, serializers.ModelSerializer):
     created_at = serializers.DateTimeField(read_only=True)
     creator = serializers.StringRelatedField()
-    comments = serializers.HyperlinkedRelatedField(view_name='appapi:comments-detail',many=True,read_only=True)
+    comments_url = serializers.HyperlinkedIdentityField(view_name='appapi:videos-comments')
+    manifest_url = serializers.FileField(source='hls_manifest', read_only=True)
 
     class Meta:
         model = Video
-        fields = ['id','video','title','desc','comments','creator','created_at']
-        read_only_fields = ['id','creator']
+        fields = ['id','video','title','desc','comments_url','comment_count','view_count','creator','created_at',
+                  'status','duration','width','height','poster','manifest_url']
+        read_only_fields = ['id','creator','comment_count','view_count','status','duration','width','height','poster']
 
     def update(self, instance, validated_data):
         instance.created_at = timezone.now()
@@ -41,6 +252,42 @@ class VideoSerilaizer(serializers.ModelSerializer):
     
     
     
+class FlatVideoSerializer(SparseFieldsMixin, FlatSerializer):
+    """VideoSerilaizer's output, from `.values()` rows."""
+    columns = ('id', 'video', 'title', 'desc', 'comment_count', 'view_count', 'creator__username', 'created_at',
+               'status', 'duration', 'width', 'height', 'poster', 'hls_manifest')
+    # reversed once per page and formatted per row
+    url_placeholder = 2 ** 31 - 1
+
+    def getters(self):
+        request = self.context.get('request')
+        comments_url = reverse('appapi:videos-comments', kwargs={'pk': self.url_placeholder})
+        if request is not None:
+            comments_url = request.build_absolute_uri(comments_url)
+        prefix, suffix = comments_url.split(str(self.url_placeholder))
+        # looked up once rather than per row
+        created_at = serializers.DateTimeField(
+            default_timezone=timezone.get_current_timezone() if settings.USE_TZ else None)
+        return {
+            'id': itemgetter('id'),
+            'video': _file_url(Video, 'video', request),
+            'title': itemgetter('title'),
+            'desc': itemgetter('desc'),
+            'comments_url': lambda row: f'{prefix}{row["id"]}{suffix}',
+            'comment_count': itemgetter('comment_count'),
+            'view_count': itemgetter('view_count'),
+            # StringRelatedField: User.__str__ is the username
+            'creator': itemgetter('creator__username'),
+            'created_at': _nullable(created_at.to_representation, 'created_at'),
+            'status': itemgetter('status'),
+            'duration': _nullable(float, 'duration'),
+            'width': itemgetter('width'),
+            'height': itemgetter('height'),
+            'poster': _file_url(Video, 'poster', request),
+            'manifest_url': _file_url(Video, 'hls_manifest', request),
+        }
+
+
 class UpdateVideoSerializer(serializers.ModelSerializer):
     creator = serializers.StringRelatedField()
 
@@ -58,13 +305,31 @@ class UpdateVideoSerializer(serializers.ModelSerializer):
 
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     creator = serializers.StringRelatedField()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id','post', 'post_image','creator']
+        fields = ['id','post', 'post_image','srcset','creator']
         read_only_fields = ['id','creator']
+
+    def get_srcset(self, obj):
+        # one `srcset` string per format, e.g. for <source type="image/webp">
+        if not obj.post_image:
+            return None
+        request = self.context.get('request')
+        version = images.version(obj.post_image.name)
+        srcset = {}
+        for fmt in images.FORMATS:
+            candidates = []
+            for size, width in images.option('SIZES').items():
+                url = reverse('appapi:posts-image', kwargs={'pk': obj.pk, 'size': size, 'fmt': fmt}) + f'?v={version}'
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                candidates.append(f'{url} {width}w')
+            srcset[fmt] = ', '.join(candidates)
+        return srcset
     
     
 
@@ -75,12 +340,26 @@ class PostSerializer(serializers.ModelSerializer):
 
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # the_video = serializers.HyperlinkedRelatedField(queryset=Comment.objects.all())
+    the_video = BatchedPrimaryKeyRelatedField(queryset=Video.objects.all())
+    parent = BatchedPrimaryKeyRelatedField(queryset=Comment.objects.all(), required=False, allow_null=True)
+    thread_url = serializers.HyperlinkedIdentityField(view_name='appapi:comments-thread')
 
     class Meta:
         model = Comment
-        fields = ['comment','the_video']
+        fields = ['id','comment','the_video','parent','depth','reply_count','thread_url']
+        read_only_fields = ['id','depth','reply_count']
+        list_serializer_class = BulkListSerializer
+
+    def validate(self, data):
+        parent = data.get('parent')
+        if parent is not None:
+            if parent.the_video_id != data['the_video'].pk:
+                raise serializers.ValidationError({'parent': "must be a comment on the same video"})
+            if parent.depth >= threads.max_depth():
+                raise serializers.ValidationError({'parent': f"replies nest at most {threads.max_depth()} levels deep"})
+        return data
         
 
 
@@ -90,19 +369,38 @@ class CommentSerializer(serializers.ModelSerializer):
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
+    subscribed_to = BatchedPrimaryKeyRelatedField(queryset=User.objects.all())
+    # ids the subscriber follows, set by prepare_batch() for bulk writes
+    subscribed_ids = None
 
     class Meta:
         model = Subscription 
         fields = ['id','subscriber','subscribed_to']
         read_only_fields = ['id','subscriber']
+        list_serializer_class = BulkListSerializer
+
+    def prepare_batch(self, items):
+        subscriber = self.context['request'].user
+        self.subscribed_ids = set(
+            Subscription.objects.filter(subscriber_id=subscriber.id).values_list('subscribed_to_id', flat=True)
+        )
 
     def validate(self, data):
         # Access the logged-in user from the request context
         subscriber = self.context['request'].user
         subscribed_to = data.get("subscribed_to")
 
-        if subscriber == subscribed_to:
+        if subscriber.id == subscribed_to.pk:
             raise serializers.ValidationError("cannot subscribe to yourself")
+
+        if self.subscribed_ids is None:
+            if Subscription.objects.filter(subscriber_id=subscriber.id, subscribed_to=subscribed_to).exists():
+                raise serializers.ValidationError("already subscribed")
+        else:
+            # also catches the same user twice in one batch
+            if subscribed_to.pk in self.subscribed_ids:
+                raise serializers.ValidationError("already subscribed")
+            self.subscribed_ids.add(subscribed_to.pk)
     
         
         return data
@@ -111,6 +409,40 @@ class SubscriptionSerializer(serializers.ModelSerializer):
 
 
 
+class ProfileSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='user_id', read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = Profile
+        fields = ['id','username','subscriber_count','video_count']
+
+
+
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    missing = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['id','filename','title','desc','total_size','received','missing','video','created_at']
+        read_only_fields = ['id','received','video','created_at']
+
+    def get_missing(self, obj):
+        return missing_ranges(obj)
+
+    def validate_total_size(self, value):
+        if value == 0:
+            raise serializers.ValidationError("cannot upload an empty file")
+        if value > max_size():
+            raise serializers.ValidationError(f"cannot upload more than {max_size()} bytes")
+        return value
+    
+
+
+
+
 # When to Use self.context:
 # Use it when you need data (like the request or user) that is not part of the serialized input but is available in the view.
 # It’s especially useful when dealing with read-only fields or fields that are automatically set, like subscriber in your case.
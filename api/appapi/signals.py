@@ -0,0 +1,147 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import authentication, cache, hls, processing, search, storage, threads
+from .models import Comment, Post, Profile, Subscription, Video
+
+
+@receiver(post_save, sender=User)
+def create_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Profile.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_token_cutoff(sender, instance, **kwargs):
+    # a deactivated or deleted user's tokens stop working without waiting for the TTL
+    authentication.forget(instance.pk)
+
+
+# flags embedded in access tokens, see ClaimsTokenObtainPairSerializer
+TOKEN_PRIVILEGES = ('is_staff', 'is_superuser')
+
+
+@receiver(pre_save, sender=User)
+def remember_privileges(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(TOKEN_PRIVILEGES) & set(update_fields):
+        return
+    instance._token_privileges = User.objects.filter(pk=instance.pk).values_list(*TOKEN_PRIVILEGES).first()
+
+
+@receiver(post_save, sender=User)
+def revoke_changed_privileges(sender, instance, **kwargs):
+    # tokens issued before a demotion would keep is_staff until they expire
+    old = instance.__dict__.pop('_token_privileges', None)
+    if old is not None and old != tuple(getattr(instance, name) for name in TOKEN_PRIVILEGES):
+        authentication.revoke(instance.pk)
+
+
+@receiver(post_save, sender=Video)
+def queue_processing(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        # workers must not pick the jobs up before the video row is visible
+        transaction.on_commit(lambda: processing.queue(instance))
+
+
+@receiver(post_delete, sender=Video)
+def remove_renditions(sender, instance, **kwargs):
+    video_id = instance.pk  # cleared on the instance once the delete finishes
+    transaction.on_commit(lambda: hls.remove(video_id))
+
+
+# Media blob references (see storage.py). A row's file is released when
+# the row is deleted or when a save replaces it with a different file.
+
+MEDIA_FIELDS = {Video: 'video', Post: 'post_image'}
+
+
+@receiver(pre_save, sender=Video)
+@receiver(pre_save, sender=Post)
+def remember_replaced_media(sender, instance, raw=False, **kwargs):
+    field = MEDIA_FIELDS[sender]
+    new = getattr(instance, field)
+    # only a newly assigned upload can replace the stored file
+    if raw or instance.pk is None or not new or new._committed:
+        return
+    instance._replaced_media = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Post)
+def release_replaced_media(sender, instance, **kwargs):
+    # the upload took its own reference, even when it stored the same
+    # bytes under the same name as before
+    old = instance.__dict__.pop('_replaced_media', None)
+    if old:
+        storage.release(old)
+
+
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Post)
+def release_media(sender, instance, **kwargs):
+    storage.release(getattr(instance, MEDIA_FIELDS[sender]).name)
+
+
+# Full-text search index (see search.py)
+
+SEARCH_FIELDS = {Video: {'title', 'desc'}, Post: {'post'}}
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Post)
+def index_for_search(sender, instance, raw=False, update_fields=None, **kwargs):
+    # background jobs save status and metadata only
+    if raw or (update_fields is not None and not SEARCH_FIELDS[sender] & set(update_fields)):
+        return
+    search.index(instance)
+
+
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Post)
+def unindex_for_search(sender, instance, **kwargs):
+    search.remove('video' if sender is Video else 'post', instance.pk)
+
+
+# Comment threads (see threads.py)
+
+@receiver(pre_save, sender=Comment)
+def set_comment_depth(sender, instance, raw=False, **kwargs):
+    if not raw and instance._state.adding and instance.parent_id:
+        instance.depth = instance.parent.depth + 1
+
+
+@receiver(post_save, sender=Comment)
+def set_comment_path(sender, instance, created, raw=False, **kwargs):
+    # the path ends with the comment's own id, which only exists now
+    if created and not raw and not instance.path:
+        instance.path = threads.path_for(instance)
+        Comment.objects.filter(pk=instance.pk).update(path=instance.path)
+
+
+# Response cache invalidation: bump the version of every scope whose
+# cached output could include the row that changed.
+
+@receiver([post_save, post_delete], sender=Video)
+def invalidate_video(sender, instance, **kwargs):
+    cache.bump(f'video:{instance.pk}', 'videos', f'profile:{instance.creator_id}')
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_comment(sender, instance, **kwargs):
+    # videos embed their comment ids and counts
+    cache.bump('comments', f'video:{instance.the_video_id}', 'videos')
+
+
+@receiver([post_save, post_delete], sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    cache.bump(f'post:{instance.pk}', 'posts')
+
+
+@receiver([post_save, post_delete], sender=Subscription)
+def invalidate_subscription(sender, instance, **kwargs):
+    cache.bump(f'profile:{instance.subscribed_to_id}', f'subscriptions:{instance.subscriber_id}')
@@ -0,0 +1,149 @@
+"""
+Content-addressed, deduplicated media storage.
+
+Files are stored once under blobs/<ab>/<cd>/<sha256><ext>, whatever name
+they were uploaded with, so identical uploads share one file and a
+duplicate costs no write at all: small uploads Django holds in memory are
+hashed before anything touches the disk, large ones it spooled to a
+temporary file are hashed and then renamed into place, and other streams
+are hashed in the same pass that copies them.
+
+Blob rows count the model fields that point at each file. Saving through
+the storage takes a reference; `release()` drops one, and once the count
+is zero the row and the file are deleted together after the transaction
+commits. A new reference is always taken before an existing file is
+reused, and the delete re-checks the count under the row's write lock,
+so an identical upload racing a release either keeps the file or finds
+it gone and stores it again. Deletes and replacements of Video.video and
+Post.post_image release automatically (see signals.py), and
+`manage.py dedupe_media` moves pre-existing files into the store and
+recounts references from scratch.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+BLOB_PREFIX = 'blobs/'
+CHUNK_SIZE = 1024 * 1024
+
+
+def blob_name(digest, original_name):
+    ext = os.path.splitext(original_name)[1].lower()
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # the stored name comes from the content, so it never collides
+        return name
+
+    def _save(self, name, content):
+        return self.store(content, name, reference=True)
+
+    def store(self, content, name, reference=False):
+        """Put `content` in the blob store and return its name; with `reference`, also take a reference to it."""
+        if hasattr(content, 'temporary_file_path'):
+            return self.store_path(content.temporary_file_path(), name, reference)
+        if isinstance(content, (InMemoryUploadedFile, ContentFile)):
+            digest = hashlib.sha256()
+            for chunk in content.chunks(CHUNK_SIZE):
+                digest.update(chunk)
+            stored = blob_name(digest.hexdigest(), name)
+            if reference:
+                # before looking for the file, see _delete_if_unused
+                retain(stored, content.size)
+                reference = False
+            if self.exists(stored):
+                return stored
+
+        directory = self.path(BLOB_PREFIX)
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    out.write(chunk)
+            return self._place(tmp, blob_name(digest.hexdigest(), name), reference)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def store_path(self, path, name, reference=False):
+        """Move the local file at `path` into the blob store and return its name, as store() does."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return self._place(path, blob_name(digest.hexdigest(), name), reference)
+
+    def _place(self, source, name, reference=False):
+        if reference:
+            retain(name, os.path.getsize(source))
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # already stored: the copy we were given is not needed
+            os.remove(source)
+            return name
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # identical content, so losing a race to another writer is harmless
+        file_move_safe(source, full_path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+
+media_storage = ContentAddressedStorage()
+
+
+def retain(name, size=None):
+    """Take a reference to blob `name`, whose file may not be in place yet if `size` is given."""
+    from .models import Blob
+
+    if Blob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        return
+    try:
+        with transaction.atomic():
+            Blob.objects.create(name=name, refcount=1, size=media_storage.size(name) if size is None else size)
+    except IntegrityError:
+        # created concurrently
+        Blob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+def release(name):
+    """Drop one reference to blob `name`; once none are left it is deleted after commit."""
+    from .models import Blob
+
+    if not is_blob(name):
+        return
+    # a compare-and-set, so concurrent releases cannot drop the count below zero
+    if Blob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1):
+        transaction.on_commit(lambda: _delete_if_unused(name))
+
+
+def _delete_if_unused(name):
+    from .models import Blob
+
+    # The DELETE waits for the write lock of any transaction that retained
+    # the blob meanwhile and then skips the row; a retain that comes after
+    # it finds no row, creates one and stores the file again (see store()).
+    # The file goes before the commit, so no new reference can see it first.
+    with transaction.atomic():
+        if Blob.objects.filter(name=name, refcount=0).delete()[0]:
+            media_storage.delete(name)
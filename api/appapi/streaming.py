@@ -0,0 +1,160 @@
+"""
+Byte-serving for stored media files.
+
+Supports single `Range: bytes=` requests (206 / 416), If-Range, and
+conditional GETs through ETag and Last-Modified. Under WSGI, responses are
+FileResponses over a real file descriptor, so servers with a sendfile-capable
+`wsgi.file_wrapper` (gunicorn, uWSGI) copy the bytes kernel-side. Under
+ASGI, Django would read a synchronous body into memory whole before
+sending it, so the file is streamed from an async iterator instead, each
+block read on a worker thread while the event loop serves other requests.
+
+Set VIDEO_STREAM_OFFLOAD to 'x-accel-redirect' (nginx) or 'x-sendfile'
+(Apache, lighttpd) to hand the transfer to the front proxy instead; the
+proxy then applies Range itself.
+"""
+
+import mimetypes
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """
+    A read-only view of `length` bytes of `file`, starting at its current
+    position. `fileno()` is passed through so sendfile can still be used.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def is_asgi(request):
+    """Whether `request` (Django's or DRF's) came through the ASGI handler."""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def aiter_file(file, block_size=BLOCK_SIZE):
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while block := await read(block_size):
+            yield block
+    finally:
+        file.close()
+
+
+def file_validators(stat):
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    return etag, int(stat.st_mtime)
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single byte range, None when the
+    header should be ignored, or raise ValueError if it is unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # weak validators never satisfy If-Range
+        return etag in parse_etags(if_range) and not if_range.startswith('W/')
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def serve_file(request, path, relative_name):
+    """
+    Serve `path` (stored under MEDIA_ROOT as `relative_name`) honouring
+    conditional and Range headers.
+    """
+    stat = os.stat(path)
+    etag, last_modified = file_validators(stat)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    offload = getattr(settings, 'VIDEO_STREAM_OFFLOAD', None)
+
+    if offload:
+        response = HttpResponse(content_type=content_type)
+        if offload == 'x-accel-redirect':
+            prefix = getattr(settings, 'VIDEO_STREAM_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative_name.lstrip('/')
+        else:
+            response['X-Sendfile'] = path
+    else:
+        byte_range = None
+        range_header = request.headers.get('Range')
+        if range_header and if_range_matches(request, etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, stat.st_size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+                response['Accept-Ranges'] = 'bytes'
+                return response
+
+        f = open(path, 'rb')
+        body, length, status = f, stat.st_size, 200
+        if byte_range is not None:
+            start, end = byte_range
+            f.seek(start)
+            body, length, status = RangeFile(f, end - start + 1), end - start + 1, 206
+        if is_asgi(request):
+            response = StreamingHttpResponse(aiter_file(body), content_type=content_type, status=status)
+        else:
+            response = FileResponse(body, content_type=content_type, status=status)
+            response.block_size = BLOCK_SIZE
+        response['Content-Length'] = length
+        if byte_range is not None:
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
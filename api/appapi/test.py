@@ -1,7 +1,68 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth.models import User
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
+from datetime import timedelta
+from django.utils import timezone
+from appapi.models import Video, Post, Comment, Subscription, TimelineEntry, Profile, TokenRevocation, UploadSession
+from appapi import uploads
+from appapi.cache import get_cache, LRUFileBasedCache
+from appapi.pagination import FeedPagination
+from appapi.cache import bump, get_version_store
+from django.core.cache import CacheHandler
+from django.core.cache.backends.locmem import LocMemCache
+import tempfile
+from django.test import override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import skipUnless
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
+from django.core.management import call_command
+import time
+from unittest import mock
+import struct
+import hashlib
+from appapi import jobs
+from appapi import hls
+from appapi.models import Job
+import os
+from io import BytesIO
+from PIL import Image
+from appapi.models import Blob
+from appapi import storage
+from appapi.models import ViewRollup
+from appapi import analytics
+from appapi import images
+from appapi import ranking
+from appapi.models import VideoScore
+from appapi import throttling
+import shutil
+from asgiref.sync import sync_to_async
+from appapi import authentication
+from appapi import routers
+from appapi.serializers import ClaimsTokenObtainPairSerializer
+from django.db import router
+import contextlib
+import importlib
+from asgiref.sync import iscoroutinefunction
+from django.urls import clear_url_caches, resolve
+import appapi.urls
+import api.urls
+import uuid
+from decimal import Decimal
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.relations import HyperlinkedIdentityField
+from rest_framework.renderers import JSONRenderer
+from appapi.fastjson import FastJSONParser, FastJSONRenderer
+from appapi.serializers import CommentSerializer, FlatSerializer, FlatVideoSerializer, VideoSerilaizer
+from appapi.views import BulkCreateView
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+import csv
+import json
+from appapi import export
 
 
 class AuthenticationTests(APITestCase):
@@ -117,6 +178,1820 @@ class AuthenticationTests(APITestCase):
         self.assertIn("access", response.data)
 
 
+class PaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        now = timezone.now()
+        # Two videos share a timestamp and one has none, to exercise the id tiebreak and NULL handling
+        self.videos = [
+            Video.objects.create(video="sample.mp4", title=f"Video {i}", desc="desc", creator=self.user,
+                                 created_at=None if i == 0 else now - timedelta(minutes=min(i, 5)))
+            for i in range(7)
+        ]
+
+    def collect(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [item["id"] for item in response.data["results"]]
+            url, pages = response.data["next"], pages + 1
+        return ids, pages
+
+    def test_video_pages_cover_every_row_once(self):
+        """
+        Test that following next cursors walks every video exactly once, newest first.
+        """
+        ids, pages = self.collect("/api/videos/?page_size=2")
+        expected = [v.id for v in sorted(self.videos[1:], key=lambda v: (v.created_at, v.id), reverse=True)]
+        self.assertEqual(ids, expected + [self.videos[0].id])
+        self.assertEqual(pages, 4)
+
+    def test_previous_cursor_returns_to_earlier_page(self):
+        """
+        Test that the previous cursor of page two returns page one.
+        """
+        first = self.client.get("/api/videos/?page_size=3").data
+        second = self.client.get(first["next"]).data
+        back = self.client.get(second["previous"]).data
+        self.assertEqual(back["results"], first["results"])
+
+    def test_page_size_is_capped(self):
+        """
+        Test that page_size cannot exceed the paginator maximum.
+        """
+        for i in range(3):
+            Post.objects.create(post=f"post {i}", creator=self.user)
+        response = self.client.get("/api/posts/?page_size=100000")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertEqual([p["post"] for p in response.data["results"]], ["post 2", "post 1", "post 0"])
+
+    def test_invalid_cursor(self):
+        """
+        Test that a tampered cursor is rejected with 404.
+        """
+        response = self.client.get("/api/comments/?cursor=garbage")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QueryCountTests(APITestCase):
+    """
+    List and detail endpoints must issue a constant number of queries
+    no matter how many rows they render.
+    """
+    sizes = (1, 100, 1000)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        # bulk_create sends no signals, so measure the uncached path explicitly
+        self.addCleanup(get_cache().clear)
+
+    def make_videos(self, count, comments_each=1):
+        Video.objects.all().delete()
+        creators = User.objects.bulk_create(User(username=f"creator{count}-{i}") for i in range(count))
+        videos = Video.objects.bulk_create(
+            Video(video="sample.mp4", title=f"Video {i}", desc="desc", creator=creators[i], created_at=timezone.now())
+            for i in range(count)
+        )
+        Comment.objects.bulk_create(
+            Comment(comment="nice", creator=self.user, the_video=video)
+            for video in videos for _ in range(comments_each)
+        )
+        return videos
+
+    def test_video_list_query_count(self):
+        """
+        Test that the video list costs the same queries for 1, 100 and 1000 videos.
+        """
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.make_videos(size)
+                # one query for videos joined to creators; comments are behind comments_url
+                get_cache().clear()
+                with self.assertNumQueries(1):
+                    response = self.client.get("/api/videos/?page_size=100")
+                self.assertEqual(len(response.data["results"]), min(size, 100))
+
+    def test_video_detail_query_count(self):
+        """
+        Test that video detail does not query once per comment.
+        """
+        video = Video.objects.create(video="sample.mp4", title="Video", desc="desc", creator=self.user)
+        for size in self.sizes:
+            with self.subTest(size=size):
+                Comment.objects.bulk_create(
+                    Comment(comment="nice", creator=self.user, the_video=video) for _ in range(size)
+                )
+                get_cache().clear()
+                with self.assertNumQueries(1):
+                    response = self.client.get(f"/api/videos/{video.id}/")
+                self.assertTrue(response.data["comments_url"].endswith(f"/api/videos/{video.id}/comments/"))
+
+    def test_post_list_query_count(self):
+        """
+        Test that the post list does not query once per creator.
+        """
+        for size in self.sizes:
+            with self.subTest(size=size):
+                creators = User.objects.bulk_create(User(username=f"poster{size}-{i}") for i in range(size))
+                Post.objects.bulk_create(Post(post=f"post {i}", creator=creators[i]) for i in range(size))
+                get_cache().clear()
+                with self.assertNumQueries(1):
+                    self.client.get("/api/posts/?page_size=100")
+
+    def test_comment_list_query_count(self):
+        """
+        Test that the comment list does not query once per video.
+        """
+        for size in self.sizes:
+            with self.subTest(size=size):
+                self.make_videos(size)
+                get_cache().clear()
+                with self.assertNumQueries(1):
+                    self.client.get("/api/comments/?page_size=100")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ResumableUploadTests(APITestCase):
+    content = bytes(range(256)) * 40  # 10,240 bytes
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post("/api/uploads/", {
+            "filename": "clip.mp4",
+            "title": "Clip",
+            "desc": "Chunked upload",
+            "total_size": len(self.content),
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.upload_url = f"/api/uploads/{response.data['id']}/"
+
+    def put_chunk(self, start, end):
+        return self.client.put(
+            self.upload_url,
+            self.content[start:end],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.content)}",
+        )
+
+    def test_out_of_order_chunks_assemble_into_video(self):
+        """
+        Test that chunks sent in any order produce the original file.
+        """
+        for start in (8192, 0, 4096):
+            response = self.put_chunk(start, min(start + 4096, len(self.content)))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["missing"], [])
+
+        response = self.client.post(self.upload_url + "complete/")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        video = Video.objects.get(pk=response.data["id"])
+        self.assertEqual(video.creator, self.user)
+        with video.video.open("rb") as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_retried_and_overlapping_chunks(self):
+        """
+        Test that resending a chunk is harmless and ranges are merged.
+        """
+        self.put_chunk(0, 5000)
+        self.put_chunk(0, 5000)
+        response = self.put_chunk(4000, 6000)
+        self.assertEqual(response.data["received"], [[0, 6000]])
+        self.assertEqual(response.data["missing"], [[6000, len(self.content)]])
+
+    def test_complete_with_missing_chunks(self):
+        """
+        Test that an incomplete upload cannot be completed.
+        """
+        self.put_chunk(0, 4096)
+        response = self.client.post(self.upload_url + "complete/")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["missing"], [[4096, len(self.content)]])
+        self.assertFalse(Video.objects.exists())
+
+    def test_chunk_with_bad_content_range(self):
+        """
+        Test that a chunk outside the declared size is rejected.
+        """
+        response = self.client.put(
+            self.upload_url, b"abc", content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {len(self.content)}-{len(self.content) + 2}/{len(self.content)}",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(MAX_UPLOAD_SIZE=1024)
+    def test_total_size_is_capped(self):
+        """
+        Test that a session declaring more than MAX_UPLOAD_SIZE bytes is refused before any file is made.
+        """
+        response = self.client.post("/api/uploads/", {
+            "filename": "huge.mp4", "title": "Huge", "desc": "desc", "total_size": 1025,
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("total_size", response.data)
+        self.assertEqual(UploadSession.objects.count(), 1)
+
+    def test_idle_sessions_expire(self):
+        """
+        Test that a session idle past UPLOAD_SESSION_TTL refuses chunks and is deleted with its partial file.
+        """
+        session = UploadSession.objects.get()
+        path = uploads.partial_path(session)
+        self.assertEqual(self.put_chunk(0, 4096).status_code, status.HTTP_200_OK)
+        session.refresh_from_db()
+        self.assertGreater(session.updated_at, session.created_at)
+
+        out = StringIO()
+        call_command("expire_uploads", stdout=out)
+        self.assertIn("0 upload session(s) expired", out.getvalue())
+
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(seconds=uploads.ttl() + 1))
+        self.assertEqual(self.put_chunk(4096, 8192).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.post(self.upload_url + "complete/").status_code, status.HTTP_404_NOT_FOUND)
+        call_command("expire_uploads", stdout=out)
+        self.assertIn("1 upload session(s) expired", out.getvalue())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class VideoStreamTests(APITestCase):
+    content = bytes(range(256)) * 8  # 2,048 bytes
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(
+            video=SimpleUploadedFile("clip.mp4", self.content, content_type="video/mp4"),
+            title="Clip", desc="desc", creator=self.user,
+        )
+        self.url = f"/api/videos/{self.video.id}/stream/"
+
+    def test_full_download(self):
+        """
+        Test that a plain GET returns the whole file and advertises ranges.
+        """
+        response = self.client.get(self.url, HTTP_ACCEPT="video/*")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Content-Type"], "video/mp4")
+
+    def test_range_request(self):
+        """
+        Test that a byte range returns 206 with only those bytes.
+        """
+        response = self.client.get(self.url, HTTP_RANGE="bytes=100-199")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), self.content[100:200])
+        self.assertEqual(response["Content-Range"], f"bytes 100-199/{len(self.content)}")
+        self.assertEqual(response["Content-Length"], "100")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-48")
+        self.assertEqual(b"".join(response.streaming_content), self.content[-48:])
+
+    def test_unsatisfiable_range(self):
+        """
+        Test that a range past the end of the file returns 416.
+        """
+        response = self.client.get(self.url, HTTP_RANGE="bytes=5000-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.content)}")
+
+    def test_conditional_get(self):
+        """
+        Test that ETag and Last-Modified validators yield 304, and a stale If-Range ignores Range.
+        """
+        first = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(VIDEO_STREAM_OFFLOAD="x-accel-redirect")
+    def test_accel_redirect_offload(self):
+        """
+        Test that offload mode returns an X-Accel-Redirect header instead of the body.
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/" + self.video.video.name)
+        self.assertEqual(response.content, b"")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FeedTests(APITestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user(username="creator", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.viewer = User.objects.create_user(username="viewer", password="testpassword")
+        Subscription.objects.create(subscriber=self.viewer, subscribed_to=self.creator)
+
+    def upload(self, user, title):
+        self.client.force_authenticate(user=user)
+        response = self.client.post("/api/videos/", {
+            "video": SimpleUploadedFile("clip.mp4", b"file_content", content_type="video/mp4"),
+            "title": title,
+            "desc": "desc",
+        }, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data["id"]
+
+    def feed_ids(self):
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.get("/api/feed/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item["id"] for item in response.data["results"]]
+
+    def test_feed_contains_only_subscribed_creators(self):
+        """
+        Test that uploads fan out to subscribers' timelines, newest first.
+        """
+        first = self.upload(self.creator, "first")
+        self.upload(self.other, "unrelated")
+        second = self.upload(self.creator, "second")
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.viewer).count(), 2)
+        self.assertEqual(self.feed_ids(), [second, first])
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_large_creators_fall_back_to_fanout_on_read(self):
+        """
+        Test that videos from creators over the fan-out limit are merged in at read time.
+        """
+        video_id = self.upload(self.creator, "popular")
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertTrue(Video.objects.get(pk=video_id).fanout_on_read)
+        self.assertEqual(self.feed_ids(), [video_id])
+
+    def test_feed_pages_merge_timeline_and_fanout_on_read(self):
+        """
+        Test that paging walks timeline and read-time videos in one order without repeats.
+        """
+        Subscription.objects.create(subscriber=self.viewer, subscribed_to=self.other)
+        ids = [self.upload(self.creator if i % 2 else self.other, f"video {i}") for i in range(5)]
+        Video.objects.filter(creator=self.other).update(fanout_on_read=True)
+        TimelineEntry.objects.filter(video__creator=self.other).delete()
+
+        self.client.force_authenticate(user=self.viewer)
+        seen, url = [], "/api/feed/?page_size=2"
+        while url:
+            response = self.client.get(url)
+            seen += [item["id"] for item in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(seen, ids[::-1])
+
+    def test_feed_page_is_fetched_once(self):
+        """
+        Test that one feed request reads its page once for both the ETag and the body, and a match gets 304.
+        """
+        video_id = self.upload(self.creator, "first")
+        self.client.force_authenticate(user=self.viewer)
+        with mock.patch("appapi.pagination.FeedPagination.fetch", autospec=True,
+                        side_effect=FeedPagination.fetch) as fetch:
+            response = self.client.get("/api/feed/")
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual([item["id"] for item in response.data["results"]], [video_id])
+        response = self.client.get("/api/feed/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_subscribe_backfills_and_unsubscribe_prunes(self):
+        """
+        Test that subscribing copies recent videos in and unsubscribing removes them.
+        """
+        video_id = self.upload(self.other, "older")
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.post("/api/subscriptions/", {"subscribed_to": self.other.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.feed_ids(), [video_id])
+
+        self.client.delete(f"/api/subscriptions/{response.data['id']}/")
+        self.assertEqual(self.feed_ids(), [])
+
+
+@skipUnless(connection.vendor == "sqlite", "query plans are checked against SQLite's EXPLAIN QUERY PLAN")
+class QueryPlanTests(APITestCase):
+    """
+    Run the hot read endpoints, EXPLAIN every query they issue and check
+    that each table is reached through an index rather than a full scan.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.creator = User.objects.create_user(username="creator", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        Subscription.objects.create(subscriber=self.user, subscribed_to=self.creator)
+        self.video = Video.objects.create(video="sample.mp4", title="Video", desc="desc", creator=self.creator, created_at=timezone.now())
+        Video.objects.create(video="sample.mp4", title="Popular", desc="desc", creator=self.creator, created_at=timezone.now(), fanout_on_read=True)
+        TimelineEntry.objects.create(owner=self.user, video=self.video, created_at=self.video.created_at)
+        Comment.objects.create(comment="nice", creator=self.user, the_video=self.video)
+
+    def query_plans(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plans.append((query["sql"], [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertNoFullScans(self, plans, table):
+        for sql, plan in plans:
+            for line in plan:
+                if line.startswith(f"SCAN {table}"):
+                    self.assertIn("INDEX", line, f"full scan of {table} in: {sql}")
+
+    def test_video_list_walks_created_at_index(self):
+        """
+        Test that the video list pages along video_created_idx without sorting.
+        """
+        plans = self.query_plans("/api/videos/")
+        video_plan = plans[0][1]
+        self.assertTrue(video_plan[0].startswith("SCAN appapi_video USING INDEX video_created_idx"))
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", video_plan)
+
+    def test_video_list_cursor_page_uses_index(self):
+        """
+        Test that a deep cursor page still uses the index and does not sort.
+        """
+        first = self.client.get("/api/videos/?page_size=1")
+        plans = self.query_plans(first.data["next"])
+        self.assertNoFullScans(plans, "appapi_video")
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plans[0][1])
+
+    def test_feed_reads_timeline_index(self):
+        """
+        Test that the feed reads the timeline through its covering index and never scans videos.
+        """
+        plans = self.query_plans("/api/feed/")
+        timeline = [plan for sql, plan in plans if '"appapi_timelineentry"' in sql.split("WHERE")[0]]
+        self.assertTrue(any("timeline_owner_created_idx" in line for line in timeline[0]))
+        self.assertFalse(any("TEMP B-TREE" in line for line in timeline[0]))
+        self.assertNoFullScans(plans, "appapi_video")
+        self.assertNoFullScans(plans, "appapi_subscription")
+
+    def test_subscription_list_uses_unique_index(self):
+        """
+        Test that a user's subscriptions are read from the unique (subscriber, subscribed_to) index.
+        """
+        plans = self.query_plans("/api/subscriptions/")
+        self.assertTrue(plans[0][1][0].startswith("SEARCH appapi_subscription USING COVERING INDEX"))
+
+    def test_comments_per_video_use_composite_index(self):
+        """
+        Test that comments for one video are found and ordered by an index on the_video.
+        """
+        queryset = Comment.objects.filter(the_video=self.video).order_by("id")
+        plan = queryset.explain()
+        # comment_video_id_idx, or the foreign key index, which SQLite also keys on the rowid
+        self.assertRegex(plan, r"SEARCH appapi_comment USING (COVERING )?INDEX \w+ \(the_video_id=\?\)")
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_thread_endpoints_use_comment_indexes(self):
+        """
+        Test that top-level comments and whole threads are read from their indexes without sorting.
+        """
+        root = Comment.objects.get()
+        Comment.objects.create(comment="reply", creator=self.user, the_video=self.video, parent=root)
+        for url, index in ((f"/api/videos/{self.video.id}/comments/", "comment_video_depth_id_idx"),
+                           (f"/api/videos/{self.video.id}/comments/?sort=top", "comment_video_top_idx"),
+                           (f"/api/comments/{root.id}/thread/", "comment_path_idx")):
+            with self.subTest(url=url):
+                plan = [line for sql, plan in self.query_plans(url) if 'FROM "appapi_comment"' in sql for line in plan][-1:]
+                self.assertIn(index, plan[0])
+                self.assertNoFullScans(self.query_plans(url), "appapi_comment")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CounterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.creator = User.objects.create_user(username="creator", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(video="sample.mp4", title="Video", desc="desc", creator=self.creator)
+
+    def test_comment_count_follows_create_and_delete(self):
+        """
+        Test that posting and deleting comments keeps Video.comment_count in step.
+        """
+        response = self.client.post("/api/comments/", {"comment": "nice", "the_video": self.video.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.post("/api/comments/", {"comment": "again", "the_video": self.video.id})
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.comment_count, 2)
+
+        comment = Comment.objects.first()
+        response = self.client.delete(f"/api/comments/{comment.id}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.comment_count, 1)
+
+    def test_subscriber_and_video_counts(self):
+        """
+        Test that subscribing, unsubscribing and uploading update the profile counters.
+        """
+        response = self.client.post("/api/subscriptions/", {"subscribed_to": self.creator.id})
+        self.assertEqual(self.client.get(f"/api/profiles/{self.creator.id}/").data["subscriber_count"], 1)
+        self.client.delete(f"/api/subscriptions/{response.data['id']}/")
+        self.assertEqual(self.client.get(f"/api/profiles/{self.creator.id}/").data["subscriber_count"], 0)
+
+        self.client.post("/api/videos/", {
+            "video": SimpleUploadedFile("clip.mp4", b"file_content", content_type="video/mp4"),
+            "title": "Clip",
+            "desc": "desc",
+        }, format="multipart")
+        self.assertEqual(self.client.get(f"/api/profiles/{self.user.id}/").data["video_count"], 1)
+
+    def test_reconcile_counters_command(self):
+        """
+        Test that reconcile_counters repairs counters changed behind the views' backs.
+        """
+        Comment.objects.create(comment="direct", creator=self.user, the_video=self.video)
+        Subscription.objects.create(subscriber=self.user, subscribed_to=self.creator)
+        Profile.objects.filter(user=self.user).delete()
+
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("comment_count: 1 row(s) corrected", out.getvalue())
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.comment_count, 1)
+        self.assertEqual(Profile.objects.get(user=self.creator).subscriber_count, 1)
+        self.assertEqual(Profile.objects.get(user=self.creator).video_count, 1)
+        self.assertTrue(Profile.objects.filter(user=self.user).exists())
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(video="sample.mp4", title="Video", desc="desc", creator=self.user, created_at=timezone.now())
+        self.video_url = f"/api/videos/{self.video.id}/"
+
+    def test_detail_hit_skips_serialization_queries(self):
+        """
+        Test that a repeated detail GET is served from the cache.
+        """
+        self.assertEqual(self.client.get(self.video_url)["X-Cache"], "MISS")
+        # only the permission lookup remains on a hit
+        with self.assertNumQueries(1):
+            response = self.client.get(self.video_url)
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.data["title"], "Video")
+
+    def test_comment_invalidates_video_detail_and_list(self):
+        """
+        Test that a new comment bumps the video and collection versions.
+        """
+        self.client.get(self.video_url)
+        self.client.get("/api/videos/")
+        self.client.post("/api/comments/", {"comment": "nice", "the_video": self.video.id})
+
+        detail = self.client.get(self.video_url)
+        listing = self.client.get("/api/videos/")
+        self.assertEqual(detail["X-Cache"], "MISS")
+        self.assertEqual(detail.data["comment_count"], 1)
+        self.assertEqual(listing["X-Cache"], "MISS")
+        self.assertEqual(listing.data["results"][0]["comment_count"], 1)
+
+    def test_post_update_invalidates_post_detail_only_for_that_post(self):
+        """
+        Test that editing a post invalidates its own detail entry but not other posts'.
+        """
+        first = Post.objects.create(post="first", creator=self.user)
+        second = Post.objects.create(post="second", creator=self.user)
+        self.client.get(f"/api/posts/{first.id}/")
+        self.client.get(f"/api/posts/{second.id}/")
+        self.client.put(f"/api/posts/{first.id}/", {"post": "edited"})
+        response = self.client.get(f"/api/posts/{first.id}/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["post"], "edited")
+        self.assertEqual(self.client.get(f"/api/posts/{second.id}/")["X-Cache"], "HIT")
+
+    def test_stats_are_admin_only(self):
+        """
+        Test that hit/miss metrics are reported to admins.
+        """
+        self.client.get(self.video_url)
+        self.client.get(self.video_url)
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=User.objects.create_superuser(username="admin", password="adminpassword"))
+        response = self.client.get("/api/cache/stats/")
+        self.assertGreaterEqual(response.data["detail_hits"], 1)
+        self.assertGreaterEqual(response.data["detail_misses"], 1)
+
+    def test_bump_through_another_handle_invalidates(self):
+        """
+        Test that versions live outside process memory, so a bump made by another worker is seen here.
+        """
+        self.assertNotIsInstance(get_version_store(), LocMemCache)
+        self.client.get(self.video_url)
+        self.assertEqual(self.client.get(self.video_url)["X-Cache"], "HIT")
+        # a fresh handler opens its own connection to each store, as another process would
+        with mock.patch("appapi.cache.caches", CacheHandler()):
+            bump(f"video:{self.video.id}")
+        self.assertEqual(self.client.get(self.video_url)["X-Cache"], "MISS")
+
+    def test_file_cache_evicts_least_recently_used(self):
+        """
+        Test that the file-based backend culls the entries read least recently.
+        """
+        cache = LRUFileBasedCache(tempfile.mkdtemp(), {"OPTIONS": {"MAX_ENTRIES": 3, "CULL_FREQUENCY": 3}})
+        for key in ("a", "b", "c"):
+            cache.set(key, key)
+            time.sleep(0.01)
+        cache.get("a")
+        cache.set("d", "d")
+        self.assertEqual(cache.get("a"), "a")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("d"), "d")
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(video="sample.mp4", title="Video", desc="desc", creator=self.user, created_at=timezone.now())
+        self.video_url = f"/api/videos/{self.video.id}/"
+
+    def test_detail_not_modified_skips_serialization(self):
+        """
+        Test that a matching If-None-Match gets a 304 without serializing the video.
+        """
+        response = self.client.get(self.video_url)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+
+        get_cache().clear()
+        with mock.patch("appapi.views.VideoSerilaizer.to_representation", side_effect=AssertionError):
+            response = self.client.get(self.video_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+    def test_if_modified_since_on_detail(self):
+        """
+        Test that If-Modified-Since at or after updated_at gets a 304.
+        """
+        last_modified = self.client.get(self.video_url)["Last-Modified"]
+        response = self.client.get(self.video_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_bump_through_another_handle_changes_list_etag(self):
+        """
+        Test that a write recorded by another worker stops this one answering 304 to the old list ETag.
+        """
+        etag = self.client.get("/api/videos/")["ETag"]
+        self.assertEqual(self.client.get("/api/videos/", HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        with mock.patch("appapi.cache.caches", CacheHandler()):
+            bump("videos")
+        response = self.client.get("/api/videos/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_comment_changes_video_etags(self):
+        """
+        Test that adding and deleting a comment changes both the detail and list ETags.
+        """
+        detail = self.client.get(self.video_url)["ETag"]
+        listing = self.client.get("/api/videos/")["ETag"]
+        self.assertEqual(self.client.get("/api/videos/", HTTP_IF_NONE_MATCH=listing).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post("/api/comments/", {"comment": "nice", "the_video": self.video.id})
+        response = self.client.get(self.video_url, HTTP_IF_NONE_MATCH=detail)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["comment_count"], 1)
+        after_post = self.client.get("/api/videos/", HTTP_IF_NONE_MATCH=listing)
+        self.assertEqual(after_post.status_code, status.HTTP_200_OK)
+
+        Comment.objects.get().delete()
+        response = self.client.get("/api/videos/", HTTP_IF_NONE_MATCH=after_post["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag_varies_with_query_string(self):
+        """
+        Test that different pages of a collection get different ETags.
+        """
+        first = self.client.get("/api/posts/")["ETag"]
+        second = self.client.get("/api/posts/?page_size=1")["ETag"]
+        self.assertNotEqual(first, second)
+
+    def test_subscription_list_etag_is_per_user(self):
+        """
+        Test that subscribing changes the subscriber's list ETag.
+        """
+        creator = User.objects.create_user(username="creator", password="testpassword")
+        etag = self.client.get("/api/subscriptions/")["ETag"]
+        self.client.post("/api/subscriptions/", {"subscribed_to": creator.id})
+        response = self.client.get("/api/subscriptions/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+
+def mp4_box(kind, payload):
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def tiny_mp4(duration=5, timescale=1000, width=640, height=360, mdat=b"\0" * 64):
+    """A header-only MP4: one video track, mdat before moov like a non-faststart file."""
+    mvhd = mp4_box(b"mvhd", b"\0" * 12 + struct.pack(">II", timescale, duration * timescale) + b"\0" * 80)
+    tkhd = mp4_box(b"tkhd", b"\0" * 76 + struct.pack(">II", width << 16, height << 16))
+    hdlr = mp4_box(b"hdlr", b"\0" * 8 + b"vide" + b"\0" * 13)
+    stsd = mp4_box(b"stsd", b"\0" * 4 + struct.pack(">I", 1) + mp4_box(b"avc1", b"\0" * 78))
+    minf = mp4_box(b"minf", mp4_box(b"stbl", stsd))
+    trak = mp4_box(b"trak", tkhd + mp4_box(b"mdia", hdlr + minf))
+    return mp4_box(b"ftyp", b"isom\0\0\0\0") + mp4_box(b"mdat", mdat) + mp4_box(b"moov", mvhd + trak)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class JobQueueTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/videos/", {
+                "video": SimpleUploadedFile("clip.mp4", content, content_type="video/mp4"),
+                "title": "Clip",
+                "desc": "desc",
+            }, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response
+
+    def test_upload_queues_jobs_and_returns_pending(self):
+        """
+        Test that an upload returns straight away with its processing jobs queued.
+        """
+        response = self.upload(tiny_mp4())
+        self.assertEqual(response.data["status"], "pending")
+        self.assertCountEqual(
+            Job.objects.filter(key=f"video:{response.data['id']}").values_list("kind", flat=True),
+            ["extract_metadata", "poster", "content_hash"],
+        )
+
+    @mock.patch("appapi.processing.shutil.which", return_value=None)
+    def test_worker_extracts_metadata_and_hash(self, which):
+        """
+        Test that running the workers fills in metadata and the content hash and marks the video ready.
+        """
+        content = tiny_mp4(duration=5, width=640, height=360)
+        video_id = self.upload(content).data["id"]
+        call_command("run_workers", processes=1, once=True, stdout=StringIO())
+
+        video = Video.objects.get(pk=video_id)
+        self.assertEqual(video.status, Video.READY)
+        self.assertEqual((video.duration, video.width, video.height, video.codec), (5.0, 640, 360, "avc1"))
+        self.assertEqual(video.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(self.client.get(f"/api/videos/{video_id}/").data["status"], "ready")
+
+    @mock.patch("appapi.processing.shutil.which", return_value=None)
+    def test_unreadable_video_fails_without_retry(self, which):
+        """
+        Test that a file that is not a video fails its metadata job at once and the video is marked failed.
+        """
+        video_id = self.upload(b"file_content").data["id"]
+        jobs.work(once=True)
+
+        job = Job.objects.get(key=f"video:{video_id}", kind="extract_metadata")
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertEqual(Video.objects.get(pk=video_id).status, Video.FAILED)
+
+    def test_failed_job_retries_with_backoff(self):
+        """
+        Test that a failing job is rescheduled with a growing delay until its attempts run out.
+        """
+        handler = mock.Mock(side_effect=RuntimeError("flaky"))
+        with mock.patch.dict(jobs.handlers, {"flaky": handler}), override_settings(JOBS={"BACKOFF": 10, "MAX_BACKOFF": 3600}):
+            job = jobs.enqueue("flaky", max_attempts=3, n=1)
+            delays = []
+            for _ in range(3):
+                Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(run_at=timezone.now())
+                job = jobs.run(jobs.claim("test"))
+                delays.append((job.run_at - timezone.now()).total_seconds())
+
+        handler.assert_called_with(n=1)
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertIn("flaky", job.last_error)
+        self.assertTrue(9 < delays[0] < 12 and 19 < delays[1] < 23)
+
+    def test_claim_is_exclusive(self):
+        """
+        Test that a job is handed to one worker only, and that an expired lease is reclaimed.
+        """
+        job = jobs.enqueue("noop")
+        self.assertEqual(jobs.claim("a").pk, job.pk)
+        self.assertIsNone(jobs.claim("b"))
+
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        reclaimed = jobs.claim("b")
+        self.assertEqual((reclaimed.locked_by, reclaimed.attempts), ("b", 2))
+
+    def test_reclaimed_job_outcome_is_dropped(self):
+        """
+        Test that a worker whose job was reclaimed does not overwrite the new owner's lease or report the job finished.
+        """
+        jobs.enqueue("noop")
+        mine = jobs.claim("a")
+        Job.objects.filter(pk=mine.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        theirs = jobs.claim("b")
+        finished = mock.Mock()
+        jobs.job_finished.connect(finished)
+        self.addCleanup(jobs.job_finished.disconnect, finished)
+        with mock.patch.dict(jobs.handlers, {"noop": lambda: None}):
+            job = jobs.run(mine)
+            self.assertEqual((job.status, job.locked_by, job.locked_at), (Job.RUNNING, "b", theirs.locked_at))
+            finished.assert_not_called()
+            self.assertEqual(jobs.run(theirs).status, Job.DONE)
+        finished.assert_called_once()
+
+    def test_lease_is_renewed_while_handler_runs(self):
+        """
+        Test that a long job keeps its lease through heartbeats, and that a reclaimed job is not renewed.
+        """
+        job = jobs.enqueue("noop")
+        claimed = jobs.claim("a")
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        claimed.locked_at = Job.objects.get(pk=job.pk).locked_at
+        self.assertTrue(jobs.renew(claimed))
+        self.assertIsNone(jobs.claim("b"))
+        stale = Job.objects.get(pk=job.pk)
+        self.assertTrue(jobs.renew(claimed))
+        self.assertFalse(jobs.renew(stale))
+
+        # the beats run on their own thread, so they are counted rather than written here
+        handler = mock.Mock(side_effect=lambda: time.sleep(0.35))
+        with mock.patch.dict(jobs.handlers, {"slow": handler}), override_settings(JOBS={"LEASE": 0.3}), \
+                mock.patch("appapi.jobs.renew", return_value=True) as renew:
+            jobs.enqueue("slow")
+            job = jobs.run(jobs.claim("a"))
+        self.assertEqual(job.status, Job.DONE)
+        self.assertGreaterEqual(renew.call_count, 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), HLS={"SEGMENT_DURATION": 6})
+@mock.patch("appapi.processing.shutil.which", return_value=None)
+@mock.patch("appapi.hls.shutil.which", return_value=None)
+class HLSPackagingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.content = tiny_mp4(duration=20, width=1280, height=720, mdat=os.urandom(100000))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/videos/", {
+                "video": SimpleUploadedFile("clip.mp4", self.content, content_type="video/mp4"),
+                "title": "Clip",
+                "desc": "desc",
+            }, format="multipart")
+        self.video_id = response.data["id"]
+
+    def test_packaging_writes_playlists_and_segments(self, *mocks):
+        """
+        Test that processing a video writes a master playlist and a segmented rendition.
+        """
+        jobs.work(once=True)
+        video = Video.objects.get(pk=self.video_id)
+        self.assertEqual(video.status, Video.READY)
+
+        rendition = video.renditions.get()
+        self.assertEqual((rendition.name, rendition.segment_count), ("source", 4))
+        master = open(video.hls_manifest.path).read()
+        self.assertIn("RESOLUTION=1280x720", master)
+        self.assertIn("source/index.m3u8", master)
+
+        playlist = open(rendition.playlist.path).read().splitlines()
+        self.assertEqual(playlist[-1], "#EXT-X-ENDLIST")
+        segments = [line for line in playlist if line.endswith(".ts")]
+        directory = os.path.dirname(rendition.playlist.path)
+        self.assertEqual(b"".join(open(os.path.join(directory, name), "rb").read() for name in segments), self.content)
+
+        response = self.client.get(f"/api/videos/{self.video_id}/")
+        self.assertTrue(response.data["manifest_url"].endswith(f"/media/uploads/hls/{self.video_id}/master.m3u8"))
+
+    def test_manifest_url_is_empty_until_packaged(self, *mocks):
+        """
+        Test that an unprocessed video has no manifest URL.
+        """
+        response = self.client.get(f"/api/videos/{self.video_id}/")
+        self.assertIsNone(response.data["manifest_url"])
+
+    def test_deleting_video_removes_renditions(self, *mocks):
+        """
+        Test that deleting a video removes its HLS directory.
+        """
+        jobs.work(once=True)
+        directory = os.path.dirname(Video.objects.get(pk=self.video_id).hls_manifest.path)
+        tree = os.path.realpath(directory)
+        self.assertTrue(os.path.isdir(directory))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/videos/{self.video_id}/")
+        self.assertFalse(os.path.lexists(directory))
+        self.assertFalse(os.path.exists(tree))
+
+    def test_repackaging_switches_trees_atomically(self, *mocks):
+        """
+        Test that a rebuild repoints the video's directory with one rename while the old tree is whole, then deletes it.
+        """
+        jobs.work(once=True)
+        video = Video.objects.get(pk=self.video_id)
+        directory = hls.output_dir(self.video_id)
+        first = os.path.realpath(directory)
+        self.assertTrue(os.path.islink(directory))
+
+        switches = []
+        real_replace = os.replace
+
+        def replace(src, dst):
+            if dst == directory:
+                switches.append(os.path.isfile(os.path.join(dst, "master.m3u8")))
+            real_replace(src, dst)
+        with mock.patch("appapi.hls.os.replace", side_effect=replace):
+            hls.package(video)
+        self.assertEqual(switches, [True])
+        self.assertNotEqual(os.path.realpath(directory), first)
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(directory))),
+                         sorted([str(self.video_id), os.path.basename(os.path.realpath(directory))]))
+
+        # a tree packaged before the link existed is replaced as well
+        tree = os.path.realpath(directory)
+        os.remove(directory)
+        os.rename(tree, directory)
+        hls.package(video)
+        self.assertTrue(os.path.islink(directory))
+        self.assertTrue(os.path.isfile(os.path.join(directory, "master.m3u8")))
+        self.assertEqual(len(os.listdir(os.path.dirname(directory))), 2)
+
+
+def png_bytes(color="red", size=(4, 4)):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContentAddressedStorageTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+
+    def upload_video(self, content, filename="clip.mp4"):
+        response = self.client.post("/api/videos/", {
+            "video": SimpleUploadedFile(filename, content, content_type="video/mp4"),
+            "title": "Clip",
+            "desc": "desc",
+        }, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Video.objects.get(pk=response.data["id"])
+
+    def test_identical_uploads_share_one_blob(self):
+        """
+        Test that the same bytes uploaded twice under different names are stored once and counted twice.
+        """
+        first = self.upload_video(b"same bytes", "a.mp4")
+        second = self.upload_video(b"same bytes", "b.MP4")
+        digest = hashlib.sha256(b"same bytes").hexdigest()
+        self.assertEqual(first.video.name, second.video.name)
+        self.assertEqual(first.video.name, f"blobs/{digest[:2]}/{digest[2:4]}/{digest}.mp4")
+        self.assertEqual(Blob.objects.get(name=first.video.name).refcount, 2)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.video.path))), 1)
+
+    def test_blob_deleted_with_last_reference(self):
+        """
+        Test that deleting videos releases the blob and removes the file only when it is unused.
+        """
+        first = self.upload_video(b"same bytes")
+        second = self.upload_video(b"same bytes")
+        path = first.video.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/videos/{first.id}/")
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Blob.objects.get().refcount, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/videos/{second.id}/")
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_replacing_post_image_releases_old_blob(self):
+        """
+        Test that a PUT with a new image releases the old one and a post delete releases the new one.
+        """
+        response = self.client.post("/api/posts/", {
+            "post": "hello", "post_image": SimpleUploadedFile("a.png", png_bytes("red"), content_type="image/png"),
+        }, format="multipart")
+        post = Post.objects.get(pk=response.data["id"])
+        old = post.post_image.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f"/api/posts/{post.id}/", {
+                "post": "hello", "post_image": SimpleUploadedFile("b.png", png_bytes("blue"), content_type="image/png"),
+            }, format="multipart")
+        post.refresh_from_db()
+        self.assertFalse(os.path.exists(old))
+        self.assertEqual(list(Blob.objects.values_list("name", "refcount")), [(post.post_image.name, 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/posts/{post.id}/")
+        self.assertFalse(Blob.objects.exists())
+
+    def test_reuploading_same_image_keeps_one_reference(self):
+        """
+        Test that PUTting the same image twice leaves one reference, so deleting the post deletes the blob.
+        """
+        response = self.client.post("/api/posts/", {"post": "hello"}, format="multipart")
+        post_url = f"/api/posts/{response.data['id']}/"
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.put(post_url, {
+                    "post": "hello", "post_image": SimpleUploadedFile("a.png", png_bytes("red"), content_type="image/png"),
+                }, format="multipart")
+        self.assertEqual(Blob.objects.get().refcount, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(post_url)
+        self.assertFalse(Blob.objects.exists())
+
+    def test_release_interleaved_with_identical_upload(self):
+        """
+        Test that a release's deferred delete landing just before or just after an identical upload takes its reference leaves the file in place.
+        """
+        hooks = {
+            "appapi.storage.retain": storage.retain,
+            "appapi.storage.ContentAddressedStorage.exists": storage.ContentAddressedStorage.exists,
+        }
+        for hook, original in hooks.items():
+            with self.subTest(hook=hook):
+                first = self.upload_video(b"same bytes")
+                with self.captureOnCommitCallbacks() as callbacks:
+                    self.client.delete(f"/api/videos/{first.id}/")
+
+                def delete_first(*args, **kwargs):
+                    for callback in callbacks:
+                        callback()
+                    return original(*args, **kwargs)
+
+                with mock.patch(hook, delete_first):
+                    second = self.upload_video(b"same bytes")
+                self.assertEqual(second.video.name, first.video.name)
+                self.assertEqual(Blob.objects.get().refcount, 1)
+                with second.video.open("rb") as f:
+                    self.assertEqual(f.read(), b"same bytes")
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.delete(f"/api/videos/{second.id}/")
+                self.assertFalse(os.path.exists(second.video.path))
+                self.assertFalse(Blob.objects.exists())
+
+    def test_dedupe_media_moves_legacy_files(self):
+        """
+        Test that dedupe_media collapses duplicate legacy files into one blob and deletes orphans on request.
+        """
+        from django.conf import settings
+        uploads_dir = os.path.join(settings.MEDIA_ROOT, "uploads")
+        os.makedirs(uploads_dir, exist_ok=True)
+        for name in ("a.mp4", "a_x1.mp4", "orphan.mp4"):
+            with open(os.path.join(uploads_dir, name), "wb") as f:
+                f.write(b"legacy bytes")
+        for name in ("uploads/a.mp4", "uploads/a_x1.mp4", "uploads/a.mp4"):
+            Video.objects.create(video=name, title="Old", desc="desc", creator=self.user)
+
+        out = StringIO()
+        call_command("dedupe_media", "--delete-orphans", stdout=out)
+
+        names = set(Video.objects.values_list("video", flat=True))
+        self.assertEqual(len(names), 1)
+        blob = Blob.objects.get()
+        self.assertEqual((blob.name, blob.refcount), (names.pop(), 3))
+        self.assertEqual(os.listdir(uploads_dir), [])
+        self.assertIn("1 unreferenced file(s) deleted", out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageDerivativeTests(APITestCase):
+    def setUp(self):
+        shutil.rmtree(images.cache_dir(), ignore_errors=True)
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post("/api/posts/", {
+            "post": "hello", "post_image": SimpleUploadedFile("a.png", png_bytes("red", (400, 300)), content_type="image/png"),
+        }, format="multipart")
+        self.post = Post.objects.get(pk=response.data["id"])
+        self.srcset = response.data["srcset"]
+
+    def test_serializer_exposes_srcset_per_format(self):
+        """
+        Test that posts list one srcset string per format with a candidate for each named size.
+        """
+        self.assertEqual(set(self.srcset), {"webp", "jpeg"})
+        candidates = self.srcset["webp"].split(", ")
+        self.assertEqual([candidate.split()[1] for candidate in candidates], ["160w", "320w", "640w", "1280w"])
+        self.assertIn(f"/api/posts/{self.post.id}/image/thumb.webp?v=", candidates[0])
+
+    def test_derivative_is_resized_and_cached(self):
+        """
+        Test that a derivative is generated once and cached for good, privately, under its version.
+        """
+        url = self.srcset["webp"].split(", ")[0].split()[0]
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertEqual(response["Cache-Control"], "private, max-age=31536000, immutable")
+        image = Image.open(BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual((image.format, image.size), ("WEBP", (160, 120)))
+
+        with mock.patch("appapi.images.Image.open", side_effect=AssertionError):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_derivative_never_upscales(self):
+        """
+        Test that sizes wider than the source keep the source dimensions, and JPEG output works.
+        """
+        response = self.client.get(f"/api/posts/{self.post.id}/image/large.jpeg")
+        image = Image.open(BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual((image.format, image.size), ("JPEG", (400, 300)))
+        self.assertEqual(response["Cache-Control"], "private, max-age=300")
+
+    def test_derivative_needs_owner_or_admin(self):
+        """
+        Test that anonymous clients get 401 and other users 403, as for the post itself.
+        """
+        url = f"/api/posts/{self.post.id}/image/thumb.webp"
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(user=User.objects.create_user(username="otheruser", password="testpassword"))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_unknown_size_or_missing_image_is_404(self):
+        """
+        Test that unknown sizes, formats and posts without an image return 404.
+        """
+        self.assertEqual(self.client.get(f"/api/posts/{self.post.id}/image/huge.webp").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(f"/api/posts/{self.post.id}/image/thumb.gif").status_code, status.HTTP_404_NOT_FOUND)
+        bare = Post.objects.create(post="text only", creator=self.user)
+        self.assertEqual(self.client.get(f"/api/posts/{bare.id}/image/thumb.webp").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_lru_eviction_by_total_bytes(self):
+        """
+        Test that going over the byte budget evicts the least recently used derivatives first.
+        """
+        name = self.post.post_image.name
+        first = images.derivative(name, "thumb", "jpeg")
+        second = images.derivative(name, "small", "jpeg")
+        os.utime(first, ns=(1, 1))
+        os.utime(second, ns=(2, 2))
+        images.derivative(name, "thumb", "jpeg")  # a read makes it most recent again
+
+        budget = os.path.getsize(first) + os.path.getsize(second) + 1
+        with override_settings(IMAGE_DERIVATIVES={"MAX_BYTES": budget}):
+            third = images.derivative(name, "thumb", "webp")
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        self.assertTrue(os.path.exists(third))
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.guitar = Video.objects.create(video="a.mp4", title="Guitar lesson", desc="learn chords", creator=self.user)
+        self.cooking = Video.objects.create(video="b.mp4", title="Cooking", desc="a guitar plays in the background", creator=self.user)
+        self.post = Post.objects.create(post="New guitar strings <b>today</b>", creator=self.user)
+
+    def test_ranked_results_with_highlights(self):
+        """
+        Test that title matches outrank body matches and matches are highlighted with escaped text.
+        """
+        response = self.client.get("/api/search/?q=guitar")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual(results[0]["id"], self.guitar.id)
+        self.assertEqual(results[0]["highlight"]["title"], "<mark>Guitar</mark> lesson")
+        self.assertEqual(results[0]["object"]["title"], "Guitar lesson")
+        self.assertEqual({(r["type"], r["id"]) for r in results},
+                         {("video", self.guitar.id), ("video", self.cooking.id), ("post", self.post.id)})
+        post_hit = next(r for r in results if r["type"] == "post")
+        self.assertIn("&lt;b&gt;today&lt;/b&gt;", post_hit["highlight"]["snippet"])
+
+    def test_prefix_type_filter_and_operators(self):
+        """
+        Test that the last word matches as a prefix, ?type= filters and FTS5 syntax in queries is inert.
+        """
+        results = self.client.get("/api/search/?q=gui&type=post").data["results"]
+        self.assertEqual([(r["type"], r["id"]) for r in results], [("post", self.post.id)])
+        self.assertEqual(self.client.get('/api/search/?q=guitar" OR "x').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get("/api/search/?q=").data["results"], [])
+
+    def test_index_follows_updates_and_deletes(self):
+        """
+        Test that edits and deletes are reflected in search results.
+        """
+        self.cooking.title = "Baking"
+        self.cooking.desc = "bread"
+        self.cooking.save()
+        self.post.delete()
+        results = self.client.get("/api/search/?q=guitar").data["results"]
+        self.assertEqual([r["id"] for r in results], [self.guitar.id])
+        self.assertEqual(self.client.get("/api/search/?q=bread").data["results"][0]["id"], self.cooking.id)
+
+    def test_pagination(self):
+        """
+        Test that results are paged with next and previous links.
+        """
+        response = self.client.get("/api/search/?q=guitar&page_size=2")
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertIsNone(response.data["previous"])
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIsNone(response.data["next"])
+        self.assertIsNotNone(response.data["previous"])
+
+    def test_rebuild_and_fallback(self):
+        """
+        Test that the rebuild command reindexes existing rows and that icontains is used without the index.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM appapi_search")
+        self.assertEqual(self.client.get("/api/search/?q=guitar").data["results"], [])
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertIn("3 document(s) indexed", out.getvalue())
+        self.assertEqual(len(self.client.get("/api/search/?q=guitar").data["results"]), 3)
+
+        with mock.patch("appapi.search.available", return_value=False):
+            results = self.client.get("/api/search/?q=chords").data["results"]
+        self.assertEqual([r["id"] for r in results], [self.guitar.id])
+        self.assertEqual(results[0]["highlight"]["snippet"], "learn <mark>chords</mark>")
+
+
+class BulkWriteTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.creators = [User.objects.create_user(username=f"creator{i}", password="testpassword") for i in range(3)]
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(video="sample.mp4", title="Video", desc="desc", creator=self.creators[0])
+
+    def test_bulk_comments_report_errors_per_item(self):
+        """
+        Test that valid comments are created in one batch and invalid ones are reported by index.
+        """
+        items = [{"comment": f"comment {i}", "the_video": self.video.id} for i in range(50)]
+        items[3] = {"comment": "no such video", "the_video": 999999}
+        items[7] = {"the_video": self.video.id}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/comments/bulk/", items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual((response.data["created"], response.data["failed"]), (48, 2))
+        self.assertLess(len(queries), 10)
+
+        results = response.data["results"]
+        self.assertEqual([r["index"] for r in results], list(range(50)))
+        self.assertEqual(results[3]["status"], 400)
+        self.assertIn("the_video", results[3]["errors"])
+        self.assertIn("comment", results[7]["errors"])
+        self.assertEqual(Comment.objects.get(pk=results[0]["id"]).comment, "comment 0")
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.comment_count, 48)
+
+    def test_bulk_subscriptions(self):
+        """
+        Test that bulk subscribing rejects self, repeat and duplicate items, counts and backfills the rest.
+        """
+        Subscription.objects.create(subscriber=self.user, subscribed_to=self.creators[2])
+        items = [{"subscribed_to": self.creators[0].id}, {"subscribed_to": self.user.id},
+                 {"subscribed_to": self.creators[0].id}, {"subscribed_to": self.creators[1].id},
+                 {"subscribed_to": self.creators[2].id}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/subscriptions/bulk/", items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r["status"] for r in response.data["results"]], [201, 400, 400, 201, 400])
+        self.assertEqual(Profile.objects.get(user=self.creators[0]).subscriber_count, 1)
+        self.assertEqual(Profile.objects.get(user=self.creators[1]).subscriber_count, 1)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, video=self.video).exists())
+
+        response = self.client.get("/api/subscriptions/")
+        self.assertEqual(len(response.data), 3)
+
+    def test_rejected_batches(self):
+        """
+        Test that a non-list, an empty list, an oversized list and an all-invalid list are 400s.
+        """
+        for body in ({"comment": "x", "the_video": self.video.id}, [], [{"comment": "x"}]):
+            response = self.client.post("/api/comments/bulk/", body, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(BULK_WRITE_MAX_ITEMS=2):
+            response = self.client.post("/api/comments/bulk/", [{"comment": "x", "the_video": self.video.id}] * 3, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_idempotency_key_replays_the_first_response(self):
+        """
+        Test that a retried batch with the same key is not written twice and a reused key with a new body is refused.
+        """
+        items = [{"comment": "once", "the_video": self.video.id}]
+        first = self.client.post("/api/comments/bulk/", items, format="json", HTTP_IDEMPOTENCY_KEY="batch-1")
+        retry = self.client.post("/api/comments/bulk/", items, format="json", HTTP_IDEMPOTENCY_KEY="batch-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Comment.objects.count(), 1)
+
+        response = self.client.post("/api/comments/bulk/", items * 2, format="json", HTTP_IDEMPOTENCY_KEY="batch-1")
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # keys are per endpoint
+        response = self.client.post("/api/subscriptions/bulk/", [{"subscribed_to": self.creators[1].id}],
+                                    format="json", HTTP_IDEMPOTENCY_KEY="batch-1")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with override_settings(IDEMPOTENCY_KEY_TTL=0):
+            time.sleep(0.01)
+            response = self.client.post("/api/comments/bulk/", items, format="json", HTTP_IDEMPOTENCY_KEY="batch-1")
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_bulk_view_requires_perform_bulk_create(self):
+        """
+        Test that a bulk view without perform_bulk_create cannot be instantiated.
+        """
+        class Incomplete(BulkCreateView):
+            serializer_class = CommentSerializer
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class ThreadedCommentTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(video="sample.mp4", title="Video", desc="desc", creator=self.user)
+        self.other_video = Video.objects.create(video="other.mp4", title="Other", desc="desc", creator=self.user)
+
+    def comment(self, text, parent=None, video=None):
+        response = self.client.post("/api/comments/", {
+            "comment": text, "the_video": (video or self.video).id, "parent": parent,
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return response.data["id"]
+
+    def test_thread_in_reading_order(self):
+        """
+        Test that a thread lists each comment followed by its replies, with depths and reply counts.
+        """
+        root = self.comment("root")
+        first = self.comment("first reply", root)
+        nested = self.comment("nested reply", first)
+        second = self.comment("second reply", root)
+        self.comment("unrelated")
+
+        response = self.client.get(f"/api/comments/{root}/thread/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual([c["id"] for c in results], [root, first, nested, second])
+        self.assertEqual([c["depth"] for c in results], [0, 1, 2, 1])
+        self.assertEqual(results[0]["reply_count"], 2)
+        self.assertEqual(results[2]["parent"], first)
+
+        page = self.client.get(f"/api/comments/{root}/thread/?page_size=2")
+        rest = self.client.get(page.data["next"])
+        self.assertEqual([c["id"] for c in page.data["results"] + rest.data["results"]], [root, first, nested, second])
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.comment_count, 5)
+
+    def test_video_comments_sorted_newest_and_top(self):
+        """
+        Test that a video's top-level comments page newest first or by reply count.
+        """
+        busy = self.comment("busy")
+        quiet = self.comment("quiet")
+        self.comment("reply", busy)
+        self.comment("elsewhere", video=self.other_video)
+
+        url = f"/api/videos/{self.video.id}/comments/"
+        self.assertEqual([c["id"] for c in self.client.get(url).data["results"]], [quiet, busy])
+        top = self.client.get(url + "?sort=top").data["results"]
+        self.assertEqual([c["id"] for c in top], [busy, quiet])
+        self.assertTrue(top[0]["thread_url"].endswith(f"/api/comments/{busy}/thread/"))
+        self.assertEqual(self.client.get(url + "?sort=oldest").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get("/api/videos/999999/comments/").status_code, status.HTTP_404_NOT_FOUND)
+
+        # the listing is cached per video and invalidated by new comments
+        self.comment("newest")
+        self.assertEqual(len(self.client.get(url).data["results"]), 3)
+
+    def test_reply_validation(self):
+        """
+        Test that replies must stay on their parent's video and within the depth limit.
+        """
+        root = self.comment("root")
+        response = self.client.post("/api/comments/", {"comment": "x", "the_video": self.other_video.id, "parent": root}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("parent", response.data)
+
+        reply = self.comment("reply", root)
+        with override_settings(COMMENT_MAX_DEPTH=1):
+            response = self.client.post("/api/comments/", {"comment": "x", "the_video": self.video.id, "parent": reply}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_removes_replies_and_fixes_counts(self):
+        """
+        Test that deleting a comment deletes its replies and updates the video and parent counters.
+        """
+        root = self.comment("root")
+        first = self.comment("first reply", root)
+        self.comment("nested reply", first)
+        self.comment("second reply", root)
+
+        response = self.client.delete(f"/api/comments/{first}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Comment.objects.count(), 2)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.comment_count, 2)
+        self.assertEqual(Comment.objects.get(pk=root).reply_count, 1)
+
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("reply_count: 0 row(s) corrected", out.getvalue())
+
+    def test_only_owner_or_admin_deletes(self):
+        """
+        Test that another user cannot delete a comment thread, while an admin can.
+        """
+        root = self.comment("root")
+        self.comment("reply", root)
+        self.client.force_authenticate(user=User.objects.create_user(username="otheruser", password="testpassword"))
+        self.assertEqual(self.client.delete(f"/api/comments/{root}/").status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Comment.objects.count(), 2)
+
+        self.client.force_authenticate(user=User.objects.create_superuser(username="admin", password="adminpassword"))
+        self.assertEqual(self.client.delete(f"/api/comments/{root}/").status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_bulk_replies(self):
+        """
+        Test that bulk-created replies get paths, depths and parent reply counts.
+        """
+        root = self.comment("root")
+        response = self.client.post("/api/comments/bulk/", [
+            {"comment": "a", "the_video": self.video.id, "parent": root},
+            {"comment": "b", "the_video": self.video.id},
+        ], format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        reply, top = (Comment.objects.get(pk=r["id"]) for r in response.data["results"])
+        self.assertEqual((reply.depth, reply.path), (1, f"{root:010d}/{reply.id:010d}/"))
+        self.assertEqual((top.depth, top.path), (0, f"{top.id:010d}/"))
+        self.assertEqual(Comment.objects.get(pk=root).reply_count, 1)
+
+
+class ViewAnalyticsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.hot = Video.objects.create(video="hot.mp4", title="Hot", desc="desc", creator=self.user)
+        self.cold = Video.objects.create(video="cold.mp4", title="Cold", desc="desc", creator=self.user)
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir, ignore_errors=True)
+        overrider = override_settings(VIEW_EVENTS={"LOG_DIR": log_dir, "MAX_BATCH": 100, "MAX_VIEWS_PER_HOUR": 10})
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+        # per-viewer caps live in the process-wide throttle store
+        throttling.get_store().clear()
+        self.addCleanup(throttling.get_store().clear)
+
+    def send(self, beacons, **extra):
+        return self.client.post("/api/views/", beacons, format="json", **extra)
+
+    def test_beacons_are_logged_then_flushed_into_rollups(self):
+        """
+        Test that beacons cost no database writes until a flush adds them to rollups and view counts.
+        """
+        self.client.force_authenticate(user=None)
+        with self.assertNumQueries(0):
+            response = self.send([{"video": self.hot.id, "seconds": 30}] * 3 + [
+                {"video": self.cold.id, "seconds": 5.5}, {"video": "x"}, {"video": self.hot.id, "seconds": -1},
+                {"video": 999999, "seconds": 1}, "junk",
+            ])
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {"accepted": 5, "rejected": 3})
+        self.assertFalse(ViewRollup.objects.exists())
+
+        out = StringIO()
+        call_command("flush_views", stdout=out)
+        self.assertIn("4 view(s) added to 2 rollup row(s)", out.getvalue())
+        rollup = ViewRollup.objects.get(video=self.hot)
+        self.assertEqual((rollup.views, rollup.watch_seconds), (3, 90))
+        self.assertEqual(rollup.hour.minute, 0)
+
+        # a second flush adds to the same hour's row
+        self.send([{"video": self.hot.id, "seconds": 10}])
+        analytics.flush()
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.views, rollup.watch_seconds), (4, 100))
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(f"/api/videos/{self.hot.id}/").data["view_count"], 4)
+        self.assertEqual(analytics.flush(), (0, 0))
+
+    def test_rejects_malformed_batches(self):
+        """
+        Test that a non-list or a batch over MAX_BATCH is refused.
+        """
+        self.assertEqual(self.send({"video": self.hot.id}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.send([{"video": self.hot.id}] * 101).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_views_are_capped_per_viewer(self):
+        """
+        Test that a viewer's views of one video beyond MAX_VIEWS_PER_HOUR are dropped, for users and per anonymous address.
+        """
+        response = self.send([{"video": self.hot.id, "seconds": 1}] * 8 + [{"video": self.cold.id, "seconds": 1}])
+        self.assertEqual(response.data, {"accepted": 9, "rejected": 0})
+        response = self.send([{"video": self.hot.id, "seconds": 1}] * 5)
+        self.assertEqual(response.data, {"accepted": 2, "rejected": 3})
+
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.send([{"video": self.hot.id}] * 12).data, {"accepted": 10, "rejected": 2})
+        # X-Forwarded-For is not a new viewer
+        self.assertEqual(self.send([{"video": self.hot.id}], HTTP_X_FORWARDED_FOR="10.0.0.9").data["accepted"], 0)
+        self.assertEqual(self.send([{"video": self.hot.id}], REMOTE_ADDR="10.0.0.9").data["accepted"], 1)
+
+        analytics.flush()
+        self.assertEqual(ViewRollup.objects.get(video=self.hot).views, 21)
+
+    @override_settings(THROTTLE={"RATES": {"beacon": "2/min"}})
+    def test_beacons_have_their_own_scope(self):
+        """
+        Test that beacon requests are charged to the beacon scope, not the write one.
+        """
+        throttling.get_store().clear()
+        for _ in range(2):
+            self.assertEqual(self.send([{"video": self.hot.id}]).status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.send([{"video": self.hot.id}]).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_leftover_logs_are_flushed(self):
+        """
+        Test that a log rotated by a flush that did not finish is picked up by the next one.
+        """
+        self.send([{"video": self.cold.id, "seconds": 1}])
+        os.rename(analytics.log_path(), analytics.log_path() + ".1")
+        self.send([{"video": self.cold.id, "seconds": 2}])
+        self.assertEqual(analytics.flush(), (2, 1))
+        self.assertEqual(os.listdir(os.path.dirname(analytics.log_path())), [])
+
+    def test_trending(self):
+        """
+        Test that trending ranks videos by recent views and refreshes after a flush.
+        """
+        self.send([{"video": self.hot.id, "seconds": 3}] * 5 + [{"video": self.cold.id, "seconds": 3}])
+        analytics.flush()
+        response = self.client.get("/api/videos/trending/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(v["id"], v["recent_views"]) for v in response.data["results"]],
+                         [(self.hot.id, 5), (self.cold.id, 1)])
+        self.assertEqual(response.data["results"][0]["recent_watch_seconds"], 15)
+
+        old = timezone.now() - timedelta(hours=30)
+        ViewRollup.objects.create(video=self.cold, hour=old.replace(minute=0, second=0, microsecond=0), views=100)
+        self.assertEqual(self.client.get("/api/videos/trending/?limit=1").data["results"][0]["id"], self.hot.id)
+        self.assertEqual(self.client.get("/api/videos/trending/?hours=48&limit=1").data["results"][0]["id"], self.cold.id)
+
+        self.send([{"video": self.cold.id}] * 10)
+        analytics.flush()
+        self.assertEqual(self.client.get("/api/videos/trending/?limit=1").data["results"][0]["id"], self.cold.id)
+
+
+class RankingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.creators = [User.objects.create(username=f"creator{i}") for i in range(4)]
+        # creator0 and creator1 share their audience; creator2 has its own
+        for i in range(3):
+            fan = User.objects.create(username=f"fan{i}")
+            Subscription.objects.create(subscriber=fan, subscribed_to=self.creators[0])
+            Subscription.objects.create(subscriber=fan, subscribed_to=self.creators[1])
+        loner = User.objects.create(username="loner")
+        Subscription.objects.create(subscriber=loner, subscribed_to=self.creators[2])
+        Subscription.objects.create(subscriber=loner, subscribed_to=self.creators[3])
+        now = timezone.now()
+        self.videos = [
+            Video.objects.create(video=f"{i}.mp4", title=f"Video {i}", desc="desc", creator=creator, created_at=now)
+            for i, creator in enumerate(self.creators)
+        ]
+
+    def test_scores_decay_with_age(self):
+        """
+        Test that equal engagement scores lower on an older video and recent views outweigh old ones.
+        """
+        now = timezone.now()
+        old = self.videos[3]
+        Video.objects.update(created_at=now)
+        Video.objects.filter(pk=old.pk).update(created_at=now - timedelta(days=2))
+        Video.objects.filter(pk__in=[self.videos[2].pk, old.pk]).update(comment_count=4)
+        ViewRollup.objects.create(video=self.videos[0], hour=now, views=10)
+        ViewRollup.objects.create(video=self.videos[1], hour=now - timedelta(hours=48), views=10)
+
+        weights = {"views": 1.0, "comments": 5.0, "subscriptions": 0.0}
+        with override_settings(RANKING={"WEIGHTS": weights, "HALF_LIFE_HOURS": 24, "VIEW_WINDOW_HOURS": 72}):
+            ids, _, scores = ranking.score_videos(now)
+        score = dict(zip(ids.tolist(), scores.tolist()))
+        self.assertAlmostEqual(score[self.videos[0].pk], 10, places=2)
+        self.assertAlmostEqual(score[self.videos[1].pk], 2.5, places=2)
+        self.assertAlmostEqual(score[old.pk] * 4, score[self.videos[2].pk], places=2)
+
+    def test_trending_sort_pages_the_ranking(self):
+        """
+        Test that ?sort=trending pages videos by rank and refreshes after a re-rank.
+        """
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for views, video in zip([5, 50, 20, 1], self.videos):
+            ViewRollup.objects.create(video=video, hour=hour, views=views)
+        # every fan already follows both creators of their cluster
+        self.assertEqual(ranking.rank(), (4, 0))
+
+        response = self.client.get("/api/videos/?sort=trending&page_size=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(v["id"], v["rank"]) for v in response.data["results"]],
+                         [(self.videos[1].id, 1), (self.videos[2].id, 2)])
+        response = self.client.get(response.data["next"])
+        self.assertEqual([v["id"] for v in response.data["results"]], [self.videos[0].id, self.videos[3].id])
+
+        ViewRollup.objects.filter(video=self.videos[3]).update(views=500)
+        ranking.rank()
+        self.assertEqual(self.client.get("/api/videos/?sort=trending").data["results"][0]["id"], self.videos[3].id)
+        self.assertEqual(self.client.get("/api/videos/?sort=oldest").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_recommends_videos_of_co_subscribed_creators(self):
+        """
+        Test that a user is recommended the creators followed alongside theirs, not ones they already follow.
+        """
+        Subscription.objects.create(subscriber=self.user, subscribed_to=self.creators[0])
+        ranking.rank()
+        response = self.client.get("/api/recommendations/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["source"], "subscriptions")
+        self.assertEqual([v["id"] for v in response.data["results"]], [self.videos[1].id])
+
+        # without subscriptions there is nothing personal: fall back to trending
+        Subscription.objects.filter(subscriber=self.user).delete()
+        ranking.rank()
+        response = self.client.get("/api/recommendations/")
+        self.assertEqual(response.data["source"], "trending")
+        self.assertEqual(len(response.data["results"]), 4)
+
+    def test_job_reschedules_itself(self):
+        """
+        Test that the rank_videos job ranks and queues exactly one next run.
+        """
+        call_command("rank_videos", "--schedule", stdout=StringIO())
+        call_command("rank_videos", "--schedule", stdout=StringIO())
+        job = Job.objects.get(kind="rank_videos")
+        jobs.run(jobs.claim("test"))
+        self.assertEqual(VideoScore.objects.count(), 4)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        next_run = Job.objects.get(kind="rank_videos", status=Job.QUEUED)
+        self.assertGreater(next_run.run_at, timezone.now() + timedelta(seconds=ranking.option("INTERVAL") - 60))
+
+
+class ThrottleTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.throttle_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.throttle_dir, ignore_errors=True)
+        self.use_store("local")
+
+    def use_store(self, store, **options):
+        overrider = override_settings(THROTTLE={
+            "STORE": store,
+            "PATH": os.path.join(self.throttle_dir, "throttle.sqlite3"),
+            "RATES": {"read": "3/min", "auth": "2/min", "upload": "100/min"},
+            "CONCURRENCY": {"upload": 1},
+            **options,
+        })
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+        store = throttling.get_store()
+        store.clear()
+        # buckets outlive the test in the process-wide store
+        self.addCleanup(store.clear)
+
+    def assert_bucket(self, store):
+        self.use_store(store)
+        now = time.time()
+        with mock.patch("appapi.throttling.time.time", return_value=now):
+            for remaining in (2, 1, 0):
+                response = self.client.get("/api/videos/")
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response["RateLimit-Limit"], "3")
+                self.assertEqual(response["RateLimit-Remaining"], str(remaining))
+            response = self.client.get("/api/videos/")
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            # one token comes back every 20 seconds
+            self.assertEqual(response["Retry-After"], "20")
+            self.assertEqual(response["RateLimit-Reset"], "60")
+            # writes are another scope, with no rate configured here
+            self.assertNotEqual(self.client.delete("/api/videos/999999/").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        with mock.patch("appapi.throttling.time.time", return_value=now + 20):
+            self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_token_bucket(self):
+        """
+        Test that a scope's bucket refuses requests once empty and refills over time, with rate-limit headers.
+        """
+        self.assert_bucket("local")
+
+    def test_sqlite_store(self):
+        """
+        Test that the SQLite store applies the same bucket, shared between store instances as between processes.
+        """
+        self.assert_bucket("sqlite")
+        other = throttling.SQLiteStore(throttling.option("PATH"))
+        granted, _ = other.take(f"read:user:{self.user.pk}", 3, 3 / 60, time.time())
+        self.assertFalse(granted)
+
+    def test_anonymous_requests_are_limited_per_address(self):
+        """
+        Test that login attempts are counted per client address in the auth scope.
+        """
+        self.client.force_authenticate(user=None)
+        for _ in range(2):
+            response = self.client.post("/api/token/", {"username": "testuser", "password": "wrong"})
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post("/api/token/", {"username": "testuser", "password": "testpassword"})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post("/api/token/", {"username": "testuser", "password": "testpassword"},
+                                    REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_forwarded_for_is_trusted_only_from_proxies(self):
+        """
+        Test that a client cannot escape its address's bucket with X-Forwarded-For, and that configured proxies' entries are used.
+        """
+        self.client.force_authenticate(user=None)
+        body = {"username": "testuser", "password": "wrong"}
+        for forwarded in ("1.1.1.1", "2.2.2.2"):
+            response = self.client.post("/api/token/", body, HTTP_X_FORWARDED_FOR=forwarded)
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post("/api/token/", body, HTTP_X_FORWARDED_FOR="3.3.3.3")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        self.use_store("local", NUM_PROXIES=1)
+        for _ in range(2):
+            response = self.client.post("/api/token/", body, HTTP_X_FORWARDED_FOR="spoofed, 10.0.0.7")
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post("/api/token/", body, HTTP_X_FORWARDED_FOR="other, 10.0.0.7")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post("/api/token/", body, HTTP_X_FORWARDED_FOR="10.0.0.8")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_concurrency_limit(self):
+        """
+        Test that an upload is refused while the user's only upload slot is held, and slots are released afterwards.
+        """
+        store = throttling.get_store()
+        key = f"upload:user:{self.user.pk}"
+        slot = store.acquire(key, 1, 600, time.time())
+        body = {"filename": "clip.mp4", "title": "Clip", "desc": "d", "total_size": 10}
+        response = self.client.post("/api/uploads/", body)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "1")
+
+        store.release(key, slot)
+        self.assertEqual(self.client.post("/api/uploads/", body).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post("/api/uploads/", body).status_code, status.HTTP_201_CREATED)
+        # a slot from a crashed request expires with its lease
+        self.assertIsNotNone(store.acquire(key, 1, 600, time.time()))
+        self.assertIsNone(store.acquire(key, 1, 600, time.time()))
+        self.assertIsNotNone(store.acquire(key, 1, 600, time.time() + 601))
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
 
 
 
@@ -281,13 +2156,508 @@ class AuthenticationTests(APITestCase):
 #         self.assertIn("desc", response.data)
 
 
+class StatelessTokenTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="otheruser", password="testpassword")
+        self.video = Video.objects.create(video="sample.mp4", title="Video", desc="desc", creator=self.user, created_at=timezone.now())
+        self.login(self.user)
 
+    def login(self, user):
+        response = self.client.post("/api/token/", {"username": user.username, "password": "testpassword"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return response.data["access"]
 
+    def test_token_carries_claims(self):
+        """
+        Test that the access token embeds the username and staff flag that request.user is built from.
+        """
+        token = self.login(self.user)
+        user = authentication.ClaimsJWTAuthentication().get_user(AccessToken(token))
+        self.assertIsInstance(user, authentication.ClaimsUser)
+        self.assertEqual((user.id, user.pk, user.username, user.is_staff), (self.user.id, self.user.id, "testuser", False))
 
+    def test_authenticated_request_does_not_load_user(self):
+        """
+        Test that once the user's cutoff is cached, authenticating a request costs no query.
+        """
+        self.client.get("/api/videos/")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/videos/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if "auth_user" in query["sql"]])
 
+    def test_owner_permission_compares_ids(self):
+        """
+        Test that owner checks work against the token's user id.
+        """
+        url = f"/api/videos/{self.video.id}/"
+        body = {"title": "Renamed", "desc": "desc"}
+        self.assertEqual(self.client.put(url, body).status_code, status.HTTP_201_CREATED)
+        self.login(self.other)
+        self.assertEqual(self.client.put(url, body).status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post("/api/comments/", {"comment": "hi", "the_video": self.video.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Comment.objects.get().creator_id, self.other.id)
 
+    def test_revoke_refuses_earlier_tokens(self):
+        """
+        Test that revoking signs out every token issued so far, and a later login works.
+        """
+        old = AccessToken.for_user(self.user)
+        old["iat"] = int(time.time()) - 20
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {old}")
+        self.assertEqual(self.client.post("/api/token/revoke/").status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_401_UNAUTHORIZED)
+        # the cutoff also holds once the cache entry is gone
+        get_cache().clear()
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_401_UNAUTHORIZED)
+        self.login(self.user)
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_200_OK)
+        # a token issued in the very second of the revocation is a new sign-in, not an old token
+        same = AccessToken.for_user(self.user)
+        same["iat"] = authentication.cutoff(self.user.id)
+        self.assertEqual(authentication.ClaimsJWTAuthentication().get_user(same).id, self.user.id)
+
+    def test_deactivated_user_is_refused(self):
+        """
+        Test that deactivating or deleting a user refuses their tokens at once.
+        """
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_401_UNAUTHORIZED)
 
+        self.login(self.other)
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_200_OK)
+        self.other.delete()
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_demoted_admin_loses_admin_rights(self):
+        """
+        Test that removing is_staff refuses tokens that still claim it, and a new login is no longer admin.
+        """
+        admin = User.objects.create_user(username="admin", password="testpassword", is_staff=True)
+        old = ClaimsTokenObtainPairSerializer.get_token(admin).access_token
+        old["iat"] = int(time.time()) - 20
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {old}")
+        url = f"/api/videos/{self.video.id}/"
+        self.assertEqual(self.client.put(url, {"title": "By admin", "desc": "desc"}).status_code, status.HTTP_201_CREATED)
+
+        admin.is_staff = False
+        admin.save()
+        self.assertEqual(self.client.put(url, {"title": "Again", "desc": "desc"}).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        self.login(admin)
+        self.assertEqual(self.client.put(url, {"title": "Again", "desc": "desc"}).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        # saves that leave the flags alone sign nobody out
+        self.user.last_login = timezone.now()
+        self.user.save()
+        self.login(self.user)
+        self.assertFalse(TokenRevocation.objects.filter(user=self.user).exists())
+
+    def test_refresh_is_held_to_cutoff(self):
+        """
+        Test that a refresh token issued before a revocation or demotion can no longer mint access tokens.
+        """
+        admin = User.objects.create_user(username="admin", password="testpassword", is_staff=True)
+        refresh = ClaimsTokenObtainPairSerializer.get_token(admin)
+        refresh["iat"] = int(time.time()) - 20
+        self.assertEqual(self.client.post("/api/token/refresh/", {"refresh": str(refresh)}).status_code,
+                         status.HTTP_200_OK)
+        admin.is_staff = False
+        admin.save()
+        response = self.client.post("/api/token/refresh/", {"refresh": str(refresh)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+        refresh = ClaimsTokenObtainPairSerializer.get_token(self.user)
+        refresh["iat"] = int(time.time()) - 20
+        self.assertEqual(self.client.post("/api/token/revoke/").status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.post("/api/token/refresh/", {"refresh": str(refresh)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_refresh_reads_claims_from_user(self):
+        """
+        Test that an access token minted by refresh carries the user's current staff flag, not the refresh token's.
+        """
+        admin = User.objects.create_user(username="admin", password="testpassword", is_staff=True)
+        refresh = ClaimsTokenObtainPairSerializer.get_token(admin)
+        # without signals, so nothing is revoked
+        User.objects.filter(pk=admin.pk).update(is_staff=False)
+        response = self.client.post("/api/token/refresh/", {"refresh": str(refresh)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(AccessToken(response.data["access"])["is_staff"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.client.get("/api/cache/stats/").status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_bulk_update_is_seen_after_ttl(self):
+        """
+        Test that a change made without signals takes effect when the cached cutoff expires.
+        """
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_200_OK)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_200_OK)
+        get_cache().delete(f"auth:cutoff:{self.user.pk}")
+        self.assertEqual(self.client.get("/api/videos/").status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+# queries still run on the test database; only the routing decisions are checked
+@override_settings(DATABASE_REPLICA="default")
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        # pins outlive the test database, and user ids are reused
+        get_version_store().clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(video="sample.mp4", title="Video", desc="desc", creator=self.user, created_at=timezone.now())
+
+    def routes(self, method, url, data=None):
+        """The use_replica() answers given while the request ran."""
+        seen = []
+        real = routers.use_replica
+        with mock.patch("appapi.routers.use_replica", side_effect=lambda: seen.append(real()) or seen[-1]):
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400)
+        self.assertTrue(seen)
+        return set(seen)
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        """
+        Test that GET requests read from the replica while write requests and code outside requests use the primary.
+        """
+        self.assertEqual(self.routes("get", f"/api/videos/{self.video.id}/comments/"), {True})
+        self.assertEqual(self.routes("post", "/api/comments/", {"comment": "hi", "the_video": self.video.id}), {False})
+        self.assertEqual(router.db_for_read(Video), "default")
+        self.assertEqual(router.db_for_write(Video), "default")
+        with override_settings(DATABASE_REPLICA="replica"):
+            self.assertEqual(router.db_for_read(Video), "default")
+            self.assertFalse(router.allow_migrate("replica", "appapi"))
+
+    def test_writer_is_pinned_to_primary(self):
+        """
+        Test that after a write the user reads their own writes from the primary until the pin expires.
+        """
+        other = User.objects.create_user(username="otheruser", password="testpassword")
+        self.client.post("/api/comments/", {"comment": "hi", "the_video": self.video.id})
+        self.assertEqual(self.routes("get", f"/api/videos/{self.video.id}/comments/"), {False})
+
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.routes("get", f"/api/videos/{self.video.id}/comments/"), {True})
+        self.client.force_authenticate(user=self.user)
+        get_version_store().delete(f"db:pinned:{self.user.id}")
+        self.assertEqual(self.routes("get", f"/api/videos/{self.video.id}/comments/"), {True})
+
+    def test_pin_is_seen_through_another_handle(self):
+        """
+        Test that a pin recorded by another worker sends this one's reads to the primary.
+        """
+        with mock.patch("appapi.cache.caches", CacheHandler()):
+            routers.pin(self.user.id)
+        self.assertEqual(self.routes("get", f"/api/videos/{self.video.id}/comments/"), {False})
+
+    def test_failed_write_does_not_pin(self):
+        """
+        Test that a rejected write leaves the user reading from the replica.
+        """
+        self.assertEqual(self.client.post("/api/comments/", {}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.routes("get", "/api/videos/"), {True})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AsyncViewTests(APITestCase):
+    content = bytes(range(256)) * 1024  # 256 KiB, several stream blocks
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(
+            video=SimpleUploadedFile("clip.mp4", self.content, content_type="video/mp4"),
+            title="Clip", desc="desc", creator=self.user, created_at=timezone.now(),
+        )
+        # as if uploaded through the API, which counts it
+        Profile.objects.filter(user=self.user).update(video_count=1)
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        self.auth = {"Authorization": f"Bearer {token}"}
+
+    @contextlib.contextmanager
+    def async_views(self):
+        # views are made coroutines or not when the URLconf is imported
+        def reload():
+            importlib.reload(appapi.urls)
+            importlib.reload(api.urls)
+            clear_url_caches()
+        try:
+            with override_settings(ASYNC_VIEWS=True):
+                reload()
+                yield
+        finally:
+            reload()
+
+    async def test_async_reads_match_sync(self):
+        """
+        Test that the async list and detail views answer exactly as the sync ones.
+        """
+        urls = ("/api/videos/", "/api/videos/?sort=trending", f"/api/videos/{self.video.id}/",
+                f"/api/videos/{self.video.id}/comments/", f"/api/profiles/{self.user.id}/", "/api/feed/")
+        self.assertFalse(iscoroutinefunction(resolve("/api/videos/").func))
+        expected = {url: await sync_to_async(self.client.get)(url) for url in urls}
+        with self.async_views():
+            self.assertTrue(iscoroutinefunction(resolve("/api/videos/").func))
+            for url in urls:
+                response = await self.async_client.get(url, headers=self.auth)
+                self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+                self.assertEqual(response.json(), expected[url].json(), url)
+                self.assertEqual(response["ETag"], expected[url]["ETag"], url)
+                response = await self.async_client.get(url, headers={**self.auth, "If-None-Match": expected[url]["ETag"]})
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, url)
+            response = await self.async_client.get("/api/videos/999999/", headers=self.auth)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            response = await self.async_client.get("/api/videos/?sort=oldest", headers=self.auth)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual((await self.async_client.get("/api/videos/")).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_async_writes_and_options(self):
+        """
+        Test that write methods and OPTIONS still work on async views.
+        """
+        url = f"/api/videos/{self.video.id}/"
+        with self.async_views():
+            response = await self.async_client.put(url, {"title": "Renamed", "desc": "desc"},
+                                                   content_type="application/json", headers=self.auth)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual((await Video.objects.aget(pk=self.video.id)).title, "Renamed")
+            response = await self.async_client.options(url, headers=self.auth)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = await self.async_client.patch(url, {}, content_type="application/json", headers=self.auth)
+            self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+            response = await self.async_client.delete(url, headers=self.auth)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            self.assertFalse(await Video.objects.filter(pk=self.video.id).aexists())
+
+    async def test_stream_is_async_under_asgi(self):
+        """
+        Test that under ASGI the video streams from an async iterator, whole or by range.
+        """
+        url = f"/api/videos/{self.video.id}/stream/"
+        with self.async_views():
+            response = await self.async_client.get(url, headers=self.auth)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.is_async)
+            self.assertEqual(response["Content-Length"], str(len(self.content)))
+            self.assertEqual(b"".join([block async for block in response.streaming_content]), self.content)
+
+            response = await self.async_client.get(url, headers={**self.auth, "Range": "bytes=70000-200000"})
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(response["Content-Range"], f"bytes 70000-200000/{len(self.content)}")
+            self.assertEqual(b"".join([block async for block in response.streaming_content]),
+                             self.content[70000:200001])
+        # WSGI keeps the sendfile-capable FileResponse
+        response = await sync_to_async(self.client.get)(url)
+        self.assertFalse(response.is_async)
+        response.close()
+
+
+class FastJSONTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(video="clip.mp4", title="Clip", desc="desc", creator=self.user,
+                                          created_at=timezone.now())
+        self.comment = Comment.objects.create(comment="Nice", creator=self.user, the_video=self.video)
+
+    def test_renderer_matches_drf(self):
+        """
+        Test that the fast renderer writes the same bytes as DRF's, with or without orjson.
+        """
+        data = {
+            "text": "café \u2028 \u2029 \"quoted\"", "when": timezone.now(), "day": timezone.now().date(),
+            "price": Decimal("1.50"), "id": uuid.uuid4(), 1: [None, True, 2.5, (1, 2)], "lazy": gettext_lazy("Clip"),
+            "big": 2 ** 70, "nested": [{"a": []}],
+        }
+        expected = JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        self.assertEqual(FastJSONRenderer().render({**data, "big": 1}), JSONRenderer().render({**data, "big": 1}))
+        with mock.patch("appapi.fastjson.orjson", None):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+        indented = "application/json; indent=2"
+        self.assertEqual(FastJSONRenderer().render(data, indented), JSONRenderer().render(data, indented))
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+    def test_parser(self):
+        """
+        Test that the fast parser reads JSON bodies and rejects malformed ones with a 400.
+        """
+        body = '{"title": "café", "n": [1, 2.5, null]}'.encode()
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)), {"title": "café", "n": [1, 2.5, None]})
+        latin = '{"title": "café"}'.encode("latin-1")
+        self.assertEqual(FastJSONParser().parse(BytesIO(latin), parser_context={"encoding": "latin-1"}),
+                         {"title": "café"})
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"title": '))
+        response = self.client.post("/api/comments/", '{"the_video": %d, "comment": ' % self.video.id,
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sparse_fieldsets(self):
+        """
+        Test that ?fields= limits the output to the named fields without computing the others.
+        """
+        with mock.patch.object(HyperlinkedIdentityField, "to_representation") as link:
+            response = self.client.get("/api/videos/?fields=id,title")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()["results"], [{"id": self.video.id, "title": "Clip"}])
+            response = self.client.get(f"/api/videos/{self.video.id}/?fields=title")
+            self.assertEqual(response.json(), {"title": "Clip"})
+            response = self.client.get(f"/api/videos/{self.video.id}/comments/?fields=comment")
+            self.assertEqual(response.json()["results"], [{"comment": "Nice"}])
+            link.assert_not_called()
+
+        response = self.client.get(f"/api/videos/{self.video.id}/")
+        self.assertIn("comments_url", response.json())
+        response = self.client.get("/api/videos/?fields=id,nope")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("nope", response.json()["fields"][0])
+        # writes validate every field whatever the query string says
+        response = self.client.post("/api/comments/?fields=id", {"the_video": self.video.id, "comment": "Again"},
+                                    format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn("thread_url", response.json())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FlatSerializerTests(APITestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        now = timezone.now()
+        Video.objects.create(
+            video=SimpleUploadedFile("clip one.mp4", b"data", content_type="video/mp4"), title="Clip ✓",
+            desc="desc", creator=self.user, created_at=now, status=Video.READY, duration=12.5, width=1280,
+            height=720, poster="posters/clip.jpg", hls_manifest="hls/1/master.m3u8", comment_count=3, view_count=40,
+        )
+        Video.objects.create(video="uploads/pending.mp4", title="Pending", desc="", creator=self.user,
+                             created_at=now - timedelta(microseconds=1500))
+        Video.objects.create(video="uploads/undated.mp4", title="Undated", desc="", creator=self.user)
+
+    def test_matches_model_serializer(self):
+        """
+        Test that the flat serializer renders .values() rows exactly as VideoSerilaizer renders instances.
+        """
+        queryset = Video.objects.order_by("id")
+        for query in ({}, {"fields": "id,comments_url,created_at,manifest_url"}):
+            request = Request(APIRequestFactory().get("/api/videos/", query))
+            expected = VideoSerilaizer(queryset.select_related("creator"), many=True, context={"request": request}).data
+            flat = FlatVideoSerializer(FlatVideoSerializer.project(queryset), many=True, context={"request": request})
+            self.assertEqual(JSONRenderer().render(flat.data), JSONRenderer().render(expected))
+
+    def test_list_uses_flat_rows(self):
+        """
+        Test that the video list builds no Video instances and still pages by cursor.
+        """
+        with mock.patch.object(Video, "from_db", side_effect=AssertionError("instance built")):
+            response = self.client.get("/api/videos/?page_size=2")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([video["title"] for video in response.json()["results"]], ["Clip ✓", "Pending"])
+            response = self.client.get(response.json()["next"])
+        self.assertEqual([video["title"] for video in response.json()["results"]], ["Undated"])
+        self.assertEqual(response.json()["results"][0]["creator"], "testuser")
+
+    def test_subclass_must_define_getters(self):
+        """
+        Test that a flat serializer without getters() cannot be instantiated.
+        """
+        class Incomplete(FlatSerializer):
+            columns = ("id",)
+
+        with self.assertRaises(TypeError):
+            Incomplete([])
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username="admin", password="testpassword", is_staff=True)
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.admin)
+        self.video = Video.objects.create(video="clip.mp4", title="Clip", desc="desc", creator=self.user,
+                                          created_at=timezone.now())
+        self.comments = [
+            Comment.objects.create(comment=f'Comment {i}, "quoted"', creator=self.user, the_video=self.video)
+            for i in range(5)
+        ]
+
+    def test_streams_ndjson_and_csv(self):
+        """
+        Test that a table streams as NDJSON or CSV in id order.
+        """
+        ids = [comment.id for comment in self.comments]
+        response = self.client.get("/api/export/comments.ndjson", HTTP_ACCEPT="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([line["id"] for line in lines], ids)
+        self.assertEqual(lines[0]["comment"], 'Comment 0, "quoted"')
+        self.assertEqual(lines[0]["the_video_id"], self.video.id)
+
+        response = self.client.get(f"/api/export/comments.ndjson?since_id={ids[2]}")
+        self.assertEqual([json.loads(line)["id"] for line in b"".join(response.streaming_content).splitlines()], ids[3:])
+
+        response = self.client.get("/api/export/comments.csv")
+        rows = list(csv.reader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:2], ["id", "the_video_id"])
+        self.assertEqual([int(row[0]) for row in rows[1:]], ids)
+        self.assertEqual(rows[1][6], 'Comment 0, "quoted"')
+
+        self.assertEqual(self.client.get("/api/export/users.csv").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("/api/export/comments.ndjson?since_id=x").status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get("/api/export/comments.ndjson").status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_chunks_use_iterator(self):
+        """
+        Test that exports read rows through chunked iteration rather than loading the table.
+        """
+        self.assertEqual([len(chunk) for chunk in export.chunks("comments", chunk_size=2)], [2, 2, 1])
+        with mock.patch("django.db.models.query.QuerySet.iterator", side_effect=AssertionError("iterator")) as iterator:
+            with self.assertRaises(AssertionError):
+                list(export.chunks("comments", chunk_size=2))
+        self.assertEqual(iterator.call_args.kwargs, {"chunk_size": 2})
+
+    async def test_streams_async_under_asgi(self):
+        """
+        Test that under ASGI the export streams from an async iterator.
+        """
+        admin_token = ClaimsTokenObtainPairSerializer.get_token(self.admin).access_token
+        response = await self.async_client.get("/api/export/comments.ndjson",
+                                               headers={"Authorization": f"Bearer {admin_token}"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([json.loads(line)["id"] for line in body.splitlines()], [c.id for c in self.comments])
+
+    def test_command_resumes_from_checkpoint(self):
+        """
+        Test that the export command saves a checkpoint and a rerun appends only newer rows.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output, checkpoint = os.path.join(directory, "comments.csv"), os.path.join(directory, "checkpoint")
+        options = {"format": "csv", "output": output, "checkpoint": checkpoint, "chunk_size": 2, "stderr": StringIO()}
+        call_command("export", "comments", **options)
+        with open(checkpoint) as f:
+            self.assertEqual(int(f.read()), self.comments[-1].id)
+
+        later = Comment.objects.create(comment="Later", creator=self.user, the_video=self.video)
+        call_command("export", "comments", **options)
+        with open(output) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0][0], "id")
+        self.assertEqual([int(row[0]) for row in rows[1:]], [c.id for c in self.comments] + [later.id])
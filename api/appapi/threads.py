@@ -0,0 +1,36 @@
+"""
+Threaded comments.
+
+A comment's `path` holds its ancestors' ids and then its own, each
+zero-padded to PATH_WIDTH digits and followed by "/", e.g.
+"0000000012/0000000034/". Sorting by path lists a thread in reading order
+(every comment before its replies, siblings oldest first), and all of a
+comment's replies, at any depth, are the paths that extend its own, so a
+whole thread is one range scan of comment_path_idx.
+
+`depth` is set before a comment is inserted and `path` right after, once
+its id is known (see signals.py); bulk inserts set both themselves.
+"""
+
+from django.conf import settings
+
+from .models import Comment
+
+PATH_WIDTH = 10
+
+
+def max_depth():
+    return getattr(settings, 'COMMENT_MAX_DEPTH', 8)
+
+
+def path_for(comment):
+    prefix = comment.parent.path if comment.parent_id else ''
+    return f'{prefix}{comment.pk:0{PATH_WIDTH}d}/'
+
+
+def subtree(comment, include_self=True):
+    """The thread below `comment`, as a range over comment_path_idx."""
+    # '0' sorts right after '/', so every extension of the path is below it
+    upper = comment.path[:-1] + '0'
+    lower = {'path__gte' if include_self else 'path__gt': comment.path}
+    return Comment.objects.filter(**lower, path__lt=upper)
@@ -0,0 +1,325 @@
+"""
+Request admission control: token-bucket rate limits and concurrency caps.
+
+Every request is charged to a scope: the view's `throttle_scopes` entry for
+the HTTP method, otherwise 'read' for safe methods and 'write' for the
+rest. THROTTLE['RATES'] gives each scope a bucket of N requests refilled at
+N per period ("N/sec|min|hour|day"), kept per user, or per client address
+for anonymous requests. The client address is REMOTE_ADDR unless
+THROTTLE['NUM_PROXIES'] says how many reverse proxies append to
+X-Forwarded-For in front of the app; the address the outermost of them saw
+is used then, and anything a client put in the header itself is ignored.
+An empty bucket answers 429 with Retry-After; every
+response carries RateLimit-Limit, RateLimit-Remaining and RateLimit-Reset
+(seconds until the bucket is full again).
+
+Scopes listed in THROTTLE['CONCURRENCY'] also cap how many requests a user
+may have in flight at once, for endpoints that hold a worker for long
+(uploads). Slots are leases: ThrottleMiddleware releases them when the
+response is ready, and a slot left behind by a crashed process expires
+after THROTTLE['LEASE'] seconds.
+
+Buckets and leases live in THROTTLE['STORE']: 'local' for process memory,
+or 'sqlite' for a SQLite file at THROTTLE['PATH'] that every process on
+the node shares, updated with one atomic statement per request.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# full buckets and expired leases are dropped every CULL_EVERY calls
+CULL_EVERY = 1000
+# Retry-After when the concurrency cap, not the rate, refused a request
+CONCURRENCY_RETRY = 1
+
+
+def option(name):
+    defaults = {
+        'STORE': 'local',
+        'PATH': '/var/tmp/videosharing-throttle.sqlite3',
+        'RATES': {},
+        'CONCURRENCY': {},
+        'LEASE': 600,
+        'NUM_PROXIES': 0,
+    }
+    return getattr(settings, 'THROTTLE', {}).get(name, defaults[name])
+
+
+def parse_rate(rate):
+    """'100/min' -> (capacity 100, refill per second 100 / 60)."""
+    count, period = rate.split('/')
+    return int(count), int(count) / PERIODS[period[0]]
+
+
+def longest_period():
+    # a bucket of N per period refills completely within one period, so one
+    # idle for longer is the same as a missing one and can be dropped
+    return max((PERIODS[rate.split('/')[1][0]] for rate in option('RATES').values()), default=0)
+
+
+class LocalStore:
+    """Buckets and leases in this process's memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._leases = {}
+        self._calls = 0
+
+    def take(self, key, capacity, rate, now):
+        """Take a token from `key`'s bucket. Returns (granted, tokens left)."""
+        with self._lock:
+            self._tick(now)
+            tokens, stamp = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * rate)
+            granted = tokens >= 1
+            if granted:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            return granted, tokens
+
+    def acquire(self, key, limit, lease, now):
+        """A slot id if `key` has fewer than `limit` live leases, else None."""
+        with self._lock:
+            self._tick(now)
+            held = {slot: expires for slot, expires in self._leases.get(key, {}).items() if expires > now}
+            slot = None
+            if len(held) < limit:
+                slot = uuid.uuid4().hex
+                held[slot] = now + lease
+            self._leases[key] = held
+            return slot
+
+    def release(self, key, slot):
+        with self._lock:
+            self._leases.get(key, {}).pop(slot, None)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._leases.clear()
+
+    def _tick(self, now):
+        self._calls += 1
+        if self._calls % CULL_EVERY:
+            return
+        idle = now - longest_period()
+        for key, (_, stamp) in list(self._buckets.items()):
+            if stamp <= idle:
+                del self._buckets[key]
+        for key, held in list(self._leases.items()):
+            if all(expires <= now for expires in held.values()):
+                del self._leases[key]
+
+
+class SQLiteStore:
+    """Buckets and leases in a SQLite file shared by every process on the node."""
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, stamp REAL, granted INTEGER) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS lease (key TEXT, slot TEXT, expires REAL, PRIMARY KEY (key, slot)) WITHOUT ROWID',
+    )
+    # SET expressions all read the row as it was before the update
+    TAKE = (
+        'INSERT INTO bucket (key, tokens, stamp, granted) VALUES (:key, :capacity - 1, :now, 1) '
+        'ON CONFLICT (key) DO UPDATE SET '
+        'tokens = min(:capacity, tokens + (:now - stamp) * :rate) - (min(:capacity, tokens + (:now - stamp) * :rate) >= 1), '
+        'granted = min(:capacity, tokens + (:now - stamp) * :rate) >= 1, '
+        'stamp = :now '
+        'RETURNING granted, tokens'
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+
+    def _connection(self):
+        # one connection per thread, and none inherited across a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # autocommit: each statement is its own transaction unless BEGIN says otherwise
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # a crash can only forget a few recent requests
+            connection.execute('PRAGMA synchronous=OFF')
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def take(self, key, capacity, rate, now):
+        connection = self._connection()
+        self._tick(connection, now)
+        granted, tokens = connection.execute(
+            self.TAKE, {'key': key, 'capacity': capacity, 'rate': rate, 'now': now}
+        ).fetchone()
+        return bool(granted), tokens
+
+    def acquire(self, key, limit, lease, now):
+        connection = self._connection()
+        self._tick(connection, now)
+        slot = uuid.uuid4().hex
+        # BEGIN IMMEDIATE takes the write lock first, so the count and the insert are atomic
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            (held,) = connection.execute(
+                'SELECT count(*) FROM lease WHERE key = ? AND expires > ?', (key, now)
+            ).fetchone()
+            if held >= limit:
+                slot = None
+            else:
+                connection.execute('INSERT INTO lease (key, slot, expires) VALUES (?, ?, ?)', (key, slot, now + lease))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return slot
+
+    def release(self, key, slot):
+        self._connection().execute('DELETE FROM lease WHERE key = ? AND slot = ?', (key, slot))
+
+    def clear(self):
+        connection = self._connection()
+        connection.execute('DELETE FROM bucket')
+        connection.execute('DELETE FROM lease')
+
+    def _tick(self, connection, now):
+        self._calls += 1
+        if self._calls % CULL_EVERY:
+            return
+        connection.execute('DELETE FROM bucket WHERE stamp <= ?', (now - longest_period(),))
+        connection.execute('DELETE FROM lease WHERE expires <= ?', (now,))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    """The configured store, one per process (and per path for SQLite)."""
+    kind, path = option('STORE'), option('PATH')
+    key = (kind, path if kind == 'sqlite' else None)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = SQLiteStore(path) if kind == 'sqlite' else LocalStore()
+                _stores[key] = store
+    return store
+
+
+def client_address(request):
+    """The address the request came from, trusting only THROTTLE['NUM_PROXIES'] X-Forwarded-For entries."""
+    proxies = option('NUM_PROXIES')
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxies and forwarded:
+        # each proxy appends the address it saw, so only the last entries are trusted
+        addresses = [address.strip() for address in forwarded.split(',')]
+        return addresses[-min(proxies, len(addresses))]
+    return request.META.get('REMOTE_ADDR')
+
+
+def identity(request):
+    """Whom a request is charged to: its user, or its client address when anonymous."""
+    if request.user and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{client_address(request)}'
+
+
+def scope_for(request, view):
+    scopes = getattr(view, 'throttle_scopes', {})
+    if request.method in scopes:
+        return scopes[request.method]
+    return 'read' if request.method in ('GET', 'HEAD', 'OPTIONS') else 'write'
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Rate limit per scope and user from THROTTLE['RATES']; scopes without a rate are not limited."""
+
+    def allow_request(self, request, view):
+        scope = scope_for(request, view)
+        rate = option('RATES').get(scope)
+        if rate is None:
+            return True
+        capacity, self.rate = parse_rate(rate)
+        now = time.time()
+        granted, self.tokens = get_store().take(f'{scope}:{identity(request)}', capacity, self.rate, now)
+        # read by ThrottleMiddleware
+        request._request.rate_limit = (capacity, int(self.tokens), (capacity - self.tokens) / self.rate)
+        return granted
+
+    def wait(self):
+        return (1 - self.tokens) / self.rate
+
+
+class ConcurrencyThrottle(TokenBucketThrottle):
+    """Cap on in-flight requests per scope and user from THROTTLE['CONCURRENCY']."""
+
+    def allow_request(self, request, view):
+        scope = scope_for(request, view)
+        limit = option('CONCURRENCY').get(scope)
+        if limit is None:
+            return True
+        key = f'{scope}:{identity(request)}'
+        store = get_store()
+        slot = store.acquire(key, limit, option('LEASE'), time.time())
+        if slot is None:
+            return False
+        request._request.throttle_releases = getattr(request._request, 'throttle_releases', []) + [
+            lambda: store.release(key, slot)
+        ]
+        return True
+
+    def wait(self):
+        return CONCURRENCY_RETRY
+
+
+class ThrottleMiddleware:
+    """Releases concurrency slots once a response is ready and adds the RateLimit-* headers."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.release(request)
+        return self.add_headers(request, response)
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.release(request)
+        return self.add_headers(request, response)
+
+    def release(self, request):
+        for release in getattr(request, 'throttle_releases', ()):
+            release()
+
+    def add_headers(self, request, response):
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            limit, remaining, reset = rate_limit
+            response['RateLimit-Limit'] = str(limit)
+            response['RateLimit-Remaining'] = str(max(remaining, 0))
+            response['RateLimit-Reset'] = str(max(int(reset + 0.999), 0))
+        return response
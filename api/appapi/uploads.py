@@ -0,0 +1,134 @@
+"""
+Resumable, chunked uploads.
+
+A client opens an UploadSession, PUTs byte ranges of the file in any order
+(retries are harmless), then completes the session to turn it into a Video.
+Chunks are copied from the request stream straight into a preallocated
+file under MEDIA_ROOT/uploads/partial/, a buffer at a time, so memory use
+does not depend on chunk or file size.
+
+Sessions declare at most MAX_UPLOAD_SIZE bytes. One left idle for
+UPLOAD_SESSION_TTL seconds expires: it stops accepting chunks, and
+`manage.py expire_uploads` deletes it along with its partial file.
+"""
+
+import datetime
+import os
+import re
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import UploadSession, Video
+from .storage import media_storage
+
+BUFFER_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class ChunkError(ValueError):
+    pass
+
+
+def max_size():
+    return getattr(settings, 'MAX_UPLOAD_SIZE', 5 * 1024 ** 3)
+
+
+def ttl():
+    return getattr(settings, 'UPLOAD_SESSION_TTL', 24 * 3600)
+
+
+def expiry_cutoff():
+    """Sessions last written to before this have expired."""
+    return timezone.now() - datetime.timedelta(seconds=ttl())
+
+
+def expire_sessions():
+    """Delete expired sessions and their partial files; return how many were deleted."""
+    stale = list(UploadSession.objects.filter(updated_at__lt=expiry_cutoff()).only('pk'))
+    for session in stale:
+        # completed sessions have no partial file left
+        discard_partial(session)
+    UploadSession.objects.filter(pk__in=[session.pk for session in stale]).delete()
+    return len(stale)
+
+
+def partial_path(session):
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', 'partial', f'{session.pk}.part')
+
+
+def create_partial(session):
+    path = partial_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        # sparse preallocation, so chunks can land at any offset
+        f.truncate(session.total_size)
+
+
+def discard_partial(session):
+    try:
+        os.remove(partial_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def parse_content_range(header, total_size):
+    """Return the [start, end) range described by a `Content-Range: bytes a-b/n` header."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise ChunkError('Content-Range header must look like "bytes <start>-<end>/<total>".')
+    start, last, total = (int(group) for group in match.groups())
+    if total != total_size:
+        raise ChunkError(f'Upload total size is {total_size} bytes, not {total}.')
+    if start > last or last >= total:
+        raise ChunkError('Content-Range is outside the upload.')
+    return start, last + 1
+
+
+def write_chunk(session, stream, start, end):
+    """Copy `end - start` bytes from `stream` into the partial file at `start`."""
+    remaining = end - start
+    with open(partial_path(session), 'r+b') as f:
+        f.seek(start)
+        while remaining:
+            block = stream.read(min(BUFFER_SIZE, remaining))
+            if not block:
+                raise ChunkError(f'Chunk ended {remaining} bytes early.')
+            f.write(block)
+            remaining -= len(block)
+
+
+def merge_range(ranges, start, end):
+    """Add [start, end) to a sorted list of disjoint ranges, coalescing neighbours."""
+    merged = []
+    for lo, hi in sorted([*ranges, [start, end]]):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+
+def missing_ranges(session):
+    missing, position = [], 0
+    for lo, hi in session.received:
+        if lo > position:
+            missing.append([position, lo])
+        position = max(position, hi)
+    if position < session.total_size:
+        missing.append([position, session.total_size])
+    return missing
+
+
+def assemble(session):
+    """Move the finished partial file into the media store and create its Video row."""
+    name = media_storage.store_path(partial_path(session), get_valid_filename(session.filename), reference=True)
+    return Video.objects.create(
+        video=name,
+        title=session.title,
+        desc=session.desc,
+        creator=session.creator,
+        created_at=timezone.now(),
+    )
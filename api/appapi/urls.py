@@ -4,35 +4,61 @@ from .views import *
 from django.urls import path, include
 
 
-
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
-
 urlpatterns = [
     # videos endpoint
     path('api/videos/', VideoList.as_view(), name='videos-detail'),
+    path('api/videos/trending/', TrendingVideos.as_view()),
     path('api/videos/<int:pk>/', VideoDetail.as_view(), name='videos-detail'),
+    path('api/videos/<int:pk>/comments/', VideoComments.as_view(), name='videos-comments'),
+    path('api/videos/<int:pk>/stream/', VideoStream.as_view(), name='videos-stream'),
+
+    # feed endpoint
+    path('api/feed/', FeedList.as_view()),
+    path('api/recommendations/', Recommendations.as_view()),
+
+    # search endpoint
+    path('api/search/', Search.as_view()),
+
+    # view analytics
+    path('api/views/', ViewBeacons.as_view()),
+
+    # profile endpoint
+    path('api/profiles/<int:pk>/', ProfileDetail.as_view()),
+
+    # cache metrics
+    path('api/cache/stats/', CacheStats.as_view()),
+
+    # bulk exports for admins and analytics
+    path('api/export/<slug:name>.<slug:fmt>', Export.as_view()),
+
+    # resumable upload endpoint
+    path('api/uploads/', UploadList.as_view()),
+    path('api/uploads/<uuid:pk>/', UploadDetail.as_view()),
+    path('api/uploads/<uuid:pk>/complete/', UploadComplete.as_view()),
 
   
 
     # post endpoint
     path('api/posts/', PostList.as_view()),
     path('api/posts/<int:pk>/', PostDetail.as_view()),
+    path('api/posts/<int:pk>/image/<slug:size>.<slug:fmt>', PostImage.as_view(), name='posts-image'),
 
     # comment endpoint
     path('api/comments/', CommentList.as_view(), name='comments-detail'),
+    path('api/comments/bulk/', CommentBulk.as_view()),
     path('api/comments/<int:pk>/', CommentDetail.as_view(), name='comments-detail'),
+    path('api/comments/<int:pk>/thread/', CommentThread.as_view(), name='comments-thread'),
 
     # subscription endpoint
     path('api/subscriptions/', SubscriptionList.as_view(), name='subscriptions-detail'),
+    path('api/subscriptions/bulk/', SubscriptionBulk.as_view()),
     path('api/subscriptions/<int:pk>/', SubscriptionDetail.as_view()),
 
 
 
     # Authentication
     path('api/register/', Register.as_view()),
-     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+     path('api/token/', TokenObtain.as_view(), name='token_obtain_pair'),
+    path('api/token/refresh/', TokenRefresh.as_view(), name='token_refresh'),
+    path('api/token/revoke/', TokenRevoke.as_view(), name='token_revoke'),
 ]
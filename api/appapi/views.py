@@ -1,28 +1,128 @@
+import abc
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render
-from .models import Video, Post, Comment, Subscription
-from .serializers import VideoSerilaizer, UpdateVideoSerializer, PostSerializer,CommentSerializer, UserSerializer, SubscriptionSerializer
+from .models import Video, Post, Comment, Subscription, UploadSession, Profile, VideoScore, Recommendation
+from .serializers import VideoSerilaizer, FlatVideoSerializer, UpdateVideoSerializer, PostSerializer,CommentSerializer, UserSerializer, SubscriptionSerializer, UploadSessionSerializer, ProfileSerializer
+from . import analytics, authentication, cache, conditional, counters, export, feed, idempotency, images, search, threads, throttling, uploads
+from .fastjson import FastJSONParser
+from .streaming import is_asgi, serve_file
+from rest_framework.negotiation import BaseContentNegotiation
 
 
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
+from django.db import IntegrityError, transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.views import exception_handler
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 
 from django.contrib.auth.models import User
 
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from .permissions import *
+from .pagination import VideoPagination, PostPagination, CommentPagination, TopCommentPagination, ThreadPagination, FeedPagination, SearchPagination, RankPagination
+from django.utils import timezone
+from django.utils.functional import classproperty
 
 # Create your views here.
 
+BULK_CREATE_BATCH_SIZE = 1000
+
+
+
+def ranked_videos(rows):
+    """
+    (row, video) for a page of VideoScore or Recommendation rows, in order,
+    skipping videos deleted since. Loaded apart from the rank index walk so
+    the planner cannot pick a join order that scans every video.
+    """
+    videos = Video.objects.select_related('creator').in_bulk([row.video_id for row in rows])
+    return [(row, videos[row.video_id]) for row in rows if row.video_id in videos]
+
+
+async def aranked_videos(rows):
+    videos = await Video.objects.select_related('creator').ain_bulk([row.video_id for row in rows])
+    return [(row, videos[row.video_id]) for row in rows if row.video_id in videos]
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView with coroutine versions of its read handlers (async_get), for
+    endpoints that mostly wait on the database or disk.
+
+    With settings.ASYNC_VIEWS on, as api/asgi.py sets it, the view itself
+    is a coroutine: a request waiting on I/O no longer holds a thread, and
+    methods without an async_ handler run their synchronous one on a
+    worker thread. Under WSGI every coroutine view would need an event
+    loop of its own per request, so there the synchronous handlers serve.
+    DRF's authentication, permission and throttle checks are synchronous
+    either way.
+    """
+
+    @classproperty
+    def view_is_async(cls):
+        return getattr(settings, 'ASYNC_VIEWS', False)
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self.adispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            method = request.method.lower()
+            handler = None
+            if method in self.http_method_names:
+                handler = getattr(self, f'async_{method}', None)
+                if handler is None:
+                    handler = sync_to_async(getattr(self, method, self.http_method_not_allowed))
+            else:
+                handler = sync_to_async(self.http_method_not_allowed)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class TokenObtain(TokenObtainPairView):
+    throttle_scopes = {'POST': 'auth'}
+
+
+class TokenRefresh(TokenRefreshView):
+    throttle_scopes = {'POST': 'auth'}
+
+
+class TokenRevoke(APIView):
+    """Sign out everywhere: every token issued to the user so far stops authenticating."""
+
+    permission_classes = [IsAuthenticated]
+    throttle_scopes = {'POST': 'auth'}
+
+    def post(self, request):
+        authentication.revoke(request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class Register(APIView):
     serializer_class = UserSerializer
+    throttle_scopes = {'POST': 'auth'}
 
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
@@ -37,23 +137,113 @@ class Register(APIView):
 
 
 
-class VideoList(APIView):
+class VideoList(AsyncAPIView):
   
     serializer_class = VideoSerilaizer
+    # list pages are rendered from .values() rows, without model instances
+    flat_serializer_class = FlatVideoSerializer
+    pagination_class = VideoPagination
     parser_classes = (MultiPartParser, FormParser)
+    cache_scopes = ('videos',)
+    sorts = ('newest', 'trending')
+    throttle_scopes = {'POST': 'upload'}
 
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        # creator is rendered by name, so fetch it up front
+        return Video.objects.select_related('creator')
+
+    def get_list_queryset(self):
+        if self.flat_serializer_class is None:
+            return self.get_queryset()
+        return self.flat_serializer_class.project(Video.objects.all())
+
+    def get_list_serializer(self, rows, request):
+        serializer_class = self.flat_serializer_class or self.serializer_class
+        return serializer_class(rows, many=True, context={'request': request})
+
+    def get_sort(self, request):
+        sort = request.query_params.get('sort', 'newest')
+        if sort not in self.sorts:
+            raise ValidationError({'sort': [f'Must be one of: {", ".join(self.sorts)}.']})
+        return sort
+
     def get(self, request,*args, **kwargs):
-        videos = Video.objects.all()
-        serializer = self.serializer_class(videos, many=True, context={'request': request})
-        return Response(serializer.data)
+        if self.get_sort(request) == 'trending':
+            return self.get_trending(request)
+
+        def build():
+            paginator = self.pagination_class()
+            videos = paginator.paginate_queryset(self.get_list_queryset(), request, view=self)
+            serializer = self.get_list_serializer(videos, request)
+            return paginator.get_paginated_response(serializer.data).data
+        etag, last_modified = conditional.collection_validators(request, *self.cache_scopes)
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'list', self.cache_scopes, build),
+            check_modified_since=False,
+        )
+
+    def get_trending(self, request):
+        """Videos by their precomputed trending rank (see ranking.py), each with its score and rank."""
+        def build():
+            paginator = RankPagination()
+            ranked = paginator.paginate_queryset(VideoScore.objects.all(), request, view=self)
+            pairs = ranked_videos(ranked)
+            data = self.serializer_class([video for _, video in pairs], many=True, context={'request': request}).data
+            results = [{**video, 'score': row.score, 'rank': row.rank} for (row, _), video in zip(pairs, data)]
+            return paginator.get_paginated_response(results).data
+        # rank_videos bumps 'ranking' each time it rewrites the table
+        scopes = ['ranking', *self.cache_scopes]
+        etag, last_modified = conditional.collection_validators(request, *scopes)
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'list', scopes, build),
+            check_modified_since=False,
+        )
+
+    async def async_get(self, request, *args, **kwargs):
+        if self.get_sort(request) == 'trending':
+            return await self.async_get_trending(request)
+
+        async def build():
+            paginator = self.pagination_class()
+            videos = await paginator.apaginate_queryset(self.get_list_queryset(), request, view=self)
+            serializer = self.get_list_serializer(videos, request)
+            return paginator.get_paginated_response(serializer.data).data
+        etag, last_modified = conditional.collection_validators(request, *self.cache_scopes)
+        return await conditional.arespond(
+            request, etag, last_modified,
+            lambda: cache.acached_response(request, 'list', self.cache_scopes, build),
+            check_modified_since=False,
+        )
+
+    async def async_get_trending(self, request):
+        async def build():
+            paginator = RankPagination()
+            ranked = await paginator.apaginate_queryset(VideoScore.objects.all(), request, view=self)
+            pairs = await aranked_videos(ranked)
+            data = self.serializer_class([video for _, video in pairs], many=True, context={'request': request}).data
+            results = [{**video, 'score': row.score, 'rank': row.rank} for (row, _), video in zip(pairs, data)]
+            return paginator.get_paginated_response(results).data
+        scopes = ['ranking', *self.cache_scopes]
+        etag, last_modified = conditional.collection_validators(request, *scopes)
+        return await conditional.arespond(
+            request, etag, last_modified,
+            lambda: cache.acached_response(request, 'list', scopes, build),
+            check_modified_since=False,
+        )
     
     
     def post(self, request):
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save(creator=request.user)
+            with transaction.atomic():
+                # created_at doubles as the pagination key, so stamp it on upload
+                video = serializer.save(creator_id=request.user.id, created_at=timezone.now())
+                counters.adjust_video_count(video.creator_id, 1)
+            feed.fan_out(video)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -62,13 +252,57 @@ class VideoList(APIView):
 
 
 
-class VideoDetail(APIView):
+class FeedList(VideoList):
+    """
+    Newest videos from the creators the user subscribes to.
+    """
+
+    http_method_names = ['get', 'head', 'options']
+    pagination_class = FeedPagination
+    # FeedPagination merges model instances
+    flat_serializer_class = None
+    sorts = ('newest',)
+    # per-user, so not worth sharing through the response cache
+    cache_scopes = None
+
+    # a feed has no cheap aggregate, so the page is fetched once and both
+    # fingerprinted for the ETag and serialized for the body
+
+    def get(self, request, *args, **kwargs):
+        self.get_sort(request)
+        paginator = self.pagination_class()
+        videos = paginator.paginate_queryset(self.get_list_queryset(), request, view=self)
+        etag, last_modified = conditional.rows_validators(request, videos)
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: paginator.get_paginated_response(self.get_list_serializer(videos, request).data),
+            check_modified_since=False,
+        )
+
+    async def async_get(self, request, *args, **kwargs):
+        self.get_sort(request)
+        paginator = self.pagination_class()
+        videos = await paginator.apaginate_queryset(self.get_list_queryset(), request, view=self)
+        etag, last_modified = conditional.rows_validators(request, videos)
+
+        async def build():
+            return paginator.get_paginated_response(self.get_list_serializer(videos, request).data)
+        return await conditional.arespond(request, etag, last_modified, build, check_modified_since=False)
+
+
+
+
+
+class VideoDetail(AsyncAPIView):
 
     permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
+
+    def get_queryset(self):
+        return Video.objects.select_related('creator')
         
     def get_object(self, pk):
         try:
-            obj = Video.objects.get(pk=pk)
+            obj = self.get_queryset().get(pk=pk)
             # Check object-level permissions
             self.check_object_permissions(self.request, obj)
             return obj
@@ -77,13 +311,38 @@ class VideoDetail(APIView):
 
     def get(self, request, pk, *args, **kwargs):
         video = self.get_object(pk)
-        serializer = VideoSerilaizer(video, context={'request': request})
-        return Response(serializer.data)
+
+        def build():
+            serializer = VideoSerilaizer(video, context={'request': request})
+            return serializer.data
+        etag, last_modified = conditional.object_validators(request, video)
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'detail', [f'video:{video.pk}'], build),
+        )
+
+    async def async_get(self, request, pk, *args, **kwargs):
+        try:
+            video = await self.get_queryset().aget(pk=pk)
+        except Video.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(request, video)
+
+        async def build():
+            serializer = VideoSerilaizer(video, context={'request': request})
+            return serializer.data
+        etag, last_modified = conditional.object_validators(request, video)
+        return await conditional.arespond(
+            request, etag, last_modified,
+            lambda: cache.acached_response(request, 'detail', [f'video:{video.pk}'], build),
+        )
     
 
     def delete(self, request, pk):
         videos = self.get_object(pk)
-        videos.delete()
+        with transaction.atomic():
+            videos.delete()
+            counters.adjust_video_count(videos.creator_id, -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
    
     def put(self, request, pk):
@@ -95,6 +354,77 @@ class VideoDetail(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    # media players send Accept: video/*, which would otherwise be a 406
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+class VideoStream(AsyncAPIView):
+    """
+    Serve the video file itself, with Range and conditional GET support.
+    """
+
+    permission_classes = [IsAuthenticated]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, pk):
+        try:
+            video = Video.objects.only('video').get(pk=pk)
+        except Video.DoesNotExist:
+            raise Http404
+        try:
+            return serve_file(request, video.video.path, video.video.name)
+        except FileNotFoundError:
+            raise Http404
+
+    async def async_get(self, request, pk):
+        try:
+            video = await Video.objects.only('video').aget(pk=pk)
+        except Video.DoesNotExist:
+            raise Http404
+        try:
+            return serve_file(request, video.video.path, video.video.name)
+        except FileNotFoundError:
+            raise Http404
+
+
+class PostImage(APIView):
+    """
+    A resized WebP or JPEG rendition of a post's image, generated on first use.
+    Guarded like the post itself, so clients fetch it with their token and
+    browsers and proxies keep it private.
+    """
+
+    permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, pk, size, fmt):
+        if size not in images.option('SIZES') or fmt not in images.FORMATS:
+            raise Http404
+        try:
+            post = Post.objects.only('post_image', 'creator_id').get(pk=pk)
+        except Post.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(request, post)
+        if not post.post_image:
+            raise Http404
+        try:
+            path = images.derivative(post.post_image.name, size, fmt)
+        except (FileNotFoundError, images.UnidentifiedImageError):
+            raise Http404
+        response = serve_file(request, path, os.path.relpath(path, settings.MEDIA_ROOT))
+        # ?v= names the source image, so a matching URL never changes content
+        if request.GET.get('v') == images.version(post.post_image.name):
+            response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        else:
+            response['Cache-Control'] = 'private, max-age=300'
+        return response
+
+
 # request.data is basically data sent in the request body from the client.
 
 
@@ -103,20 +433,32 @@ class VideoDetail(APIView):
 
 class PostList(APIView):
     serializer_class = PostSerializer
+    pagination_class = PostPagination
     permission_classes = [IsAuthenticated]
     
 
+    def get_queryset(self):
+        return Post.objects.select_related('creator')
+
     def get(self, request):
-        queryset = Post.objects.all()
-        serializer = self.serializer_class(queryset,many=True)
-        return Response (serializer.data)
+        def build():
+            paginator = self.pagination_class()
+            queryset = paginator.paginate_queryset(self.get_queryset(), request, view=self)
+            serializer = self.serializer_class(queryset,many=True)
+            return paginator.get_paginated_response(serializer.data).data
+        etag, last_modified = conditional.collection_validators(request, 'posts')
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'list', ['posts'], build),
+            check_modified_since=False,
+        )
     
     
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid():
             # Set the creator to the logged-in user before saving
-            serializer.save(creator=request.user)
+            serializer.save(creator_id=request.user.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -128,10 +470,12 @@ class PostDetail(APIView):
     permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
     
 
+    def get_queryset(self):
+        return Post.objects.select_related('creator')
         
     def get_object(self, pk):
         try:
-            obj = Post.objects.get(pk=pk)
+            obj = self.get_queryset().get(pk=pk)
             # Check object-level permissions
             self.check_object_permissions(self.request, obj)
             return obj
@@ -142,8 +486,15 @@ class PostDetail(APIView):
 
     def get(self, request, pk):
         queryset = self.get_object(pk)
-        serializer = PostSerializer(queryset)
-        return Response (serializer.data)
+
+        def build():
+            serializer = PostSerializer(queryset)
+            return serializer.data
+        etag, last_modified = conditional.object_validators(request, queryset)
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'detail', [f'post:{queryset.pk}'], build),
+        )
     
 
     def put(self, request, pk):
@@ -169,41 +520,231 @@ class PostDetail(APIView):
 class CommentList(APIView):
     
     permission_classes = [IsAuthenticated]
+    throttle_scopes = {'POST': 'comment'}
     serializer_class =  CommentSerializer
+    pagination_class = CommentPagination
 
 
     def get(self, request,*args, **kwargs):
-        queryset = Comment.objects.all()
-        serializer = self.serializer_class(queryset, many=True, context={'request': request})
-        return Response(serializer.data)
+        def build():
+            paginator = self.pagination_class()
+            queryset = paginator.paginate_queryset(Comment.objects.all(), request, view=self)
+            serializer = self.serializer_class(queryset, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data).data
+        etag, last_modified = conditional.collection_validators(request, 'comments')
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'list', ['comments'], build),
+            check_modified_since=False,
+        )
     
 
     def post(self, request):
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save(creator=request.user)
+            with transaction.atomic():
+                comment = serializer.save(creator_id=request.user.id)
+                counters.adjust_comment_count(comment.the_video_id, 1)
+                if comment.parent_id:
+                    counters.adjust_reply_count(comment.parent_id, 1)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 
 
+class BulkCreateView(APIView, abc.ABC):
+    """
+    POST a JSON array of up to BULK_WRITE_MAX_ITEMS items. The valid ones
+    are inserted with bulk_create in one transaction and every item gets a
+    result, in input order: {"index", "status": 201, "id"} or
+    {"index", "status": 400, "errors"}. The response is 201 when every item
+    was created, 207 when some were and 400 when none were. Send an
+    Idempotency-Key header to make retries safe (see idempotency.py).
+
+    bulk_create sends no signals, so subclasses apply the counter and
+    cache updates the single-item views get from signals.py themselves.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = None
+    idempotency_scope = None
+
+    def post(self, request):
+        def run():
+            serializer = self.serializer_class(
+                data=request.data, many=True, max_length=getattr(settings, 'BULK_WRITE_MAX_ITEMS', 10000),
+                context={'request': request},
+            )
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                with transaction.atomic():
+                    created = self.perform_bulk_create(serializer.validated_data)
+            except IntegrityError:
+                # lost a race with a concurrent write of the same row
+                return Response({"detail": "A conflicting write happened at the same time; retry."},
+                                status=status.HTTP_409_CONFLICT)
+
+            results = [None] * len(request.data)
+            for index, errors in serializer.item_errors.items():
+                results[index] = {"index": index, "status": status.HTTP_400_BAD_REQUEST, "errors": errors}
+            for index, obj in zip(serializer.valid_indexes, created):
+                results[index] = {"index": index, "status": status.HTTP_201_CREATED, "id": obj.pk}
+            if not serializer.item_errors:
+                code = status.HTTP_201_CREATED
+            elif created:
+                code = status.HTTP_207_MULTI_STATUS
+            else:
+                code = status.HTTP_400_BAD_REQUEST
+            return Response({"created": len(created), "failed": len(serializer.item_errors), "results": results}, status=code)
+
+        return idempotency.respond(request, self.idempotency_scope, run)
+
+    @abc.abstractmethod
+    def perform_bulk_create(self, items):
+        """Insert the validated `items` and return the created objects, in order."""
+
+
+class CommentBulk(BulkCreateView):
+    serializer_class = CommentSerializer
+    idempotency_scope = 'comments:bulk'
+    throttle_scopes = {'POST': 'comment'}
+
+    def perform_bulk_create(self, items):
+        comments = [Comment(creator_id=self.request.user.id, **item) for item in items]
+        for comment in comments:
+            if comment.parent_id:
+                comment.depth = comment.parent.depth + 1
+        comments = Comment.objects.bulk_create(comments, batch_size=BULK_CREATE_BATCH_SIZE)
+        # paths end with the new ids (see threads.py)
+        for comment in comments:
+            comment.path = threads.path_for(comment)
+        Comment.objects.bulk_update(comments, ['path'], batch_size=BULK_CREATE_BATCH_SIZE)
+
+        deltas, replies = {}, {}
+        for comment in comments:
+            deltas[comment.the_video_id] = deltas.get(comment.the_video_id, 0) + 1
+            if comment.parent_id:
+                replies[comment.parent_id] = replies.get(comment.parent_id, 0) + 1
+        counters.adjust_comment_counts(deltas)
+        counters.adjust_reply_counts(replies)
+        cache.bump('comments', 'videos', *(f'video:{video_id}' for video_id in deltas))
+        return comments
+
+
 class CommentDetail(APIView):
+    permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
+
     def get_object(self,pk):
         try:
-            return Comment.objects.get(pk=pk)
+            obj = Comment.objects.get(pk=pk)
         except Comment.DoesNotExist:
             raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
     
 
     def get(self, request, pk,*args, **kwargs):
         queryset = self.get_object(pk)
-        serializer = CommentSerializer(queryset,context={'request': request})
-        return Response(serializer.data)
+        etag, last_modified = conditional.object_validators(request, queryset)
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: Response(CommentSerializer(queryset,context={'request': request}).data),
+        )
     
 
     def delete(self, request, pk):
-        queryset = self.get_object(pk)
-        queryset.delete()
+        comment = self.get_object(pk)
+        with transaction.atomic():
+            # replies go with the comment they answer
+            removed = threads.subtree(comment).delete()[1].get('appapi.Comment', 0)
+            counters.adjust_comment_count(comment.the_video_id, -removed)
+            if comment.parent_id:
+                counters.adjust_reply_count(comment.parent_id, -1)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class VideoComments(AsyncAPIView):
+    """
+    A video's top-level comments, ?sort=newest (default) or ?sort=top (most
+    replies first). Each carries its reply_count and a thread_url for its
+    replies.
+    """
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = CommentSerializer
+    pagination_classes = {'newest': CommentPagination, 'top': TopCommentPagination}
+
+    def get_sort(self, request):
+        sort = request.query_params.get('sort', 'newest')
+        if sort not in self.pagination_classes:
+            raise ValidationError({'sort': ['Must be "newest" or "top".']})
+        return sort
+
+    def get(self, request, pk):
+        sort = self.get_sort(request)
+        if not Video.objects.filter(pk=pk).exists():
+            raise Http404
+
+        def build():
+            paginator = self.pagination_classes[sort]()
+            comments = paginator.paginate_queryset(Comment.objects.filter(the_video_id=pk, depth=0), request, view=self)
+            serializer = self.serializer_class(comments, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data).data
+        # comment writes bump the video's scope (see signals.py)
+        etag, last_modified = conditional.collection_validators(request, f'video:{pk}')
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'list', [f'video:{pk}'], build),
+            check_modified_since=False,
+        )
+
+    async def async_get(self, request, pk):
+        sort = self.get_sort(request)
+        if not await Video.objects.filter(pk=pk).aexists():
+            raise Http404
+
+        async def build():
+            paginator = self.pagination_classes[sort]()
+            comments = await paginator.apaginate_queryset(
+                Comment.objects.filter(the_video_id=pk, depth=0), request, view=self)
+            serializer = self.serializer_class(comments, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data).data
+        etag, last_modified = conditional.collection_validators(request, f'video:{pk}')
+        return await conditional.arespond(
+            request, etag, last_modified,
+            lambda: cache.acached_response(request, 'list', [f'video:{pk}'], build),
+            check_modified_since=False,
+        )
+
+
+class CommentThread(APIView):
+    """
+    A comment and every reply below it, at any depth, in reading order:
+    each comment is followed by its replies, oldest first. Pages are
+    ranges of comment_path_idx (see threads.py).
+    """
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = CommentSerializer
+    pagination_class = ThreadPagination
+
+    def get(self, request, pk):
+        try:
+            root = Comment.objects.only('id', 'path', 'the_video').get(pk=pk)
+        except Comment.DoesNotExist:
+            raise Http404
+
+        def build():
+            paginator = self.pagination_class()
+            comments = paginator.paginate_queryset(threads.subtree(root), request, view=self)
+            serializer = self.serializer_class(comments, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data).data
+        etag, last_modified = conditional.collection_validators(request, f'video:{root.the_video_id}')
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'list', [f'video:{root.the_video_id}'], build),
+            check_modified_since=False,
+        )
 
 
 
@@ -218,18 +759,42 @@ class SubscriptionList(APIView):
 
 
     def get(self, request):
-        queryset = Subscription.objects.filter(subscriber=request.user)
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data)
+        # only() keeps the read on the covering unique index
+        queryset = Subscription.objects.filter(subscriber_id=request.user.id).only('id', 'subscriber', 'subscribed_to')
+        etag, last_modified = conditional.collection_validators(request, f'subscriptions:{request.user.id}')
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: Response(self.serializer_class(queryset, many=True).data),
+            check_modified_since=False,
+        )
 
     
     def post(self, request):
         serializer = self.serializer_class(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save(subscriber=request.user)
+            with transaction.atomic():
+                subscription = serializer.save(subscriber_id=request.user.id)
+                counters.adjust_subscriber_count(subscription.subscribed_to_id, 1)
+            feed.backfill(subscription)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+class SubscriptionBulk(BulkCreateView):
+    serializer_class = SubscriptionSerializer
+    idempotency_scope = 'subscriptions:bulk'
+
+    def perform_bulk_create(self, items):
+        subscriber = self.request.user
+        subscriptions = Subscription.objects.bulk_create(
+            [Subscription(subscriber_id=subscriber.id, **item) for item in items], batch_size=BULK_CREATE_BATCH_SIZE,
+        )
+        counters.adjust_subscriber_counts({subscription.subscribed_to_id: 1 for subscription in subscriptions})
+        cache.bump(f'subscriptions:{subscriber.id}',
+                   *(f'profile:{subscription.subscribed_to_id}' for subscription in subscriptions))
+        transaction.on_commit(lambda: feed.backfill_many(subscriptions))
+        return subscriptions
+
+
 class SubscriptionDetail(APIView):
     def get_object(self,pk):
         try:
@@ -244,14 +809,318 @@ class SubscriptionDetail(APIView):
     
     def delete(self, request, pk):
         subscription = self.get_object(pk)
-        if subscription.subscriber != request.user:
+        if subscription.subscriber_id != request.user.id:
             return Response({"detail": "You cannot delete someone else's subscription."}, status=status.HTTP_403_FORBIDDEN)
-        subscription.delete()
+        feed.prune(subscription)
+        with transaction.atomic():
+            subscription.delete()
+            counters.adjust_subscriber_count(subscription.subscribed_to_id, -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
-          
 
 
 
 
 
-    
\ No newline at end of file
+class ProfileDetail(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        try:
+            profile = Profile.objects.select_related('user').get(user_id=pk)
+        except Profile.DoesNotExist:
+            raise Http404
+
+        def build():
+            serializer = ProfileSerializer(profile)
+            return serializer.data
+        etag, last_modified = conditional.object_validators(request, profile)
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'detail', [f'profile:{pk}'], build),
+        )
+
+    async def async_get(self, request, pk):
+        try:
+            profile = await Profile.objects.select_related('user').aget(user_id=pk)
+        except Profile.DoesNotExist:
+            raise Http404
+
+        async def build():
+            return ProfileSerializer(profile).data
+        etag, last_modified = conditional.object_validators(request, profile)
+        return await conditional.arespond(
+            request, etag, last_modified,
+            lambda: cache.acached_response(request, 'detail', [f'profile:{pk}'], build),
+        )
+
+
+class Search(APIView):
+    """
+    Ranked full-text search over videos and posts: ?q=words&type=video|post.
+    Each hit carries its serialized object and HTML-escaped highlights.
+    """
+
+    permission_classes = [IsAuthenticated]
+    pagination_class = SearchPagination
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        kind = request.query_params.get('type') or None
+        if kind not in (None, 'video', 'post'):
+            return Response({'type': ['Must be "video" or "post".']}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = self.pagination_class()
+        hits = paginator.paginate(request, lambda limit, offset: search.search(query, kind, limit, offset))
+
+        ids = {'video': [], 'post': []}
+        for hit in hits:
+            ids[hit['kind']].append(hit['id'])
+        videos = Video.objects.select_related('creator').in_bulk(ids['video'])
+        posts = Post.objects.select_related('creator').in_bulk(ids['post'])
+
+        results = []
+        for hit in hits:
+            if hit['kind'] == 'video':
+                obj = videos.get(hit['id'])
+                data = obj and VideoSerilaizer(obj, context={'request': request}).data
+            else:
+                obj = posts.get(hit['id'])
+                data = obj and PostSerializer(obj, context={'request': request}).data
+            if obj is None:
+                # deleted since it was indexed
+                continue
+            results.append({
+                'type': hit['kind'],
+                'id': hit['id'],
+                'score': hit['score'],
+                'highlight': {'title': hit['title'], 'snippet': hit['snippet']},
+                'object': data,
+            })
+        return paginator.get_paginated_response(results)
+
+
+class ViewBeacons(APIView):
+    """
+    POST a JSON array of view beacons, {"video": id, "seconds": watched},
+    up to VIEW_EVENTS['MAX_BATCH'] per request. They are logged, not
+    written to the database; flush_views adds them to the rollups later
+    (see analytics.py). Invalid beacons, and views of a video beyond
+    VIEW_EVENTS['MAX_VIEWS_PER_HOUR'] per viewer, are dropped and counted.
+    """
+
+    permission_classes = [AllowAny]
+    parser_classes = [FastJSONParser]
+    throttle_scopes = {'POST': 'beacon'}
+
+    def post(self, request):
+        beacons = request.data
+        if not isinstance(beacons, list):
+            return Response({"detail": "Expected a list of beacons."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(beacons) > analytics.option('MAX_BATCH'):
+            return Response({"detail": f"At most {analytics.option('MAX_BATCH')} beacons per request."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        totals, rejected = analytics.parse(beacons, throttling.identity(request))
+        analytics.record(totals)
+        return Response({"accepted": len(beacons) - rejected, "rejected": rejected}, status=status.HTTP_202_ACCEPTED)
+
+
+class TrendingVideos(APIView):
+    """
+    The most viewed videos of the last ?hours= hours (default
+    VIEW_EVENTS['TRENDING_HOURS'], at most a week), with their views and
+    seconds watched in that window. Up to ?limit= (20, at most 100).
+    """
+
+    permission_classes = [IsAuthenticated]
+    max_hours = 7 * 24
+    max_limit = 100
+
+    def get(self, request):
+        try:
+            hours = int(request.query_params.get('hours', analytics.option('TRENDING_HOURS')))
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({"detail": "hours and limit must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        hours = min(max(hours, 1), self.max_hours)
+        limit = min(max(limit, 1), self.max_limit)
+
+        def build():
+            ranked = analytics.trending(hours, limit)
+            videos = Video.objects.select_related('creator').in_bulk([video_id for video_id, _, _ in ranked])
+            results = []
+            for video_id, views, watched in ranked:
+                if video_id in videos:
+                    data = VideoSerilaizer(videos[video_id], context={'request': request}).data
+                    results.append({**data, 'recent_views': views, 'recent_watch_seconds': watched})
+            return {'hours': hours, 'results': results}
+        # flush_views bumps 'views'; rollups only change then
+        etag, last_modified = conditional.collection_validators(request, 'views', 'videos')
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: cache.cached_response(request, 'list', ['views', 'videos'], build),
+            check_modified_since=False,
+        )
+
+
+class Recommendations(APIView):
+    """
+    Videos picked for the user from the creators most co-subscribed with
+    the ones they follow, best first, each with its score. Users without
+    recommendations yet get the trending ranking instead. Both lists are
+    precomputed by the rank_videos job (see ranking.py).
+    """
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = VideoSerilaizer
+    pagination_class = RankPagination
+
+    def get(self, request):
+        rows = Recommendation.objects.filter(user_id=request.user.id)
+        source = 'subscriptions'
+        if not rows.exists():
+            rows, source = VideoScore.objects.all(), 'trending'
+        paginator = self.pagination_class()
+        ranked = paginator.paginate_queryset(rows, request, view=self)
+        pairs = ranked_videos(ranked)
+        data = self.serializer_class([video for _, video in pairs], many=True, context={'request': request}).data
+        results = [{**video, 'score': row.score} for (row, _), video in zip(pairs, data)]
+        response = paginator.get_paginated_response(results)
+        response.data['source'] = source
+        return response
+
+
+class CacheStats(APIView):
+    """
+    Hit and miss counts of the response cache in this process.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(dict(cache.stats))
+
+
+class Export(APIView):
+    """
+    A whole table as NDJSON or CSV, streamed in id order (see export.py).
+    `?since_id=` resumes after the last id received.
+    """
+
+    permission_classes = [IsAdminUser]
+    http_method_names = ['get', 'options']
+    # the format is in the URL; ignore Accept: text/csv and the like
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, name, fmt):
+        if name not in export.EXPORTS or fmt not in export.FORMATS:
+            raise Http404
+        try:
+            since_id = int(request.query_params.get('since_id', 0))
+        except ValueError:
+            raise ValidationError({'since_id': ['Must be an integer.']})
+        stream = export.astream if is_asgi(request) else export.stream
+        response = StreamingHttpResponse(stream(name, fmt, since_id), content_type=export.FORMATS[fmt])
+        response['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+        return response
+
+
+
+
+
+class UploadList(APIView):
+    """
+    Open a resumable upload. The response `id` is used to PUT chunks and complete it.
+    """
+
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scopes = {'POST': 'upload'}
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        if serializer.is_valid():
+            session = serializer.save(creator_id=request.user.id)
+            uploads.create_partial(session)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class UploadDetail(APIView):
+    """
+    GET reports received and missing byte ranges, PUT writes one chunk
+    described by its Content-Range header, DELETE abandons the upload.
+    """
+
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scopes = {'PUT': 'chunk'}
+
+    def get_object(self, pk):
+        try:
+            return UploadSession.objects.get(
+                pk=pk, creator_id=self.request.user.id, video__isnull=True, updated_at__gte=uploads.expiry_cutoff(),
+            )
+        except UploadSession.DoesNotExist:
+            raise Http404
+
+    def get(self, request, pk):
+        session = self.get_object(pk)
+        etag, last_modified = conditional.object_validators(request, session)
+        return conditional.respond(
+            request, etag, last_modified,
+            lambda: Response(self.serializer_class(session).data),
+        )
+
+    def put(self, request, pk):
+        session = self.get_object(pk)
+        try:
+            start, end = uploads.parse_content_range(request.headers.get('Content-Range'), session.total_size)
+            if request.META.get('CONTENT_LENGTH') != str(end - start):
+                raise uploads.ChunkError('Content-Length does not match Content-Range.')
+            # read the raw request stream; touching request.data would buffer the chunk
+            uploads.write_chunk(session, request.stream, start, end)
+        except uploads.ChunkError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            session.received = uploads.merge_range(session.received, start, end)
+            # updated_at too: every chunk keeps the session from expiring
+            session.save(update_fields=['received', 'updated_at'])
+        serializer = self.serializer_class(session)
+        return Response(serializer.data)
+
+    def delete(self, request, pk):
+        session = self.get_object(pk)
+        uploads.discard_partial(session)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadComplete(APIView):
+    """
+    Assemble a fully received upload into a Video.
+    """
+
+    permission_classes = [IsAuthenticated]
+    # assembling is I/O bound like writing chunks, and counts against the same cap
+    throttle_scopes = {'POST': 'chunk'}
+
+    def post(self, request, pk):
+        with transaction.atomic():
+            try:
+                session = UploadSession.objects.select_for_update().get(pk=pk, creator_id=request.user.id)
+            except UploadSession.DoesNotExist:
+                raise Http404
+            if session.video_id is None and session.updated_at < uploads.expiry_cutoff():
+                raise Http404
+            if session.video_id is None:
+                missing = uploads.missing_ranges(session)
+                if missing:
+                    return Response({"detail": "upload is incomplete", "missing": missing}, status=status.HTTP_409_CONFLICT)
+                session.video = uploads.assemble(session)
+                session.save(update_fields=['video'])
+                counters.adjust_video_count(session.creator_id, 1)
+                feed.fan_out(session.video)
+        serializer = VideoSerilaizer(session.video, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,193 @@
+"""
+WSGI against ASGI with CONNECTIONS concurrent clients (default 1000),
+driving Django's WSGI and ASGI handlers in process, without a network in
+between.
+
+WSGI is served the way a threaded server does it, by a pool of THREADS
+workers (default 32): a request waits for a free worker and holds it
+until its body has been sent. ASGI is served from one event loop, once
+with the synchronous views and once with ASYNC_VIEWS on, as api/asgi.py
+runs them. In the first run every client sends REQUESTS requests one
+after the other (default 5) to the cached video list and a video
+detail; in the second it fetches a 512 KiB video stream once, reading
+it at BLOCK_DELAY seconds per 64 KiB (default 50 ms, about 10 Mbit/s)
+the way a client on a slow link does.
+
+Reports requests/s and client-side latency (queueing included).
+"""
+
+from benchmarks.common import setup
+
+setup()
+
+import asyncio
+import importlib
+import io
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.urls import clear_url_caches
+from django.utils import timezone
+
+import api.urls
+import appapi.urls
+from appapi.models import Video
+from appapi.serializers import ClaimsTokenObtainPairSerializer
+
+CONNECTIONS = int(os.environ.get('CONNECTIONS', 1000))
+THREADS = int(os.environ.get('THREADS', 32))
+REQUESTS = int(os.environ.get('REQUESTS', 5))
+BLOCK_DELAY = float(os.environ.get('BLOCK_DELAY', 0.05))
+STREAM_SIZE = 512 * 1024
+
+
+def populate():
+    user = User.objects.create_user(username='bench', password='bench')
+    now = timezone.now()
+    Video.objects.bulk_create([
+        Video(video='x.mp4', title=f'video {i}', desc='', status=Video.READY, creator=user, created_at=now)
+        for i in range(200)
+    ])
+    video = Video.objects.create(video=SimpleUploadedFile('clip.mp4', os.urandom(STREAM_SIZE)), title='clip',
+                                 desc='', status=Video.READY, creator=user, created_at=now)
+    token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+    return video, f'Bearer {token}'
+
+
+def use_async_views(enabled):
+    # views are made coroutines or not when the URLconf is imported
+    settings.ASYNC_VIEWS = enabled
+    importlib.reload(appapi.urls)
+    importlib.reload(api.urls)
+    clear_url_caches()
+
+
+def summary(label, latencies, elapsed):
+    latencies.sort()
+    print(f'{label:<33} {len(latencies) / elapsed:8,.0f} req/s   latency median {statistics.median(latencies):8.1f} ms'
+          f'   p99 {latencies[int(len(latencies) * 0.99) - 1]:8.1f} ms')
+
+
+def run_wsgi(client_paths, authorization, slow):
+    application = WSGIHandler()
+    pool = ThreadPoolExecutor(THREADS)
+    latencies, errors, lock, done = [], [], threading.Lock(), threading.Event()
+    clients = [len(client_paths)]
+
+    def handle(paths, index, submitted):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': paths[index], 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80', 'HTTP_HOST': 'testserver', 'HTTP_AUTHORIZATION': authorization,
+            'REMOTE_ADDR': '127.0.0.1', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0), 'wsgi.multithread': True,
+            'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        statuses = []
+        try:
+            body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            try:
+                for _ in body:
+                    if slow:
+                        # the worker blocks while a slow client drains the socket
+                        time.sleep(BLOCK_DELAY)
+            finally:
+                body.close()
+            assert statuses[0].startswith('200'), statuses
+        except BaseException as exc:
+            errors.append(exc)
+        with lock:
+            latencies.append((time.perf_counter() - submitted) * 1000)
+            if index + 1 < len(paths):
+                # the client sends its next request once this one is answered
+                pool.submit(handle, paths, index + 1, time.perf_counter())
+            else:
+                clients[0] -= 1
+                if not clients[0]:
+                    done.set()
+
+    start = time.perf_counter()
+    for paths in client_paths:
+        pool.submit(handle, paths, 0, time.perf_counter())
+    done.wait()
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    if errors:
+        raise errors[0]
+    return latencies, elapsed
+
+
+def run_asgi(client_paths, authorization, slow):
+    application = ASGIHandler()
+    latencies = []
+
+    async def request(path):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'authorization', authorization.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        finished = asyncio.Event()
+        sent = [False]
+        statuses = []
+
+        async def receive():
+            if not sent[0]:
+                sent[0] = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            elif slow and message.get('body'):
+                await asyncio.sleep(BLOCK_DELAY)
+
+        started = time.perf_counter()
+        await application(scope, receive, send)
+        finished.set()
+        assert statuses == [200], statuses
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    async def client(paths):
+        for path in paths:
+            await request(path)
+
+    async def main():
+        await asyncio.gather(*(client(paths) for paths in client_paths))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    video, authorization = populate()
+    settings.THROTTLE = dict(settings.THROTTLE, RATES={})
+    reads = ['/api/videos/', f'/api/videos/{video.pk}/'] * REQUESTS
+    stream = [f'/api/videos/{video.pk}/stream/']
+    print(f'{CONNECTIONS} clients, {THREADS} WSGI threads, {REQUESTS} x (list + detail) per client, '
+          f'or a {STREAM_SIZE // 1024} KiB stream at {BLOCK_DELAY * 1000:g} ms per 64 KiB')
+    # warm the response cache and the code paths
+    run_wsgi([reads[:2]] * 50, authorization, False)
+
+    for paths, slow, label in ((reads, False, 'list + detail'), (stream, True, 'slow stream')):
+        use_async_views(False)
+        summary(f'WSGI, {label}', *run_wsgi([paths] * CONNECTIONS, authorization, slow))
+        summary(f'ASGI sync views, {label}', *run_asgi([paths] * CONNECTIONS, authorization, slow))
+        use_async_views(True)
+        summary(f'ASGI async views, {label}', *run_asgi([paths] * CONNECTIONS, authorization, slow))
+
+
+if __name__ == '__main__':
+    main()
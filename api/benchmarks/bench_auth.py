@@ -0,0 +1,68 @@
+"""
+Authentication cost per request, loading the User row for every token
+(simplejwt's JWTAuthentication, the previous default) against building it
+from the token's claims (ClaimsJWTAuthentication) with the cached
+revocation cutoff, among USERS users (default 100k).
+
+Times authenticate() alone and a cached GET /api/videos/, and counts the
+queries each path runs.
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from appapi import authentication
+from appapi.serializers import ClaimsTokenObtainPairSerializer
+from appapi.views import VideoList
+
+USERS = int(os.environ.get('USERS', 100_000))
+
+
+def per_call(label, func, count=20_000):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    print(f'{label:<40} {(time.perf_counter() - start) / count * 1e6:8.1f} us')
+
+
+def main():
+    User.objects.bulk_create([User(username=f'user{i}') for i in range(USERS)], batch_size=5000)
+    user = User.objects.get(username=f'user{USERS // 2}')
+    token = str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+    header = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+    print(f'{USERS:,} users')
+    settings.THROTTLE = dict(settings.THROTTLE, RATES={})
+
+    request = Request(APIRequestFactory().get('/api/videos/', **header))
+    client = APIClient()
+    client.credentials(**header)
+    for label, backend in (('load user row', JWTAuthentication), ('claims', authentication.ClaimsJWTAuthentication)):
+        authenticator = backend()
+        authenticator.authenticate(request)
+        with CaptureQueriesContext(connection) as queries:
+            authenticator.authenticate(request)
+        per_call(f'authenticate(), {label} ({len(queries)} queries)', lambda: authenticator.authenticate(request))
+
+        VideoList.authentication_classes = [backend]
+        for _ in range(500):
+            client.get('/api/videos/')
+        with CaptureQueriesContext(connection) as queries:
+            assert client.get('/api/videos/').status_code == 200
+        report(f'GET /api/videos/, {label} ({len(queries)} q)',
+               *measure(lambda: client.get('/api/videos/'), repeat=3000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Throughput of creating ITEMS comments and subscriptions (default 10k):
+one POST per item against the bulk endpoints, whole and in batches.
+
+    ITEMS=2000 python -m benchmarks.bench_bulk
+"""
+
+from benchmarks.common import setup
+
+setup()
+
+import os
+import time
+
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from appapi.models import Comment, Profile, Subscription, Video
+
+ITEMS = int(os.environ.get('ITEMS', 10_000))
+
+
+def timed(label, post, items, batch=None):
+    start = time.perf_counter()
+    if batch is None:
+        for item in items:
+            post(item)
+    else:
+        for offset in range(0, len(items), batch):
+            post(items[offset:offset + batch])
+    elapsed = time.perf_counter() - start
+    print(f'{label:<40} {elapsed:8.2f} s   {len(items) / elapsed:10,.0f} items/s')
+
+
+def main():
+    user = User.objects.create_user(username='bench', password='bench')
+    creators = User.objects.bulk_create([User(username=f'creator{i}') for i in range(3 * ITEMS)])
+    Profile.objects.bulk_create([Profile(user=creator) for creator in creators])
+    videos = Video.objects.bulk_create([
+        Video(video='x.mp4', title=f'video {i}', desc='', creator=creators[i % 100]) for i in range(100)
+    ])
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    def post(url):
+        def send(body):
+            response = client.post(url, body, format='json')
+            assert response.status_code == 201, response.data
+        return send
+
+    comments = [{'comment': f'comment {i}', 'the_video': videos[i % len(videos)].pk} for i in range(ITEMS)]
+    timed('comments, one per request', post('/api/comments/'), comments)
+    timed('comments, bulk', post('/api/comments/bulk/'), comments, batch=ITEMS)
+    timed('comments, bulk in batches of 1000', post('/api/comments/bulk/'), comments, batch=1000)
+    assert Comment.objects.count() == 3 * ITEMS
+
+    for label, url, group, batch in (
+        ('subscriptions, one per request', '/api/subscriptions/', 0, None),
+        ('subscriptions, bulk', '/api/subscriptions/bulk/', 1, ITEMS),
+        ('subscriptions, bulk in batches of 1000', '/api/subscriptions/bulk/', 2, 1000),
+    ):
+        targets = creators[group * ITEMS:(group + 1) * ITEMS]
+        timed(label, post(url), [{'subscribed_to': creator.pk} for creator in targets], batch=batch)
+    assert Subscription.objects.count() == 3 * ITEMS
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Latency of cached (hit) versus uncached read endpoints.
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from appapi.cache import get_cache
+from appapi.models import Comment, Post, Video
+
+
+def main():
+    user = User.objects.create_user(username='bench', password='bench')
+    videos = Video.objects.bulk_create(
+        Video(video='uploads/bench.mp4', title=f'video {i}', desc='bench', creator=user, created_at=timezone.now())
+        for i in range(200)
+    )
+    Comment.objects.bulk_create(Comment(comment='nice', creator=user, the_video=v) for v in videos for _ in range(20))
+    post = Post.objects.create(post='bench', creator=user)
+
+    client = APIClient()
+    client.force_authenticate(user=user)
+    cache = get_cache()
+
+    for label, url in (
+        ('video detail', f'/api/videos/{videos[0].pk}/'),
+        ('post detail', f'/api/posts/{post.pk}/'),
+        ('video list page (100)', '/api/videos/?page_size=100'),
+        ('comment list page (100)', '/api/comments/?page_size=100'),
+    ):
+        def uncached():
+            cache.clear()
+            client.get(url)
+
+        report(f'{label}, uncached', *measure(uncached))
+        client.get(url)
+        report(f'{label}, hit', *measure(lambda: client.get(url)))
+
+
+if __name__ == '__main__':
+    main()
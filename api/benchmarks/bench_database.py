@@ -0,0 +1,106 @@
+"""
+SQLite under concurrent writers: WRITERS processes (default 4) each post
+WRITES comments (default 300), the way CommentList.post does (read the
+video, insert the comment, bump the video's comment_count, in one
+transaction), while one more process keeps reading a page of comments.
+
+Compared on a database file with SQLite's defaults and with
+settings.SQLITE_TUNED_OPTIONS: committed writes per second, writes that
+failed with "database is locked", and reader latency during the writes.
+"""
+
+from benchmarks.common import setup
+
+setup()
+
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+
+from appapi.models import Comment, Video
+
+WRITERS = int(os.environ.get('WRITERS', 4))
+WRITES = int(os.environ.get('WRITES', 300))
+
+
+def add_database(alias, options):
+    path = os.path.join(tempfile.mkdtemp(prefix='bench-db-'), 'db.sqlite3')
+    connections.databases[alias] = dict(settings.DATABASES['default'], NAME=path, OPTIONS=options,
+                                        CONN_MAX_AGE=None, TEST={})
+    call_command('migrate', database=alias, verbosity=0)
+    # bulk_create: no signals, which would write to the default database
+    (user,) = User.objects.using(alias).bulk_create([User(username='bench')])
+    (video,) = Video.objects.using(alias).bulk_create([Video(video='x.mp4', title='video', desc='', creator=user)])
+    connections[alias].close()
+    return user.pk, video.pk
+
+
+def write(alias, user_id, video_id, results):
+    committed = locked = 0
+    start = time.perf_counter()
+    for i in range(WRITES):
+        try:
+            with transaction.atomic(using=alias):
+                video = Video.objects.using(alias).get(pk=video_id)
+                Comment.objects.using(alias).bulk_create(
+                    [Comment(comment=f'comment {i}', creator_id=user_id, the_video=video)])
+                Video.objects.using(alias).filter(pk=video_id).update(comment_count=F('comment_count') + 1)
+            committed += 1
+        except OperationalError:
+            locked += 1
+    results.put((committed, locked, time.perf_counter() - start))
+
+
+def read(alias, video_id, stop, results):
+    samples = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            list(Comment.objects.using(alias).filter(the_video_id=video_id).order_by('-id')[:20])
+        except OperationalError:
+            pass
+        samples.append((time.perf_counter() - start) * 1000)
+    results.put(samples)
+
+
+def run(alias, options):
+    user_id, video_id = add_database(alias, options)
+    results, latencies, stop = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Event()
+    reader = multiprocessing.Process(target=read, args=(alias, video_id, stop, latencies))
+    writers = [multiprocessing.Process(target=write, args=(alias, user_id, video_id, results)) for _ in range(WRITERS)]
+    reader.start()
+    start = time.perf_counter()
+    for writer in writers:
+        writer.start()
+    outcomes = [results.get() for _ in writers]
+    elapsed = time.perf_counter() - start
+    stop.set()
+    samples = sorted(latencies.get())
+    for process in writers + [reader]:
+        process.join()
+
+    committed = sum(outcome[0] for outcome in outcomes)
+    locked = sum(outcome[1] for outcome in outcomes)
+    count = Video.objects.using(alias).get(pk=video_id).comment_count
+    assert count == committed == Comment.objects.using(alias).count(), (count, committed)
+    print(f'{alias:<10} {committed / elapsed:8,.0f} writes/s   {locked:5} locked of {WRITERS * WRITES}   '
+          f'reads median {statistics.median(samples):6.2f} ms  p95 {samples[int(len(samples) * 0.95) - 1]:6.2f} ms  '
+          f'max {samples[-1]:7.1f} ms')
+
+
+def main():
+    print(f'{WRITERS} writers x {WRITES} comments, 1 reader')
+    run('defaults', {})
+    run('tuned', settings.SQLITE_TUNED_OPTIONS)
+
+
+if __name__ == '__main__':
+    main()
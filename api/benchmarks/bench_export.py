@@ -0,0 +1,87 @@
+"""
+Memory of a comments export as the table grows through SIZES rows
+(default 10, 100k and 1M): export.stream() consumed to the end, as the
+NDJSON endpoint is, against building the whole list first the way a
+list endpoint does (only up to LIST_LIMIT rows, default 100k).
+
+Reports rows/s, how far the process RSS rose above where it started
+and, from a second pass, the peak of Python allocations (tracemalloc).
+The test database lives in memory, so RSS is sampled against a baseline
+taken after the rows are inserted.
+"""
+
+from benchmarks.common import setup
+
+setup()
+
+import json
+import os
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from appapi import export
+from appapi.models import Comment, Video
+
+SIZES = [int(size) for size in os.environ.get('SIZES', '10,100000,1000000').split(',')]
+LIST_LIMIT = int(os.environ.get('LIST_LIMIT', 100_000))
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def streamed():
+    high = rss()
+    rows = 0
+    for chunk in export.stream('comments', 'ndjson'):
+        rows += chunk.count(b'\n')
+        high = max(high, rss())
+    return rows, high
+
+
+def listed():
+    _, columns = export.EXPORTS['comments']
+    rows = list(Comment.objects.order_by('pk').values(*columns))
+    body = json.dumps(rows, default=str).encode()
+    high = rss()
+    del body
+    return len(rows), high
+
+
+def run(label, func):
+    baseline = rss()
+    start = time.perf_counter()
+    rows, high = func()
+    elapsed = time.perf_counter() - start
+    # a second pass, since tracing slows everything down
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<8} {rows:>9,} rows {rows / elapsed:>10,.0f} rows/s   '
+          f'peak allocated {peak / 2 ** 20:8.1f} MiB   RSS +{(high - baseline) / 2 ** 20:7.1f} MiB')
+
+
+def main():
+    user = User.objects.create_user(username='bench')
+    video = Video.objects.create(video='x.mp4', title='video', desc='', creator=user, created_at=timezone.now())
+    count = 0
+    for size in SIZES:
+        while count < size:
+            batch = min(20_000, size - count)
+            Comment.objects.bulk_create([
+                Comment(comment=f'comment number {count + i}', creator=user, the_video=video) for i in range(batch)
+            ])
+            count += batch
+        run('stream', streamed)
+        if size <= LIST_LIMIT:
+            run('list', listed)
+
+
+if __name__ == '__main__':
+    main()
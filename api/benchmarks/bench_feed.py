@@ -0,0 +1,57 @@
+"""
+Feed read latency against the number of creators a reader follows, with
+every creator having 10k followers.
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from appapi import feed
+from appapi.models import Subscription, Video
+
+FOLLOWERS = 10_000
+READERS = (10, 100, 1000)
+VIDEOS_PER_CREATOR = 3
+
+
+def main():
+    settings.FEED_FANOUT_LIMIT = FOLLOWERS
+    creators = User.objects.bulk_create(User(username=f'creator{i}') for i in range(max(READERS)))
+    followers = User.objects.bulk_create(User(username=f'follower{i}') for i in range(FOLLOWERS))
+    readers = {n: followers[i] for i, n in enumerate(READERS)}
+
+    # creator 0 carries the full 10k followers; every reader follows the first n creators
+    subscriptions = [Subscription(subscriber=f, subscribed_to=creators[0]) for f in followers]
+    for n, reader in readers.items():
+        subscriptions += [Subscription(subscriber=reader, subscribed_to=c) for c in creators[1:n]]
+    Subscription.objects.bulk_create(subscriptions, batch_size=5000)
+
+    start = time.perf_counter()
+    for creator in creators:
+        for i in range(VIDEOS_PER_CREATOR):
+            video = Video.objects.create(video='uploads/bench.mp4', title=f'v{i}', desc='bench',
+                                         creator=creator, created_at=timezone.now())
+            feed.fan_out(video)
+    print(f'publish + fan-out of {len(creators) * VIDEOS_PER_CREATOR} videos: {time.perf_counter() - start:.2f} s')
+
+    client = APIClient()
+    for n, reader in readers.items():
+        client.force_authenticate(user=reader)
+        report(f'fan-out on write, following {n}', *measure(lambda: client.get('/api/feed/')))
+
+    Video.objects.filter(creator=creators[0]).update(fanout_on_read=True)
+    for n, reader in readers.items():
+        client.force_authenticate(user=reader)
+        report(f'creator 0 on read, following {n}', *measure(lambda: client.get('/api/feed/')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+The video list's read path per ROWS rows (default 1000): fetching Video
+instances with their creator and serializing them with VideoSerilaizer,
+against `.values()` rows through FlatVideoSerializer.
+
+Reports the time to fetch and serialize, and the peak memory allocated
+along the way (tracemalloc).
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+import os
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from appapi.models import Video
+from appapi.serializers import FlatVideoSerializer, VideoSerilaizer
+
+ROWS = int(os.environ.get('ROWS', 1000))
+
+
+def model_rows(request):
+    videos = list(Video.objects.select_related('creator').order_by('-created_at', '-id')[:ROWS])
+    return VideoSerilaizer(videos, many=True, context={'request': request}).data
+
+
+def flat_rows(request):
+    rows = list(FlatVideoSerializer.project(Video.objects.order_by('-created_at', '-id'))[:ROWS])
+    return FlatVideoSerializer(rows, many=True, context={'request': request}).data
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    users = User.objects.bulk_create([User(username=f'creator{i}') for i in range(50)])
+    now = timezone.now()
+    Video.objects.bulk_create([
+        Video(video=f'uploads/{i}.mp4', title=f'video {i}', desc='a description', status=Video.READY,
+              creator=users[i % len(users)], created_at=now, duration=60.0, width=1280, height=720,
+              poster=f'posters/{i}.jpg', comment_count=i, view_count=i * 10)
+        for i in range(ROWS)
+    ])
+    request = Request(APIRequestFactory().get('/api/videos/'))
+    assert model_rows(request) == flat_rows(request)
+    print(f'{ROWS:,} rows')
+    for label, func in (('VideoSerilaizer over instances', model_rows), ('FlatVideoSerializer over .values()', flat_rows)):
+        report(label, *measure(lambda: func(request), repeat=20))
+        print(f'{"":<40} peak {peak_memory(lambda: func(request)) / 1024:8,.0f} KiB allocated')
+
+
+if __name__ == '__main__':
+    main()
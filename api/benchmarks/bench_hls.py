@@ -0,0 +1,71 @@
+"""
+What a player waits for before playback can start: the whole MP4 (its
+moov box sits after mdat, so every byte is needed) against HLS, where it
+needs the master playlist, one variant playlist and the first segment.
+Reports time to first byte, time to playable and bytes transferred.
+"""
+
+from benchmarks.common import report, setup
+
+setup()
+
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import RequestFactory
+from django.utils import timezone
+from django.views.static import serve
+
+from appapi import hls
+from appapi.models import Video
+
+FILE_SIZE = 64 * 1024 * 1024
+DURATION = 300
+REPEAT = 20
+
+
+def fetch(paths):
+    """Fetch media files in turn; return (ms to first byte, ms to last byte, bytes)."""
+    start = time.perf_counter()
+    ttfb, size = None, 0
+    for path in paths:
+        response = serve(RequestFactory().get('/'), path, document_root=settings.MEDIA_ROOT)
+        for chunk in response.streaming_content:
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+        response.close()
+    return ttfb * 1000, (time.perf_counter() - start) * 1000, size
+
+
+def run(label, paths):
+    samples = [fetch(paths) for _ in range(REPEAT)]
+    for name, index in (('first byte', 0), ('playable', 1)):
+        values = sorted(sample[index] for sample in samples)
+        report(f'{label}: {name}', statistics.median(values), values[int(len(values) * 0.95) - 1])
+    print(f'{label + ": bytes":<40} {samples[0][2] / 2**20:8.2f} MiB')
+
+
+def main():
+    user = User.objects.create_user(username='bench', password='bench')
+    video = Video(title='bench', desc='bench', creator=user, created_at=timezone.now(),
+                  duration=DURATION, width=1280, height=720)
+    video.video.save('bench.mp4', ContentFile(os.urandom(FILE_SIZE)), save=False)
+    video.save()
+    hls.package(video)
+    rendition = video.renditions.get()
+
+    run('whole file', [video.video.name])
+    run('HLS', [
+        video.hls_manifest.name,
+        rendition.playlist.name,
+        f'{os.path.dirname(rendition.playlist.name)}/seg_00000.ts',
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Bytes served and latency for a post image shown as a feed thumbnail: the
+original upload against its derivatives, cold (first request renders it)
+and warm (served from the derivative cache).
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+import random
+import shutil
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory
+from django.views.static import serve
+from PIL import Image
+
+from appapi import images
+from appapi.models import Post
+from appapi.views import PostImage
+
+
+def photo(width=2400, height=1600):
+    """A JPEG with enough detail to compress like a photo."""
+    rng = random.Random(0)
+    image = Image.radial_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.frombytes('RGB', (width // 4, height // 4), rng.randbytes(width // 4 * height // 4 * 3))
+    image = Image.blend(image, noise.resize((width, height)), 0.35)
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def body_size(response):
+    size = sum(len(chunk) for chunk in response.streaming_content)
+    response.close()
+    return size
+
+
+def main():
+    user = User.objects.create_user(username='bench', password='bench')
+    post = Post.objects.create(
+        post='bench', creator=user,
+        post_image=SimpleUploadedFile('photo.jpg', photo(), content_type='image/jpeg'),
+    )
+    view = PostImage.as_view()
+    factory = RequestFactory()
+
+    def original():
+        return body_size(serve(factory.get('/'), post.post_image.name, document_root=settings.MEDIA_ROOT))
+
+    def derivative(size, fmt):
+        return body_size(view(factory.get('/'), pk=post.pk, size=size, fmt=fmt))
+
+    print(f'{"original":<24} {original():>9,} bytes')
+    report('original', *measure(original, repeat=50))
+    for size in ('thumb', 'medium'):
+        for fmt in ('webp', 'jpeg'):
+            label = f'{size}.{fmt}'
+            print(f'{label:<24} {derivative(size, fmt):>9,} bytes')
+
+            def cold():
+                shutil.rmtree(images.cache_dir(), ignore_errors=True)
+                derivative(size, fmt)
+
+            report(f'{label} cold', *measure(cold, repeat=20))
+            report(f'{label} warm', *measure(lambda: derivative(size, fmt), repeat=200))
+
+
+if __name__ == '__main__':
+    main()
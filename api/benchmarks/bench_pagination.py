@@ -0,0 +1,61 @@
+"""
+Compare keyset pagination with OFFSET pagination at page 1 and page 10,000.
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from appapi.models import Video
+from appapi.pagination import VideoPagination
+
+PAGE_SIZE = 20
+DEEP_PAGE = 10_000
+
+
+def seed(count):
+    user = User.objects.create_user(username='bench', password='bench')
+    now = timezone.now()
+    Video.objects.bulk_create(
+        Video(video='uploads/bench.mp4', title=f'video {i}', desc='bench', creator=user,
+              created_at=now - timedelta(seconds=i))
+        for i in range(count)
+    )
+    return user
+
+
+def cursor_for_page(page):
+    """Build the cursor a client would hold after walking to `page`."""
+    if page == 1:
+        return '/api/videos/'
+    ordered = Video.objects.order_by('-created_at', '-id')
+    last_row = ordered[(page - 1) * PAGE_SIZE - 1]
+    paginator = VideoPagination()
+    paginator.base_url = f'/api/videos/?page_size={PAGE_SIZE}'
+    paginator.model = Video
+    return paginator.encode_cursor(last_row, reverse=False)
+
+
+def main():
+    user = seed(PAGE_SIZE * DEEP_PAGE + PAGE_SIZE)
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    for page in (1, DEEP_PAGE):
+        url = cursor_for_page(page)
+        report(f'keyset  page {page}', *measure(lambda: client.get(url)))
+
+    for page in (1, DEEP_PAGE):
+        offset = (page - 1) * PAGE_SIZE
+        qs = Video.objects.order_by('-created_at', '-id')
+        report(f'offset  page {page} (ORM only)', *measure(lambda: list(qs[offset:offset + PAGE_SIZE])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+The rank_videos job and the reads it serves, on USERS users (default 50k)
+following Zipf-popular creators, VIDEOS videos (default 100k) and a week
+of hourly view rollups.
+
+Times one full rank(), its NumPy scoring and co-subscription counting
+against the same arithmetic in Python loops, and reads of the first and a
+deep page of ?sort=trending and /api/recommendations/ against sorting by
+a score computed in the query.
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+import datetime
+import os
+import random
+import time
+from collections import Counter
+from itertools import combinations
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import ExpressionWrapper, F, FloatField, Sum
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from appapi import cache, ranking
+from appapi.models import Recommendation, Subscription, Video, ViewRollup
+
+USERS = int(os.environ.get('USERS', 50_000))
+VIDEOS = int(os.environ.get('VIDEOS', 100_000))
+CREATORS = USERS // 10
+SUBSCRIPTIONS_PER_USER = 20
+
+
+def populate():
+    rng = random.Random(0)
+    now = timezone.now()
+    users = User.objects.bulk_create([User(username=f'user{i}') for i in range(USERS)], batch_size=5000)
+    ids = [user.pk for user in users]
+    creators = ids[:CREATORS]
+    weights = [1 / (rank + 1) for rank in range(CREATORS)]
+    cumulative = list(np.cumsum(weights))
+    subscriptions = []
+    for user in ids:
+        followed = set(rng.choices(creators, cum_weights=cumulative, k=rng.randint(1, 2 * SUBSCRIPTIONS_PER_USER)))
+        followed.discard(user)
+        subscriptions += [Subscription(subscriber_id=user, subscribed_to_id=creator) for creator in followed]
+    Subscription.objects.bulk_create(subscriptions, batch_size=5000)
+    # spread "subscribed at" over the last month
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE appapi_subscription SET updated_at = datetime('now', '-' || (abs(random()) % 2592000) || ' seconds')"
+        )
+
+    videos = Video.objects.bulk_create([
+        Video(video='x.mp4', title=f'video {i}', desc='', status=Video.READY,
+              creator_id=rng.choices(creators, cum_weights=cumulative)[0],
+              created_at=now - datetime.timedelta(seconds=rng.randint(0, 30 * 86400)),
+              comment_count=int(rng.paretovariate(1.5)) - 1)
+        for i in range(VIDEOS)
+    ], batch_size=5000)
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    rollups = []
+    for video in rng.sample(videos, VIDEOS // 5):
+        for hours in rng.sample(range(7 * 24), 5):
+            rollups.append(ViewRollup(video=video, hour=hour - datetime.timedelta(hours=hours),
+                                      views=int(rng.paretovariate(1.2)), watch_seconds=0))
+    ViewRollup.objects.bulk_create(rollups, batch_size=5000)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return len(subscriptions), len(rollups)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def python_scores(now):
+    """score_videos() written as loops over the same rows."""
+    half_life = ranking.option('HALF_LIFE_HOURS') * 3600.0
+    weights = ranking.option('WEIGHTS')
+    now = now.timestamp()
+    since = timezone.now() - datetime.timedelta(hours=ranking.option('VIEW_WINDOW_HOURS'))
+    views = Counter()
+    for video, hour, count in ViewRollup.objects.filter(hour__gte=since).values_list('video_id', 'hour', 'views'):
+        views[video] += count * 0.5 ** (max(now - hour.timestamp(), 0) / half_life)
+    momentum = Counter()
+    for creator, when in Subscription.objects.values_list('subscribed_to_id', 'updated_at'):
+        momentum[creator] += 0.5 ** (max(now - when.timestamp(), 0) / half_life)
+    scores = {}
+    for pk, creator, comments, created in Video.objects.values_list('pk', 'creator_id', 'comment_count', 'created_at'):
+        decay = 0.5 ** (max(now - created.timestamp(), 0) / half_life)
+        scores[pk] = weights['views'] * views[pk] + (
+            weights['comments'] * comments + weights['subscriptions'] * momentum[creator]) * decay
+    return scores
+
+
+def python_co_subscriptions(subscribers, creators, keys):
+    """Pair counts over the ranked creators with a dict per pair."""
+    ranked = set(keys.tolist())
+    follows = {}
+    for user, creator in zip(subscribers.tolist(), creators.tolist()):
+        if creator in ranked:
+            follows.setdefault(user, []).append(creator)
+    pairs = Counter()
+    for followed in follows.values():
+        for pair in combinations(sorted(followed[:ranking.option('MAX_SUBSCRIPTIONS_PER_USER')]), 2):
+            pairs[pair] += 1
+    return pairs
+
+
+def main():
+    subscriptions, rollups = populate()
+    print(f'{USERS:,} users, {CREATORS:,} creators, {subscriptions:,} subscriptions, '
+          f'{VIDEOS:,} videos, {rollups:,} rollup rows')
+
+    now = timezone.now()
+    (ids, _, scores), elapsed = timed(lambda: ranking.score_videos(now))
+    print(f'{"score videos, NumPy":<40} {elapsed:8.2f} s')
+    loop_scores, elapsed = timed(lambda: python_scores(now))
+    print(f'{"score videos, Python loop":<40} {elapsed:8.2f} s')
+    assert np.allclose(scores, [loop_scores[pk] for pk in ids.tolist()])
+
+    pairs = np.array(list(Subscription.objects.values_list('subscriber_id', 'subscribed_to_id')), dtype=np.int64)
+    (keys, similarity), elapsed = timed(lambda: ranking.creator_similarity(pairs[:, 0], pairs[:, 1]))
+    print(f'{"creator similarity, NumPy":<40} {elapsed:8.2f} s   ({len(keys):,} creators)')
+    counted, elapsed = timed(lambda: python_co_subscriptions(pairs[:, 0], pairs[:, 1], keys))
+    print(f'{"co-subscription counts, Python dicts":<40} {elapsed:8.2f} s   ({len(counted):,} pairs)')
+
+    (ranked, users), elapsed = timed(ranking.rank)
+    print(f'{"rank() end to end":<40} {elapsed:8.2f} s   ({ranked:,} ranked, {users:,} users recommended)')
+
+    client = APIClient()
+    reader = User.objects.get(username=f'user{USERS - 1}')
+    client.force_authenticate(user=reader)
+
+    def get(url):
+        # measure the database path, not the response cache
+        cache.bump('ranking', 'videos')
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+        return response
+
+    def deep(url, pages=50):
+        response = get(url)
+        for _ in range(pages):
+            response = get(response.data['next'])
+        return response.data['next']
+
+    report('newest (for reference), page 1', *measure(lambda: get('/api/videos/')))
+    report('trending, page 1', *measure(lambda: get('/api/videos/?sort=trending')))
+    deep_trending = deep('/api/videos/?sort=trending')
+    report('trending, page 52', *measure(lambda: get(deep_trending)))
+    assert Recommendation.objects.filter(user=reader).exists()
+    report('recommendations, page 1', *measure(lambda: get('/api/recommendations/?page_size=20')))
+
+    since = timezone.now() - datetime.timedelta(hours=ranking.option('VIEW_WINDOW_HOURS'))
+    on_the_fly = (
+        Video.objects.filter(view_rollups__hour__gte=since).annotate(recent=Sum('view_rollups__views'))
+        .annotate(hot=ExpressionWrapper(F('recent') + 5 * F('comment_count'), output_field=FloatField()))
+        .order_by('-hot', '-id').values_list('pk', flat=True)
+    )
+    report('views-only score in the query, page 1', *measure(lambda: list(on_the_fly[:20]), repeat=5))
+    report('  ... page 52', *measure(lambda: list(on_the_fly[1020:1040]), repeat=5))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+FTS5 search against icontains scanning over ROWS videos (default 1M).
+
+    ROWS=200000 python -m benchmarks.bench_search
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+import itertools
+import os
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from appapi import search
+from appapi.models import Video
+
+ROWS = int(os.environ.get('ROWS', 1_000_000))
+VOCABULARY = 20_000
+BATCH = 10_000
+
+
+def populate(user):
+    rng = random.Random(0)
+    # Zipf-like word frequencies, so some words are common and most are rare
+    words = [f'w{i}' for i in range(VOCABULARY)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(VOCABULARY)))
+    now = timezone.now().isoformat()
+    with connection.cursor() as cursor:
+        for start in range(0, ROWS, BATCH):
+            rows = []
+            for _ in range(min(BATCH, ROWS - start)):
+                title = ' '.join(rng.choices(words, cum_weights=cum_weights, k=4))[:40]
+                desc = ' '.join(rng.choices(words, cum_weights=cum_weights, k=12))[:100]
+                rows.append(('x.mp4', title, desc, user.pk, now, now))
+            cursor.executemany(
+                'INSERT INTO appapi_video (video, title, "desc", creator_id, created_at, updated_at, '
+                'fanout_on_read, comment_count, status, codec, content_hash, hls_manifest) '
+                "VALUES (%s, %s, %s, %s, %s, %s, 0, 0, 'ready', '', '', '')",
+                rows,
+            )
+
+
+def icontains(word):
+    return list(
+        Video.objects.filter(Q(title__icontains=word) | Q(desc__icontains=word))
+        .order_by('-id').values_list('pk', flat=True)[:20]
+    )
+
+
+def main():
+    user = User.objects.create_user(username='bench', password='bench')
+    start = time.perf_counter()
+    populate(user)
+    print(f'inserted {ROWS:,} videos in {time.perf_counter() - start:.1f} s')
+    start = time.perf_counter()
+    search.rebuild()
+    print(f'built the FTS5 index in {time.perf_counter() - start:.1f} s')
+
+    # a common word, a mid-frequency word, a word that matches nothing
+    for word in ('w0', 'w500', 'w19999x'):
+        report(f'fts5 "{word}"', *measure(lambda: search.search(word, 'video'), repeat=20))
+        report(f'icontains "{word}"', *measure(lambda: icontains(word), repeat=5))
+    report('fts5 "w1 w2"', *measure(lambda: search.search('w1 w2', 'video'), repeat=20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Serializing OBJECTS videos (default 10k) as the video list does: the
+VideoSerilaizer pass with all fields and with `?fields=id,title,
+comment_count`, then rendering the result to JSON and parsing it back
+with DRF's stdlib-based JSONRenderer/JSONParser against the
+orjson-backed FastJSONRenderer/FastJSONParser.
+
+The videos are loaded once up front, so no query is timed.
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+import io
+import os
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from appapi import fastjson
+from appapi.fastjson import FastJSONParser, FastJSONRenderer
+from appapi.models import Video
+from appapi.serializers import VideoSerilaizer
+
+OBJECTS = int(os.environ.get('OBJECTS', 10_000))
+
+
+def main():
+    user = User.objects.create_user(username='bench')
+    now = timezone.now()
+    Video.objects.bulk_create([
+        Video(video=f'videos/{i}.mp4', title=f'video {i}', desc='a description ' * 4, status=Video.READY,
+              creator=user, created_at=now, comment_count=i, view_count=i * 10)
+        for i in range(OBJECTS)
+    ], batch_size=2000)
+    videos = list(Video.objects.select_related('creator'))
+    print(f'{OBJECTS:,} videos, orjson {"installed" if fastjson.orjson else "missing"}')
+
+    factory = APIRequestFactory()
+    full = Request(factory.get('/api/videos/'))
+    sparse = Request(factory.get('/api/videos/', {'fields': 'id,title,comment_count'}))
+
+    def serialize(request):
+        return VideoSerilaizer(videos, many=True, context={'request': request}).data
+
+    report('serialize, all fields', *measure(lambda: serialize(full), repeat=5))
+    report('serialize, ?fields= (3 fields)', *measure(lambda: serialize(sparse), repeat=5))
+
+    data = serialize(full)
+    body = JSONRenderer().render(data)
+    assert FastJSONRenderer().render(data) == body
+    print(f'{len(body) / 1024:,.0f} KiB of JSON')
+    report('render, JSONRenderer', *measure(lambda: JSONRenderer().render(data), repeat=20))
+    report('render, FastJSONRenderer', *measure(lambda: FastJSONRenderer().render(data), repeat=20))
+    report('parse, JSONParser', *measure(lambda: JSONParser().parse(io.BytesIO(body)), repeat=20))
+    report('parse, FastJSONParser', *measure(lambda: FastJSONParser().parse(io.BytesIO(body)), repeat=20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Throughput of concurrent random seeks against serve_file, compared with
+re-downloading the whole file for every seek.
+"""
+
+from benchmarks.common import setup
+
+setup()
+
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import RequestFactory
+
+from appapi.streaming import serve_file
+
+FILE_SIZE = 64 * 1024 * 1024
+SEEK_LENGTH = 1024 * 1024
+REQUESTS = 400
+WORKERS = 16
+
+
+def fetch(path, range_header):
+    headers = {'HTTP_RANGE': range_header} if range_header else {}
+    response = serve_file(RequestFactory().get('/', **headers), path, 'bench.mp4')
+    size = sum(len(block) for block in response.streaming_content)
+    response.close()
+    return size
+
+
+def run(path, ranged):
+    rng = random.Random(0)
+    headers = []
+    for _ in range(REQUESTS):
+        start = rng.randrange(FILE_SIZE - SEEK_LENGTH)
+        headers.append(f'bytes={start}-{start + SEEK_LENGTH - 1}' if ranged else None)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(WORKERS) as pool:
+        transferred = sum(pool.map(lambda header: fetch(path, header), headers))
+    elapsed = time.perf_counter() - start
+    label = 'range seek' if ranged else 'whole file per seek'
+    print(f'{label:<22} {REQUESTS / elapsed:8.1f} seeks/s   {transferred / elapsed / 2**20:8.1f} MiB/s   '
+          f'{transferred / REQUESTS / 2**20:6.1f} MiB per seek')
+
+
+def main():
+    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as f:
+        f.write(os.urandom(FILE_SIZE))
+    try:
+        run(f.name, ranged=True)
+        run(f.name, ranged=False)
+    finally:
+        os.remove(f.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Comment reads on a video with COMMENTS comments (default 100k) in threads:
+video detail, the first page of top-level comments by newest and by top,
+and a whole 1,000-comment thread, read a level at a time by parent (one
+query per level) against one range of its materialized paths.
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+import os
+import random
+
+from django.contrib.auth.models import User
+from django.db import connection
+from rest_framework.test import APIClient
+
+from appapi import cache, threads
+from appapi.models import Comment, Video
+
+COMMENTS = int(os.environ.get('COMMENTS', 100_000))
+THREAD = 1000
+
+
+def populate(user, video):
+    """Threads of random shape; the first one has THREAD comments."""
+    rng = random.Random(0)
+    rows, sizes = [], [THREAD]
+    while sum(sizes) < COMMENTS:
+        sizes.append(rng.randint(1, 50))
+    pk = 0
+    for size in sizes:
+        thread = []
+        for _ in range(size):
+            pk += 1
+            parent = rng.choice(thread) if thread and rng.random() < 0.8 else (thread[0] if thread else None)
+            path = (parent.path if parent else '') + f'{pk:0{threads.PATH_WIDTH}d}/'
+            comment = Comment(
+                pk=pk, comment=f'comment {pk}', creator=user, the_video=video, parent=parent,
+                path=path, depth=parent.depth + 1 if parent else 0,
+            )
+            thread.append(comment)
+        for comment in thread:
+            if comment.parent:
+                comment.parent.reply_count += 1
+        rows += thread
+    Comment.objects.bulk_create(rows, batch_size=5000)
+    video.comment_count = len(rows)
+    video.save()
+    return rows[0]
+
+
+def by_levels(root):
+    """The thread read breadth first through the parent foreign key."""
+    found, level = [root], [root.pk]
+    while level:
+        level = list(Comment.objects.filter(parent_id__in=level).values_list('pk', flat=True))
+        found += level
+    return found
+
+
+def main():
+    user = User.objects.create_user(username='bench', password='bench')
+    video = Video.objects.create(video='x.mp4', title='popular', desc='', creator=user)
+    root = populate(user, video)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    def get(url):
+        # measure the database path, not the response cache
+        cache.bump(f'video:{video.pk}')
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+        return response
+
+    print(f'{COMMENTS:,} comments; video detail is {len(get(f"/api/videos/{video.pk}/").content):,} bytes')
+    report('video detail', *measure(lambda: get(f'/api/videos/{video.pk}/')))
+    report('top-level comments, newest', *measure(lambda: get(f'/api/videos/{video.pk}/comments/')))
+    report('top-level comments, top', *measure(lambda: get(f'/api/videos/{video.pk}/comments/?sort=top')))
+    assert len(by_levels(root)) == threads.subtree(root).count() == THREAD
+    report(f'{THREAD}-comment thread, level by level', *measure(lambda: by_levels(root)))
+    report(f'{THREAD}-comment thread, path range', *measure(lambda: list(threads.subtree(root).values_list('pk', flat=True))))
+    report('thread endpoint, first 100', *measure(lambda: get(f'/api/comments/{root.pk}/thread/?page_size=100')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Cost of admission control: one bucket take and one lease acquire/release
+in each store, a cached read endpoint with throttling off and on, and the
+SQLite store shared by PROCESSES processes (default 4) draining a single
+bucket, which must grant exactly its capacity.
+"""
+
+from benchmarks.common import measure, report, setup
+
+setup()
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from appapi import throttling
+
+PROCESSES = int(os.environ.get('PROCESSES', 4))
+CAPACITY = 20_000
+
+
+def per_call(label, func, count=20_000):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    print(f'{label:<40} {(time.perf_counter() - start) / count * 1e6:8.1f} us')
+
+
+def drain(path, counts):
+    store = throttling.SQLiteStore(path)
+    granted = 0
+    while True:
+        # no refill: the bucket only empties
+        ok, _ = store.take('shared', CAPACITY, 1e-9, time.time())
+        if not ok:
+            break
+        granted += 1
+    counts.put(granted)
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(prefix='bench-throttle-'), 'throttle.sqlite3')
+    stores = {'local': throttling.LocalStore(), 'sqlite': throttling.SQLiteStore(path)}
+    for name, store in stores.items():
+        per_call(f'take, {name} store', lambda i: store.take(f'read:user:{i % 1000}', 10**9, 1.0, time.time()))
+        per_call(f'acquire + release, {name} store',
+                 lambda i: store.release('upload:user:1', store.acquire('upload:user:1', 10, 600, time.time())))
+
+    user = User.objects.create_user(username='bench', password='bench')
+    client = APIClient()
+    client.force_authenticate(user=user)
+    base = dict(settings.THROTTLE, PATH=path, RATES={'read': '1000000000/min'})
+    # warm the response cache and the interpreter before comparing
+    settings.THROTTLE = dict(base, RATES={})
+    for _ in range(2000):
+        client.get('/api/videos/')
+    for label, config in (
+        ('GET /api/videos/, throttling off', dict(base, RATES={})),
+        ('GET /api/videos/, local store', dict(base, STORE='local')),
+        ('GET /api/videos/, sqlite store', dict(base, STORE='sqlite')),
+    ):
+        settings.THROTTLE = config
+        report(label, *measure(lambda: client.get('/api/videos/'), repeat=3000))
+
+    throttling.SQLiteStore(path).clear()
+    counts = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=drain, args=(path, counts)) for _ in range(PROCESSES)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    granted = sum(counts.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    assert granted == CAPACITY, granted
+    print(f'{"sqlite store, %d processes, one bucket" % PROCESSES:<40} {granted / elapsed:8,.0f} takes/s, '
+          f'{granted:,} granted of {CAPACITY:,}')
+
+
+if __name__ == '__main__':
+    main()
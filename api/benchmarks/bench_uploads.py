@@ -0,0 +1,49 @@
+"""
+Peak Python memory while writing one chunk of increasing size.
+"""
+
+from benchmarks.common import setup
+
+setup()
+
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+
+from appapi import uploads
+from appapi.models import UploadSession
+
+
+class ZeroStream:
+    """Stands in for the request stream without holding the body in memory."""
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        self.remaining -= size
+        return bytes(size)
+
+
+def main():
+    user = User.objects.create_user(username='bench', password='bench')
+    for megabytes in (16, 128, 512):
+        size = megabytes * 1024 * 1024
+        session = UploadSession.objects.create(creator=user, filename='big.mp4', title='big', desc='big', total_size=size)
+        uploads.create_partial(session)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        uploads.write_chunk(session, ZeroStream(size), 0, size)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        uploads.discard_partial(session)
+        print(f'{megabytes:>4} MiB chunk   peak {peak / 1024:8.1f} KiB   {megabytes / elapsed:8.1f} MiB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+View beacon ingestion against writing to the database once per view.
+
+Ingestion goes through the /api/views/ view in batches of BATCH beacons
+(default 100), in one process and in PROCESSES processes (default 4)
+appending to the same log; then one flush adds everything to the rollups.
+The baseline increments Video.view_count with an UPDATE per view.
+"""
+
+from benchmarks.common import setup
+
+setup()
+
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F
+from rest_framework.test import APIRequestFactory
+
+from appapi import analytics
+from appapi.models import Video, ViewRollup
+from appapi.views import ViewBeacons
+
+BATCH = int(os.environ.get('BATCH', 100))
+PROCESSES = int(os.environ.get('PROCESSES', 4))
+VIDEOS = 10_000
+SECONDS = 5
+
+
+def batches(seed, video_ids):
+    rng = random.Random(seed)
+    while True:
+        # views follow popularity: a few videos get most of them
+        yield [{'video': video_ids[min(int(rng.paretovariate(1.2)) - 1, VIDEOS - 1)], 'seconds': rng.uniform(0, 600)}
+               for _ in range(BATCH)]
+
+
+def ingest(seed, video_ids, seconds, counts):
+    view = ViewBeacons.as_view()
+    factory = APIRequestFactory()
+    bodies = [json.dumps(body) for body, _ in zip(batches(seed, video_ids), range(200))]
+    sent = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for body in bodies:
+            response = view(factory.post('/api/views/', body, content_type='application/json'))
+            assert response.status_code == 202
+            sent += BATCH
+    counts.put(sent)
+
+
+def run_ingest(processes, video_ids):
+    counts = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=ingest, args=(seed, video_ids, SECONDS, counts)) for seed in range(processes)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    sent = sum(counts.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    return sent, time.perf_counter() - start
+
+
+def main():
+    # every batch comes from one address: keep the per-viewer cap's cost but never reach it
+    settings.VIEW_EVENTS = {**settings.VIEW_EVENTS, 'LOG_DIR': tempfile.mkdtemp(prefix='bench-views-'),
+                            'MAX_VIEWS_PER_HOUR': 10 ** 12}
+    settings.THROTTLE = dict(settings.THROTTLE, RATES={})
+    user = User.objects.create_user(username='bench', password='bench')
+    videos = Video.objects.bulk_create(Video(video='x.mp4', title=f'video {i}', desc='', creator=user) for i in range(VIDEOS))
+    video_ids = [video.pk for video in videos]
+
+    total = 0
+    for processes in (1, PROCESSES):
+        sent, elapsed = run_ingest(processes, video_ids)
+        total += sent
+        print(f'{"ingest, %d process(es), batch %d" % (processes, BATCH):<40} {sent / elapsed:12,.0f} events/s')
+
+    start = time.perf_counter()
+    views, rows = analytics.flush()
+    elapsed = time.perf_counter() - start
+    assert views == total == sum(ViewRollup.objects.values_list('views', flat=True)), (views, total)
+    print(f'{"flush (%s events, %s rows)" % (f"{views:,}", f"{rows:,}"):<40} {views / elapsed:12,.0f} events/s   {elapsed:.2f} s')
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    count = 0
+    while time.perf_counter() - start < SECONDS:
+        Video.objects.filter(pk=rng.choice(video_ids)).update(view_count=F('view_count') + 1)
+        count += 1
+    print(f'{"UPDATE per view (baseline)":<40} {count / (time.perf_counter() - start):12,.0f} events/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Shared setup for the benchmark scripts.
+
+Run a benchmark from the `api/` directory, e.g.::
+
+    python -m benchmarks.bench_pagination
+
+Each script works on a throwaway test database and media root, so the
+project's db.sqlite3 and media/ are never touched.
+"""
+
+import os
+import statistics
+import tempfile
+import time
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    settings.MEDIA_ROOT = tempfile.mkdtemp(prefix='bench-media-')
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+
+def measure(func, repeat=50):
+    """Call `func` `repeat` times and return (median, p95) in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def report(label, median, p95):
+    print(f'{label:<40} median {median:8.3f} ms   p95 {p95:8.3f} ms')